@@ -18,6 +18,7 @@ from app.config import DATABASE_URL
 from app.models.source import Source
 from app.models.message import MessageQueue
 from app.models.post import Post, PostMedia
+from app.models.rewrite_cache import RewriteCacheEntry
 
 # Конфиг Alembic
 config = context.config
@@ -0,0 +1,55 @@
+"""NOTIFY trigger on sources
+
+Revision ID: 5f1c0e7a9b3d
+Revises: 2db633dd5a95
+Create Date: 2026-10-18 10:12:41.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f1c0e7a9b3d'
+down_revision: Union[str, None] = '2db633dd5a95'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Реестр источников в боте слушает канал sources_changed
+    op.execute("""
+        CREATE OR REPLACE FUNCTION notify_sources_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('sources_changed', json_build_object(
+                    'op', TG_OP,
+                    'chat_id', OLD.chat_id,
+                    'old_chat_id', OLD.chat_id,
+                    'is_active', false
+                )::text);
+                RETURN OLD;
+            END IF;
+
+            PERFORM pg_notify('sources_changed', json_build_object(
+                'op', TG_OP,
+                'chat_id', NEW.chat_id,
+                'old_chat_id', CASE WHEN TG_OP = 'UPDATE' THEN OLD.chat_id END,
+                'is_active', COALESCE(NEW.is_active, false)
+            )::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_sources_notify
+        AFTER INSERT OR DELETE OR UPDATE OF chat_id, is_active ON sources
+        FOR EACH ROW EXECUTE FUNCTION notify_sources_changed();
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_sources_notify ON sources")
+    op.execute("DROP FUNCTION IF EXISTS notify_sources_changed()")
@@ -0,0 +1,38 @@
+"""Claim leases for message_queue and posts
+
+Revision ID: 8a4e2d91c6f0
+Revises: 5f1c0e7a9b3d
+Create Date: 2026-10-18 12:40:05.902117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8a4e2d91c6f0'
+down_revision: Union[str, None] = '5f1c0e7a9b3d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('message_queue', sa.Column('claimed_by', sa.String(length=100), nullable=True))
+    op.add_column('message_queue', sa.Column('lease_until', sa.TIMESTAMP(), nullable=True))
+    op.create_index('idx_queue_processing_lease', 'message_queue', ['lease_until'], unique=False, postgresql_where=sa.text("rewrite_status = 'processing'"))
+
+    op.add_column('posts', sa.Column('claimed_by', sa.String(length=100), nullable=True))
+    op.add_column('posts', sa.Column('lease_until', sa.TIMESTAMP(), nullable=True))
+    op.create_index('idx_posts_posting_lease', 'posts', ['lease_until'], unique=False, postgresql_where=sa.text("status = 'posting'"))
+
+
+def downgrade() -> None:
+    op.drop_index('idx_posts_posting_lease', table_name='posts', postgresql_where=sa.text("status = 'posting'"))
+    op.drop_column('posts', 'lease_until')
+    op.drop_column('posts', 'claimed_by')
+
+    op.drop_index('idx_queue_processing_lease', table_name='message_queue', postgresql_where=sa.text("rewrite_status = 'processing'"))
+    op.drop_column('message_queue', 'lease_until')
+    op.drop_column('message_queue', 'claimed_by')
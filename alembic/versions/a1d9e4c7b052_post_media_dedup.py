@@ -0,0 +1,28 @@
+"""Media-level dedup: post_media lookup index and posts.media_duplicate_of
+
+Revision ID: a1d9e4c7b052
+Revises: f3a8d5c1e960
+Create Date: 2026-10-18 20:14:09.318240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a1d9e4c7b052'
+down_revision: Union[str, None] = 'f3a8d5c1e960'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('posts', sa.Column('media_duplicate_of', sa.BigInteger(), nullable=True))
+    op.create_index('idx_media_file', 'post_media', ['media_type', 'media_file_id'], unique=False, postgresql_where=sa.text('media_file_id IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('idx_media_file', table_name='post_media', postgresql_where=sa.text('media_file_id IS NOT NULL'))
+    op.drop_column('posts', 'media_duplicate_of')
@@ -0,0 +1,28 @@
+"""Partial indexes for the set-based post builder
+
+Revision ID: c3b7f05d2e18
+Revises: 8a4e2d91c6f0
+Create Date: 2026-10-18 14:05:52.117630
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3b7f05d2e18'
+down_revision: Union[str, None] = '8a4e2d91c6f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('idx_queue_unbuilt_grouped', 'message_queue', ['grouped_id'], unique=False, postgresql_where=sa.text('ready_to_post = false AND grouped_id IS NOT NULL'))
+    op.create_index('idx_queue_unbuilt_singles', 'message_queue', ['collected_at'], unique=False, postgresql_where=sa.text('ready_to_post = false AND grouped_id IS NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('idx_queue_unbuilt_singles', table_name='message_queue', postgresql_where=sa.text('ready_to_post = false AND grouped_id IS NULL'))
+    op.drop_index('idx_queue_unbuilt_grouped', table_name='message_queue', postgresql_where=sa.text('ready_to_post = false AND grouped_id IS NOT NULL'))
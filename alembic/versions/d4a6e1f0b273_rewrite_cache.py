@@ -0,0 +1,40 @@
+"""Rewrite cache table
+
+Revision ID: d4a6e1f0b273
+Revises: c3b7f05d2e18
+Create Date: 2026-10-18 16:22:08.540311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4a6e1f0b273'
+down_revision: Union[str, None] = 'c3b7f05d2e18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('rewrite_cache',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('provider', sa.String(length=50), nullable=False),
+    sa.Column('model', sa.String(length=200), nullable=False),
+    sa.Column('prompt_version', sa.String(length=20), nullable=False),
+    sa.Column('rewritten_text', sa.Text(), nullable=False),
+    sa.Column('input_tokens', sa.Integer(), nullable=True),
+    sa.Column('output_tokens', sa.Integer(), nullable=True),
+    sa.Column('hits', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('created_at', sa.TIMESTAMP(), server_default=sa.text('now()'), nullable=True),
+    sa.Column('last_hit_at', sa.TIMESTAMP(), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index('idx_rewrite_cache_created', 'rewrite_cache', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_rewrite_cache_created', table_name='rewrite_cache')
+    op.drop_table('rewrite_cache')
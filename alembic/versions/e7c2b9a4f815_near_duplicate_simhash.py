@@ -0,0 +1,30 @@
+"""Near-duplicate SimHash columns
+
+Revision ID: e7c2b9a4f815
+Revises: d4a6e1f0b273
+Create Date: 2026-10-18 17:48:31.205946
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7c2b9a4f815'
+down_revision: Union[str, None] = 'd4a6e1f0b273'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('message_queue', sa.Column('text_simhash', sa.BigInteger(), nullable=True))
+    op.add_column('message_queue', sa.Column('duplicate_of', sa.BigInteger(), nullable=True))
+    op.create_index('idx_queue_simhash_window', 'message_queue', ['collected_at'], unique=False, postgresql_where=sa.text('text_simhash IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('idx_queue_simhash_window', table_name='message_queue', postgresql_where=sa.text('text_simhash IS NOT NULL'))
+    op.drop_column('message_queue', 'duplicate_of')
+    op.drop_column('message_queue', 'text_simhash')
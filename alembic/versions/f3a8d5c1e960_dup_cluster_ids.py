@@ -0,0 +1,32 @@
+"""Duplicate cluster ids for the backlog dedup scan
+
+Revision ID: f3a8d5c1e960
+Revises: e7c2b9a4f815
+Create Date: 2026-10-18 19:03:47.661802
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3a8d5c1e960'
+down_revision: Union[str, None] = 'e7c2b9a4f815'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('message_queue', sa.Column('dup_cluster_id', sa.BigInteger(), nullable=True))
+    op.add_column('posts', sa.Column('dup_cluster_id', sa.BigInteger(), nullable=True))
+    op.create_index('idx_queue_dup_cluster', 'message_queue', ['dup_cluster_id'], unique=False, postgresql_where=sa.text('dup_cluster_id IS NOT NULL'))
+    op.create_index('idx_posts_dup_cluster', 'posts', ['dup_cluster_id'], unique=False, postgresql_where=sa.text('dup_cluster_id IS NOT NULL'))
+
+
+def downgrade() -> None:
+    op.drop_index('idx_posts_dup_cluster', table_name='posts', postgresql_where=sa.text('dup_cluster_id IS NOT NULL'))
+    op.drop_index('idx_queue_dup_cluster', table_name='message_queue', postgresql_where=sa.text('dup_cluster_id IS NOT NULL'))
+    op.drop_column('posts', 'dup_cluster_id')
+    op.drop_column('message_queue', 'dup_cluster_id')
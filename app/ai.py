@@ -1,9 +1,20 @@
+import asyncio
+import json
 import logging
+import re
 import time
-from openai import OpenAI
-from google import genai
+from typing import NamedTuple
 from app.config import (
-    AI_PROVIDER,
+    AI_PROVIDERS,
+    AI_HEDGE,
+    AI_FALLBACK,
+    AI_FALLBACK_WAIT,
+    AI_ROUTE_MAX_WAIT,
+    AI_ROUTE_SHORT,
+    AI_ROUTE_MEDIUM,
+    AI_ROUTE_LONG,
+    AI_ROUTE_ALBUM,
+    AI_EWMA_ALPHA,
     OPENROUTER_API_KEY,
     OPENROUTER_MODEL,
     DEEPSEEK_API_KEY,
@@ -11,195 +22,456 @@ from app.config import (
     GEMINI_API_KEY,
     GEMINI_MODEL,
 )
-from app.prompts import SYSTEM_PROMPT
+from app.ai_clients import client_pool
+from app.ai_router import AiRouter, HedgeBudget, Route, RoutesExhausted
+from app.fallback_rewriter import fallback_rewrite
+from app.prompt_assembly import (
+    BATCH_PREFIX,
+    REWRITE_PREFIX,
+    PromptPrefix,
+    gemini_cache,
+    openai_cached_tokens,
+    openai_messages,
+    record_usage,
+)
+from app import metrics
 
 logger = logging.getLogger(__name__)
 
-_PROVIDER = (AI_PROVIDER or "openrouter").strip().lower()
+_JSON_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
 
+_ALIASES = {"gemini": "google"}
 
-def _setup_keys():
-    """Определяем список ключей в зависимости от провайдера"""
-    if _PROVIDER == "google":
-        source = GEMINI_API_KEY
-    elif _PROVIDER == "deepseek":
-        source = DEEPSEEK_API_KEY
-    else:
-        source = OPENROUTER_API_KEY
+# провайдер → (ключи, модели, модель по умолчанию)
+_PROVIDER_SETTINGS = {
+    "openrouter": (OPENROUTER_API_KEY, OPENROUTER_MODEL, "anthropic/claude-3.5-sonnet"),
+    "deepseek": (DEEPSEEK_API_KEY, DEEPSEEK_MODEL, "deepseek-chat"),
+    "google": (GEMINI_API_KEY, GEMINI_MODEL, "gemini-1.5-flash"),
+}
 
-    if not source:
-        return []
-    return [k.strip() for k in source.split(",") if k.strip()]
 
-
-def _setup_models():
-    """Определяем список моделей в зависимости от провайдера"""
-    if _PROVIDER == "google":
-        source = GEMINI_MODEL or "gemini-1.5-flash"
-    elif _PROVIDER == "deepseek":
-        source = DEEPSEEK_MODEL or "deepseek-chat"
-    else:
-        source = OPENROUTER_MODEL or "anthropic/claude-3.5-sonnet"
-
-    if not source:
+def _split(value: str | None) -> list[str]:
+    if not value:
         return []
-    return [m.strip() for m in source.split(",") if m.strip()]
-
-
-_KEYS = _setup_keys()
-_MODELS = _setup_models()
-_current_key_idx = 0
-_current_model_idx = 0
-_failed_combinations = set()  # Храним проблемные пары (key_idx, model_idx)
+    return [item.strip() for item in value.split(",") if item.strip()]
+
+
+def _route_rule(value: str) -> frozenset[tuple[str, str]]:
+    """Правило маршрутизации "провайдер:модель,..." → {(провайдер, модель)}"""
+    rule = []
+    for item in _split(value):
+        provider, sep, model = item.partition(":")
+        provider = _ALIASES.get(provider.strip().lower(), provider.strip().lower())
+        if not sep or not model.strip() or provider not in _PROVIDER_SETTINGS:
+            logger.warning(f"⚠️ Правило маршрутизации '{item}' пропущено: нужно провайдер:модель")
+            continue
+        rule.append((provider, model.strip()))
+    return frozenset(rule)
+
+
+# Классы длины входа — как в SYSTEM_PROMPT (Output Examples: SHORT < 200, LONG > 500)
+SHORT_MAX_CHARS = 200
+LONG_MIN_CHARS = 500
+
+# класс поста → маршруты, которым он отдаётся предпочтительно (пусто — любые)
+_ROUTING = {
+    "album": _route_rule(AI_ROUTE_ALBUM),
+    "short": _route_rule(AI_ROUTE_SHORT),
+    "medium": _route_rule(AI_ROUTE_MEDIUM),
+    "long": _route_rule(AI_ROUTE_LONG),
+}
+
+
+def route_class(text: str, album: bool = False) -> str:
+    """Класс поста для правил маршрутизации: album (если для альбомов есть правило) или класс длины"""
+    if album and _ROUTING["album"]:
+        return "album"
+    if len(text) < SHORT_MAX_CHARS:
+        return "short"
+    if len(text) > LONG_MIN_CHARS:
+        return "long"
+    return "medium"
+
+
+def _setup_routes() -> list[Route]:
+    """
+    Матрица маршрутов ключ × модель по всем провайдерам из AI_PROVIDERS
+
+    Модели из правил маршрутизации (AI_ROUTE_*) добавляются к моделям провайдера
+    """
+    models = {}  # провайдер → модели (dict — порядок без повторов)
+    providers = dict.fromkeys(_ALIASES.get(p, p) for p in AI_PROVIDERS)
+    for provider in providers:
+        if provider not in _PROVIDER_SETTINGS:
+            logger.warning(f"⚠️ Неизвестный AI-провайдер '{provider}' пропущен")
+            continue
+        _, models_source, default_model = _PROVIDER_SETTINGS[provider]
+        models.setdefault(provider, {}).update(dict.fromkeys(_split(models_source or default_model)))
+
+    for rule in _ROUTING.values():
+        for provider, model in sorted(rule):
+            models.setdefault(provider, {})[model] = None
+
+    routes = []
+    for provider, provider_models in models.items():
+        keys = _split(_PROVIDER_SETTINGS[provider][0])
+        if not keys:
+            logger.warning(f"⚠️ API ключи для {provider} не настроены в .env")
+            continue
+
+        routes.extend(
+            Route(provider, key, key_idx, model)
+            for key_idx, key in enumerate(keys)
+            for model in provider_models
+        )
+    return routes
 
 
-def get_llm_client():
-    """Получаем клиента, используя текущий активный ключ"""
-    global _current_key_idx
+class OutputEstimate:
+    """
+    Ожидаемые выходные токены по длине входа (для тайм-аута запроса)
 
-    if not _KEYS:
-        raise RuntimeError(f"API ключи для {_PROVIDER} не настроены в .env")
+    Рерайт по промпту близок по длине ко входу (±30%) плюс стартовая и финальная
+    строки; токенов на символ входа — EWMA по фактическому usage
+    """
 
-    # Пропускаем проблемные ключи
-    attempts = 0
-    while attempts < len(_KEYS):
-        combo = (_current_key_idx, _current_model_idx)
-        if combo not in _failed_combinations:
-            break
-        _current_key_idx = (_current_key_idx + 1) % len(_KEYS)
-        attempts += 1
+    OVERHEAD_TOKENS = 60  # стартовая + финальная строки
+    DEFAULT_TOKENS_PER_CHAR = 0.35
 
-    if attempts >= len(_KEYS):
-        logger.warning("⚠️ Все комбинации ключ+модель исчерпаны, сбрасываем метки")
-        _failed_combinations.clear()
+    def __init__(self):
+        self.tokens_per_char = self.DEFAULT_TOKENS_PER_CHAR
 
-    current_key = _KEYS[_current_key_idx]
+    def expected(self, chars: int) -> float:
+        return self.OVERHEAD_TOKENS + self.tokens_per_char * chars
 
-    if _PROVIDER == "google":
-        return genai.Client(api_key=current_key)
+    def observe(self, chars: int, output_tokens: int | None):
+        if not chars or not output_tokens:
+            return
+        ratio = max(0, output_tokens - self.OVERHEAD_TOKENS) / chars
+        self.tokens_per_char += AI_EWMA_ALPHA * (ratio - self.tokens_per_char)
 
-    if _PROVIDER == "deepseek":
-        return OpenAI(api_key=current_key, base_url="https://api.deepseek.com")
 
-    return OpenAI(base_url="https://openrouter.ai/api/v1", api_key=current_key)
+router = AiRouter(_setup_routes())
+hedge_budget = HedgeBudget()
+output_estimate = OutputEstimate()
 
 
-def get_current_model():
-    """Получаем текущую активную модель"""
-    if not _MODELS:
-        raise RuntimeError(f"Модели для {_PROVIDER} не настроены в .env")
-    return _MODELS[_current_model_idx]
+class RewriteResult(NamedTuple):
+    """Результат рерайта: текст + чем он был сделан + сколько токенов стоил"""
+    text: str
+    provider: str | None
+    model: str | None
+    input_tokens: int | None = None
+    output_tokens: int | None = None
 
 
-def rotate_key(mark_failed=False):
-    """Ротация ключа API"""
-    global _current_key_idx
+def configured_models() -> list[tuple[str, str]]:
+    """Все (провайдер, модель), которыми может быть сделан рерайт"""
+    return list(dict.fromkeys((route.provider, route.model) for route in router.routes))
 
-    if mark_failed:
-        combo = (_current_key_idx, _current_model_idx)
-        _failed_combinations.add(combo)
-        logger.warning(
-            f"⚠️ Комбинация ключ №{_current_key_idx + 1} + модель '{_MODELS[_current_model_idx]}' помечена как исчерпанная"
-        )
 
-    if len(_KEYS) > 1:
-        old_idx = _current_key_idx
-        _current_key_idx = (_current_key_idx + 1) % len(_KEYS)
-        logger.warning(
-            f"🔄 {_PROVIDER}: Переключение ключа №{old_idx + 1} → №{_current_key_idx + 1}"
-        )
+def max_concurrency() -> int:
+    """Сколько запросов к AI может идти одновременно при текущих лимитах"""
+    return router.max_concurrency()
 
 
-def rotate_model(mark_failed=False):
-    """Ротация модели"""
-    global _current_model_idx
+def get_llm_client(route: Route):
+    """Async-клиент маршрута (один на ключ, из пула app.ai_clients)"""
+    return client_pool.get(route.provider, route.key)
 
-    if mark_failed:
-        combo = (_current_key_idx, _current_model_idx)
-        _failed_combinations.add(combo)
-        logger.warning(
-            f"⚠️ Комбинация ключ №{_current_key_idx + 1} + модель '{_MODELS[_current_model_idx]}' помечена как проблемная"
-        )
 
-    if len(_MODELS) > 1:
-        old_idx = _current_model_idx
-        _current_model_idx = (_current_model_idx + 1) % len(_MODELS)
-        logger.warning(
-            f"🔄 {_PROVIDER}: Переключение модели '{_MODELS[old_idx]}' → '{_MODELS[_current_model_idx]}'"
-        )
+async def _request(route: Route, text, prefix: PromptPrefix = REWRITE_PREFIX):
+    """
+    Один запрос к провайдеру по маршруту: (текст, входные токены, выходные токены)
 
+    Запрос собирается через app.prompt_assembly: неизменный префикс (кэш провайдера)
+    + текст поста; входные токены из кэша учитываются в метриках
+    """
+    client = get_llm_client(route)
 
-def rewrite_text(text, max_retries=6):
+    if route.provider == "google":
+        cached_content = await gemini_cache.handle(client, route.key, route.model, prefix)
+        if cached_content:
+            config = {'cached_content': cached_content}
+        else:
+            config = {'system_instruction': prefix.text}
+        try:
+            response = await client.aio.models.generate_content(
+                model=route.model,
+                config=config,
+                contents=str(text)
+            )
+        except Exception:
+            if cached_content:
+                gemini_cache.invalidate(route.key, route.model, prefix)
+            raise
+        usage = response.usage_metadata
+        if usage is None:
+            record_usage(route.provider, prefix, None, None)
+            return response.text, None, None
+        record_usage(route.provider, prefix, usage.prompt_token_count, usage.cached_content_token_count)
+        return response.text, usage.prompt_token_count, usage.candidates_token_count
+
+    # OpenAI-совместимые (DeepSeek, OpenRouter)
+    response = await client.chat.completions.create(
+        model=route.model,
+        messages=openai_messages(prefix, str(text), route.provider, route.model)
+    )
+    usage = response.usage
+    if usage is None:
+        record_usage(route.provider, prefix, None, None)
+        return response.choices[0].message.content, None, None
+    record_usage(route.provider, prefix, usage.prompt_tokens, openai_cached_tokens(usage))
+    return response.choices[0].message.content, usage.prompt_tokens, usage.completion_tokens
+
+
+async def _call(route: Route, text, prefix: PromptPrefix = REWRITE_PREFIX, expected_tokens=None):
+    """
+    Запрос по занятому маршруту с учётом результата в роутере
+
+    Маршрут освобождается в любом случае; отменённый запрос (проигравший hedge)
+    учитывается как нижняя оценка латентности, ошибка — как ошибка маршрута.
+    Тайм-аут — по ожидаемым выходным токенам и скорости маршрута (router.timeout)
+    """
+    if expected_tokens is None:
+        expected_tokens = output_estimate.expected(len(text))
+    timeout = router.timeout(route, expected_tokens)
+    started = time.perf_counter()
+    try:
+        logger.info(f"🤖 Запрос к {route.label} (тайм-аут {timeout:.0f} с)")
+        result = await asyncio.wait_for(_request(route, text, prefix), timeout)
+    except asyncio.CancelledError:
+        router.cancelled(route, (time.perf_counter() - started) * 1000)
+        raise
+    except Exception as e:
+        failure = router.failure(route, e)
+        logger.error(f"❌ Ошибка {route.label} [{failure.kind}]: {e}")
+        raise
+    else:
+        router.success(route, (time.perf_counter() - started) * 1000, result[2])
+        return result
+    finally:
+        await router.release(route)
+
+
+async def _hedged_call(route: Route, text, prefer=None):
+    """
+    Запрос с дублированием (AI_HEDGE)
+
+    Нет ответа дольше p90 маршрута — тот же текст уходит по другому свободному
+    маршруту (если позволяет бюджет), побеждает первый успешный ответ, второй
+    запрос отменяется. Возвращает (маршрут-победитель, результат)
+    """
+    metrics.inc('ai.hedge.requests')
+    hedge_budget.on_request()
+
+    primary = asyncio.create_task(_call(route, text))
+    tasks = {primary: route}
+    try:
+        done, _ = await asyncio.wait({primary}, timeout=router.hedge_delay(route))
+        if done:
+            return route, primary.result()
+
+        if not hedge_budget.try_spend():
+            metrics.inc('ai.hedge.budget_denied')
+            return route, await primary
+
+        alternate = router.try_acquire(exclude=(route,), prefer=prefer)
+        if alternate is None:
+            metrics.inc('ai.hedge.no_route')
+            return route, await primary
+
+        metrics.inc('ai.hedge.sent')
+        logger.info(f"🔀 Нет ответа от {route.label} — дублируем в {alternate.label}")
+        tasks[asyncio.create_task(_call(alternate, text))] = alternate
+
+        pending, error = set(tasks), None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                if task is not primary:
+                    metrics.inc('ai.hedge.won')
+                return tasks[task], task.result()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def rewrite_text_async(text, max_retries=6, album=False) -> RewriteResult:
+    """
+    Асинхронный рерайт текста
+
+    Каждая попытка получает от роутера самый быстрый здоровый маршрут
+    провайдер × ключ × модель (app.ai_router). Пауз между попытками нет:
+    упавший маршрут сам уходит на паузу/размыкается, следующая попытка
+    идёт по другому, а если здоровых не осталось — роутер ждёт ближайшего.
+    С AI_HEDGE=1 зависший запрос дублируется на другой маршрут (_hedged_call).
+    Маршруты сужаются правилом для класса поста (route_class: альбом или
+    длина текста), если оно задано в AI_ROUTE_*.
+
+    Если маршрутов нет или попытки кончились — с AI_FALLBACK=1 текст
+    переписывается локально (app/fallback_rewriter.py) за миллисекунды,
+    провайдер результата — 'fallback'.
+    """
     if not text:
-        return ""
+        return RewriteResult("", None, None)
 
-    attempt = 0
-    base_delay = 2
-    provider = (AI_PROVIDER or "openrouter").strip().lower()
+    cls = route_class(text, album)
+    prefer = _ROUTING.get(cls)
+    metrics.inc(f'ai.route_class.{cls}')
 
+    max_wait = AI_FALLBACK_WAIT if AI_FALLBACK else AI_ROUTE_MAX_WAIT
+    attempt = 0
     while attempt < max_retries:
         try:
-            client = get_llm_client()
-            model = get_current_model()
-
-            logger.info(
-                f"🤖 Запрос к {provider}: ключ №{_current_key_idx + 1}, модель '{model}'"
-            )
-
-            if provider == "google":
-                response = client.models.generate_content(
-                    model=model,
-                    config={'system_instruction': str(SYSTEM_PROMPT)},
-                    contents=str(text)
-                )
-                # Успех - снимаем метку с комбинации
-                _failed_combinations.discard((_current_key_idx, _current_model_idx))
-                return response.text
+            route = await router.acquire(max_wait=max_wait, prefer=prefer)
+        except RoutesExhausted as e:
+            logger.error(f"❌ {e}")
+            break
 
+        try:
+            if AI_HEDGE:
+                route, (rewritten, input_tokens, output_tokens) = await _hedged_call(route, text, prefer)
             else:
-                # OpenAI-совместимые (DeepSeek, OpenRouter)
-                messages = [
-                    {"role": "system", "content": str(SYSTEM_PROMPT)},
-                    {"role": "user", "content": str(text)}
-                ]
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=messages,
-                    timeout=45
-                )
-                # Успех - снимаем метку с комбинации
-                _failed_combinations.discard((_current_key_idx, _current_model_idx))
-                return response.choices[0].message.content
-
-        except Exception as e:
+                rewritten, input_tokens, output_tokens = await _call(route, text)
+        except Exception:
             attempt += 1
-            err_str = str(e).lower()
-
-            # Определяем тип ошибки
-            is_limit_error = any(x in err_str for x in ["429", "limit", "quota", "402", "exhausted"])
-            is_model_error = any(x in err_str for x in ["model", "not found", "invalid", "unsupported"])
-
-            logger.error(f"❌ Ошибка {provider} (попытка {attempt}/{max_retries}): {e}")
-
-            # Стратегия ротации:
-            if is_model_error:
-                # Проблема с моделью - пробуем другую модель
-                rotate_model(mark_failed=True)
-            elif is_limit_error:
-                # Лимиты - сначала пробуем другой ключ
-                rotate_key(mark_failed=True)
-                # Если ключи кончились, пробуем другую модель
-                if len(_KEYS) > 1 and attempt % len(_KEYS) == 0:
-                    rotate_model(mark_failed=False)
-            else:
-                # Другая ошибка - пробуем следующий ключ без метки
-                rotate_key(mark_failed=False)
+            logger.warning(f"⚠️ Попытка рерайта {attempt}/{max_retries} не удалась")
+            continue
+
+        if input_tokens is not None:
+            metrics.inc('ai.input_tokens', input_tokens)
+        if output_tokens is not None:
+            metrics.inc('ai.output_tokens', output_tokens)
+        output_estimate.observe(len(text), output_tokens)
+        return RewriteResult(rewritten, route.provider, route.model, input_tokens, output_tokens)
+
+    if AI_FALLBACK:
+        logger.warning("🛟 AI недоступен — локальный рерайт по правилам промпта")
+        return RewriteResult(fallback_rewrite(text), 'fallback', None)
+
+    return RewriteResult(f"**[Ошибка рерайта после {max_retries} попыток]**\n\n{text}", None, None)
+
+
+def _parse_batch(raw: str | None, count: int) -> list[str | None]:
+    """
+    Разбор ответа пакетного рерайта: тексты по id входа
+
+    Элемент без текста, с чужим или повторным id — None (будет переписан поодиночке);
+    невалидный JSON целиком — все None
+    """
+    texts = [None] * count
+    try:
+        items = json.loads(_JSON_FENCE.sub('', (raw or '').strip()))
+    except ValueError:
+        return texts
+    if not isinstance(items, list):
+        return texts
+
+    seen = set()
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        idx, text = item.get('id'), item.get('text')
+        if type(idx) is not int or not 0 <= idx < count:
+            continue
+        if idx in seen:
+            texts[idx] = None  # два ответа на один пост — не доверяем ни одному
+            continue
+        seen.add(idx)
+        if isinstance(text, str) and text.strip():
+            texts[idx] = text.strip()
+    return texts
+
+
+def _share(total: int | None, part: int, whole: int) -> int | None:
+    """Доля токенов пакета, приходящаяся на один пост (пропорционально длине)"""
+    if total is None or whole <= 0:
+        return None
+    return round(total * part / whole)
+
+
+async def rewrite_batch_async(texts: list[str], album=False) -> list[RewriteResult | None]:
+    """
+    Пакетный рерайт коротких текстов одним запросом
+
+    Тексты уходят JSON-массивом [{"id", "text"}] с BATCH_PREFIX, ответ —
+    такой же массив. Одна попытка без hedging (латентность пакета несравнима
+    с одиночной): если запрос упал или маршрутов нет — все элементы None,
+    невалидные элементы ответа — None; их вызывающий переписывает через
+    rewrite_text_async. Токены делятся между постами пропорционально длине.
+    Правило маршрутизации — по самому длинному тексту пакета
+    """
+    if not texts:
+        return []
+    count = len(texts)
+    metrics.inc('ai.batch.requests')
+    metrics.inc('ai.batch.items', count)
+
+    payload = json.dumps(
+        [{"id": idx, "text": text} for idx, text in enumerate(texts)],
+        ensure_ascii=False
+    )
+    try:
+        route = await router.acquire(
+            max_wait=AI_FALLBACK_WAIT if AI_FALLBACK else AI_ROUTE_MAX_WAIT,
+            prefer=_ROUTING.get(route_class(max(texts, key=len), album)),
+        )
+        raw, input_tokens, output_tokens = await _call(
+            route, payload, BATCH_PREFIX,
+            expected_tokens=sum(output_estimate.expected(len(text)) for text in texts),
+        )
+    except Exception as e:
+        metrics.inc('ai.batch.failed')
+        logger.warning(f"⚠️ Пакетный рерайт ({count} шт.) не удался, перепишем поодиночке: {e}")
+        return [None] * count
+
+    if input_tokens is not None:
+        metrics.inc('ai.input_tokens', input_tokens)
+    if output_tokens is not None:
+        metrics.inc('ai.output_tokens', output_tokens)
+
+    rewritten = _parse_batch(raw, count)
+    invalid = sum(text is None for text in rewritten)
+    if invalid:
+        metrics.inc('ai.batch.invalid', invalid)
+        logger.warning(f"⚠️ Пакетный рерайт: {invalid} из {count} элементов ответа невалидны")
+
+    chars_in = sum(len(text) for text in texts)
+    chars_out = sum(len(text) for text in rewritten if text is not None)
+    return [
+        None if text is None else RewriteResult(
+            text, route.provider, route.model,
+            _share(input_tokens, len(source), chars_in),
+            _share(output_tokens, len(text), chars_out),
+        )
+        for source, text in zip(texts, rewritten)
+    ]
 
-            if attempt < max_retries:
-                delay = base_delay * (2 ** (attempt - 1))
-                logger.info(f"⏳ Ожидание {delay}с перед повтором...")
-                time.sleep(delay)
-            else:
-                return f"**[Ошибка рерайта после {max_retries} попыток]**\n\n{text}"
 
-    return text
\ No newline at end of file
+def rewrite_text(text, max_retries=6):
+    """
+    Синхронная обёртка над rewrite_text_async (только для скриптов)
+
+    Каждый вызов — свой asyncio.run, поэтому всё, что привязано к event loop,
+    живёт только в пределах вызова: HTTP-клиенты закрываются, Condition роутера
+    и Lock'и кэша промпта пересоздаются. Здоровье маршрутов сохраняется.
+
+    Нельзя вызывать из работающего event loop — там используйте rewrite_text_async
+    """
+    async def run():
+        try:
+            return await rewrite_text_async(text, max_retries=max_retries)
+        finally:
+            await client_pool.close()
+
+    try:
+        return asyncio.run(run()).text
+    finally:
+        router.reset_loop_state()
+        gemini_cache.reset_loop_state()
@@ -0,0 +1,168 @@
+"""
+Пул HTTP-клиентов AI-провайдеров
+
+Один долгоживущий клиент на пару (провайдер, ключ): соединения переиспользуются
+(keep-alive, HTTP/2, TLS-сессии), вместо нового рукопожатия на каждую попытку.
+
+Повторы внутри SDK выключены: повторяет только роутер (app/ai_router.py),
+иначе он видел бы один медленный вызов вместо нескольких ошибок — Retry-After,
+счётчики breaker'а и EWMA латентности считались бы неверно.
+
+Метрики (по провайдеру):
+- ai.http.<provider>.connections_new / .connections_reused — открыто новое соединение или взято из пула
+- ai.http.<provider>.connect_ms — TCP + TLS для новых соединений
+- ai.http.<provider>.ttfb_ms — от отправки запроса до заголовков ответа
+- ai.http.<provider>.http2 / .http1 — версия протокола ответов
+"""
+import logging
+import time
+
+import httpx
+from openai import AsyncOpenAI
+from google import genai
+from google.genai import types as genai_types
+
+from app.config import (
+    AI_HTTP2,
+    AI_TIMEOUT,
+    AI_ADAPTIVE_TIMEOUT,
+    AI_TIMEOUT_MAX,
+    AI_CONNECT_TIMEOUT,
+    AI_POOL_MAX_CONNECTIONS,
+    AI_POOL_MAX_KEEPALIVE,
+    AI_KEEPALIVE_EXPIRY,
+    OPENROUTER_BASE_URL,
+    DEEPSEEK_BASE_URL,
+)
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+BASE_URLS = {
+    "openrouter": OPENROUTER_BASE_URL or "https://openrouter.ai/api/v1",
+    "deepseek": DEEPSEEK_BASE_URL or "https://api.deepseek.com",
+}
+
+# Тайм-аут запроса задаёт app.ai (адаптивный) — клиенту нужен потолок, а не типичное значение
+_REQUEST_TIMEOUT = max(AI_TIMEOUT, AI_TIMEOUT_MAX) if AI_ADAPTIVE_TIMEOUT else AI_TIMEOUT
+
+try:
+    import h2  # noqa: F401  (нужен httpx для HTTP/2)
+    _HTTP2 = AI_HTTP2
+except ImportError:
+    _HTTP2 = False
+    if AI_HTTP2:
+        logger.warning("⚠️ Пакет h2 не установлен — клиенты AI работают по HTTP/1.1 (pip install httpx[http2])")
+
+
+class _RequestTrace:
+    """
+    Трассировка одного запроса (httpcore extensions["trace"])
+
+    Новое соединение видно по событиям connection.connect_tcp / start_tls;
+    если их не было — соединение взято из пула
+    """
+
+    __slots__ = ('provider', 'connect_started', 'connect_ms', 'headers_sent')
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.connect_started = None
+        self.connect_ms = None
+        self.headers_sent = None
+
+    async def __call__(self, event: str, info: dict):
+        now = time.perf_counter()
+
+        if event == 'connection.connect_tcp.started':
+            self.connect_started = now
+        elif event.startswith('connection.') and event.endswith('.complete') and self.connect_started:
+            self.connect_ms = (now - self.connect_started) * 1000
+        elif event.endswith('send_request_headers.started'):
+            self.headers_sent = now
+        elif event.endswith('receive_response_headers.complete') and self.headers_sent:
+            prefix = f'ai.http.{self.provider}'
+            if self.connect_ms is None:
+                metrics.inc(f'{prefix}.connections_reused')
+            else:
+                metrics.inc(f'{prefix}.connections_new')
+                metrics.observe(f'{prefix}.connect_ms', self.connect_ms)
+            metrics.observe(f'{prefix}.ttfb_ms', (now - self.headers_sent) * 1000)
+
+
+def _http_client(provider: str) -> httpx.AsyncClient:
+    """httpx-клиент с лимитами пула, тайм-аутами и трассировкой"""
+
+    async def on_request(request: httpx.Request):
+        request.extensions['trace'] = _RequestTrace(provider)
+
+    async def on_response(response: httpx.Response):
+        version = 'http2' if response.http_version == 'HTTP/2' else 'http1'
+        metrics.inc(f'ai.http.{provider}.{version}')
+
+    return httpx.AsyncClient(
+        http2=_HTTP2,
+        limits=httpx.Limits(
+            max_connections=AI_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=AI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=AI_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(_REQUEST_TIMEOUT, connect=AI_CONNECT_TIMEOUT),
+        event_hooks={'request': [on_request], 'response': [on_response]},
+    )
+
+
+class ClientPool:
+    """
+    Клиенты SDK по ключу (провайдер, API-ключ)
+
+    Клиент создаётся при первом запросе и живёт до close() (остановка бота)
+    """
+
+    def __init__(self):
+        self._clients = {}  # (provider, key) → (клиент SDK, httpx.AsyncClient)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, provider: str, key: str):
+        """Клиент SDK провайдера для ключа"""
+        entry = self._clients.get((provider, key))
+        if entry is None:
+            entry = self._clients[(provider, key)] = self._create(provider, key)
+        return entry[0]
+
+    def _create(self, provider: str, key: str):
+        http = _http_client(provider)
+
+        if provider == "google":
+            client = genai.Client(
+                api_key=key,
+                http_options=genai_types.HttpOptions(
+                    httpx_async_client=http,
+                    timeout=int(_REQUEST_TIMEOUT * 1000),  # мс
+                    retry_options=genai_types.HttpRetryOptions(attempts=1),  # повторы — только роутер
+                ),
+            )
+        else:
+            base_url = BASE_URLS.get(provider, BASE_URLS["openrouter"])
+            # Свои повторы SDK (429/5xx с backoff) спрятали бы ошибки от роутера
+            client = AsyncOpenAI(api_key=key, base_url=base_url, http_client=http, max_retries=0)
+
+        logger.info(f"🔌 HTTP-клиент {provider} создан (всего {len(self._clients) + 1}, http2={_HTTP2})")
+        return client, http
+
+    async def close(self):
+        """Закрывает все соединения"""
+        for _, http in self._clients.values():
+            try:
+                await http.aclose()
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка закрытия HTTP-клиента: {e}")
+        count = len(self._clients)
+        self._clients.clear()
+        if count:
+            logger.info(f"✅ HTTP-клиенты AI закрыты ({count})")
+
+
+client_pool = ClientPool()
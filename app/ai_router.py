@@ -0,0 +1,497 @@
+"""
+Роутер запросов к AI: выбор маршрута провайдер × ключ × модель по здоровью
+
+Для каждого маршрута хранится:
+- EWMA латентности успешных запросов и EWMA доли ошибок
+- пауза (кулдаун): после 429 — по Retry-After, после прочих ошибок —
+  AI_RETRY_BACKOFF × 2^(ошибок подряд - 1)
+- circuit breaker: AI_BREAKER_THRESHOLD ошибок подряд размыкают маршрут
+  на AI_BREAKER_COOLDOWN (удваивается при повторных размыканиях),
+  затем один пробный запрос (half-open) — успех замыкает, ошибка размыкает снова.
+  401/402/403 размыкают все маршруты ключа, 404 — маршрут, сразу на максимум
+
+Запрос получает самый быстрый здоровый маршрут с учётом загрузки.
+Если все маршруты на паузе — acquire() ждёт ближайшего освобождения,
+но не дольше AI_ROUTE_MAX_WAIT, без сброса меток. Если ни одна пауза не кончится
+за это время (например, разомкнуты все breaker'ы) — RoutesExhausted сразу.
+Правило маршрутизации (prefer — набор провайдер × модель) сужает выбор,
+пока среди его маршрутов есть здоровые; иначе берётся любой маршрут.
+
+Тайм-аут запроса (timeout()) — ожидаемые выходные токены × EWMA мс на
+выходной токен маршрута × AI_TIMEOUT_FACTOR.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import NamedTuple
+
+import httpx
+import openai
+from google.genai import errors as genai_errors
+
+from app.config import (
+    AI_MAX_CONCURRENCY_PER_KEY,
+    AI_MAX_CONCURRENCY_PER_MODEL,
+    AI_EWMA_ALPHA,
+    AI_RETRY_BACKOFF,
+    AI_RATE_LIMIT_COOLDOWN,
+    AI_BREAKER_THRESHOLD,
+    AI_BREAKER_COOLDOWN,
+    AI_BREAKER_MAX_COOLDOWN,
+    AI_ROUTE_MAX_WAIT,
+    AI_TIMEOUT,
+    AI_ADAPTIVE_TIMEOUT,
+    AI_TIMEOUT_FACTOR,
+    AI_TIMEOUT_MIN,
+    AI_TIMEOUT_MAX,
+    AI_HEDGE_PERCENTILE,
+    AI_HEDGE_MIN_SAMPLES,
+    AI_HEDGE_DEFAULT_DELAY,
+    AI_HEDGE_MIN_DELAY,
+    AI_HEDGE_BUDGET,
+    AI_HEDGE_BURST,
+)
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+# Классы ошибок
+RATE_LIMIT = 'rate_limit'  # 429 — пауза по Retry-After
+QUOTA = 'quota'            # 402 — кончились деньги/квота ключа
+AUTH = 'auth'              # 401/403 — ключ недействителен
+NOT_FOUND = 'not_found'    # 404 — модели нет у провайдера
+TIMEOUT = 'timeout'
+NETWORK = 'network'
+SERVER = 'server'          # 5xx
+BAD_REQUEST = 'bad_request'
+UNKNOWN = 'unknown'
+
+_KEY_WIDE = (QUOTA, AUTH)
+_LATENCY_WINDOW = 200  # последних латентностей маршрута для перцентилей
+_COLD_TIMEOUT_TOKENS = 400  # выходных токенов, на которые рассчитан AI_TIMEOUT (пока нет наблюдений)
+
+
+class RoutesExhausted(Exception):
+    """Все маршруты на паузе дольше допустимого ожидания"""
+
+
+class Failure(NamedTuple):
+    kind: str
+    retry_after: float | None = None
+
+
+@dataclass(slots=True, eq=False)
+class Route:
+    """Маршрут провайдер × ключ × модель и его здоровье"""
+    provider: str
+    key: str
+    key_idx: int  # номер ключа у провайдера (для логов, сам ключ не логируем)
+    model: str
+
+    latency_ewma: float | None = None  # мс
+    ms_per_token: float | None = None  # EWMA латентности на выходной токен
+    error_ewma: float = 0.0
+    failures: int = 0  # ошибок подряд
+    cooldown_until: float = 0.0  # time.monotonic()
+    state: str = CLOSED
+    opens: int = 0  # размыканий подряд (для удвоения паузы)
+    inflight: int = 0
+    requests: int = 0
+    errors: dict = field(default_factory=dict)  # класс ошибки → количество
+    latencies: deque = field(default_factory=lambda: deque(maxlen=_LATENCY_WINDOW))  # мс
+
+    @property
+    def label(self) -> str:
+        return f"{self.provider} ключ №{self.key_idx + 1} '{self.model}'"
+
+    def percentile(self, q: float) -> float | None:
+        """q-й перцентиль латентности за окно (мс), None — окно пусто"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+# ============================================
+# КЛАССИФИКАЦИЯ ОШИБОК
+# ============================================
+
+def _status_code(error: Exception) -> int | None:
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code
+    if isinstance(error, genai_errors.APIError):
+        return error.code
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code
+    return None
+
+
+def _retry_after(error: Exception) -> float | None:
+    """Секунды из Retry-After (заголовок или RetryInfo в теле ответа Gemini)"""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    value = headers.get('retry-after') if headers is not None else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        for item in details.get('error', {}).get('details', []) or []:
+            delay = item.get('retryDelay') if isinstance(item, dict) else None
+            if isinstance(delay, str) and delay.endswith('s'):
+                try:
+                    return float(delay[:-1])
+                except ValueError:
+                    pass
+    return None
+
+
+def classify_error(error: BaseException) -> Failure:
+    """Класс ошибки провайдера по типу исключения и HTTP-статусу"""
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException, openai.APITimeoutError)):
+        return Failure(TIMEOUT)
+
+    status = _status_code(error)
+    if status is None:
+        if isinstance(error, (httpx.TransportError, openai.APIConnectionError, ConnectionError)):
+            return Failure(NETWORK)
+        return Failure(UNKNOWN)
+
+    if status == 429:
+        return Failure(RATE_LIMIT, _retry_after(error))
+    if status == 402:
+        return Failure(QUOTA)
+    if status in (401, 403):
+        return Failure(AUTH)
+    if status == 404:
+        return Failure(NOT_FOUND)
+    if status in (408, 504):
+        return Failure(TIMEOUT)
+    if status >= 500:
+        return Failure(SERVER, _retry_after(error))
+    return Failure(BAD_REQUEST)
+
+
+# ============================================
+# РОУТЕР
+# ============================================
+
+class AiRouter:
+    """Выбор маршрута и учёт его здоровья (один экземпляр на процесс)"""
+
+    def __init__(self, routes: list[Route]):
+        self.routes = routes
+        self._key_inflight = {}  # (provider, key) → запросов в полёте
+        self._model_inflight = {}  # (provider, model) → запросов в полёте
+        self._capacity = asyncio.Condition()
+        self._cursor = 0  # ротация при равных оценках
+
+    def __len__(self):
+        return len(self.routes)
+
+    def reset_loop_state(self):
+        """Новый asyncio.Condition: старый привязан к завершённому event loop (asyncio.run в скриптах)"""
+        self._capacity = asyncio.Condition()
+
+    def max_concurrency(self) -> int:
+        """Сколько запросов может идти одновременно при текущих лимитах"""
+        keys = {(r.provider, r.key) for r in self.routes}
+        models = {(r.provider, r.model) for r in self.routes}
+        by_keys = len(keys) * AI_MAX_CONCURRENCY_PER_KEY
+        by_models = len(models) * AI_MAX_CONCURRENCY_PER_MODEL
+        return max(1, min(by_keys, by_models))
+
+    # --------------------------------------------
+    # Выбор маршрута
+    # --------------------------------------------
+
+    def _healthy(self, route: Route, now: float) -> bool:
+        if route.cooldown_until > now:
+            return False
+        # После паузы разомкнутый маршрут пропускает ровно один пробный запрос
+        if route.state != CLOSED and route.inflight > 0:
+            return False
+        return True
+
+    def _has_capacity(self, route: Route) -> bool:
+        if self._key_inflight.get((route.provider, route.key), 0) >= AI_MAX_CONCURRENCY_PER_KEY:
+            return False
+        if self._model_inflight.get((route.provider, route.model), 0) >= AI_MAX_CONCURRENCY_PER_MODEL:
+            return False
+        return True
+
+    @staticmethod
+    def _score(route: Route) -> float:
+        """Ожидаемая задержка: EWMA латентности × штраф за ошибки × загрузка"""
+        if route.latency_ewma is None:
+            return 0.0  # ещё не пробовали — пробуем первым
+        return route.latency_ewma * (1 + 4 * route.error_ewma) * (1 + route.inflight)
+
+    def _pick(self, now: float, exclude=(), prefer=None) -> tuple[Route | None, bool]:
+        """
+        (лучший свободный маршрут, есть ли здоровые маршруты вообще)
+
+        prefer — набор (провайдер, модель) из правила маршрутизации: пока среди
+        них есть здоровые, выбор только из них (заняты — ждём их слота)
+        """
+        if prefer:
+            route, any_healthy = self._pick_from(now, exclude, prefer)
+            if any_healthy:
+                return route, True
+        return self._pick_from(now, exclude, None)
+
+    def _pick_from(self, now: float, exclude, prefer) -> tuple[Route | None, bool]:
+        best, best_score, any_healthy = None, None, False
+        total = len(self.routes)
+        for offset in range(total):
+            route = self.routes[(self._cursor + offset) % total]
+            if route in exclude or not self._healthy(route, now):
+                continue
+            if prefer and (route.provider, route.model) not in prefer:
+                continue
+            any_healthy = True
+            if not self._has_capacity(route):
+                continue
+            score = self._score(route)
+            if best is None or score < best_score:
+                best, best_score = route, score
+
+        if best is not None:
+            self._cursor = (self._cursor + 1) % total
+        return best, any_healthy
+
+    def _next_ready(self, now: float) -> float | None:
+        """Секунд до конца ближайшей паузы"""
+        pending = [r.cooldown_until - now for r in self.routes if r.cooldown_until > now]
+        return min(pending) if pending else None
+
+    def _take(self, route: Route):
+        route.inflight += 1
+        route.requests += 1
+        if route.state == OPEN:
+            route.state = HALF_OPEN
+            logger.info(f"🔎 Пробный запрос: {route.label}")
+        key = (route.provider, route.key)
+        model = (route.provider, route.model)
+        self._key_inflight[key] = self._key_inflight.get(key, 0) + 1
+        self._model_inflight[model] = self._model_inflight.get(model, 0) + 1
+
+    async def acquire(self, max_wait: float = AI_ROUTE_MAX_WAIT, exclude=(), prefer=None) -> Route:
+        """
+        Занимает лучший маршрут
+
+        Маршруты заняты (лимиты) — ждёт освобождения слота.
+        Все на паузе — ждёт ближайшего освобождения (короткий backoff после ошибки);
+        если оно позже max_wait — RoutesExhausted без ожидания.
+        """
+        if not self.routes:
+            raise RuntimeError("AI-провайдеры не настроены: нет ключей или моделей в .env")
+
+        deadline = time.monotonic() + max_wait
+        async with self._capacity:
+            while True:
+                now = time.monotonic()
+                route, any_healthy = self._pick(now, exclude, prefer)
+                if route is not None:
+                    self._take(route)
+                    return route
+
+                timeout = self._next_ready(now)
+                if not any_healthy:
+                    # Ждать бессмысленно, если ни один маршрут не освободится до дедлайна
+                    if timeout is None or timeout > deadline - now:
+                        metrics.inc('ai.router.exhausted')
+                        raise RoutesExhausted("Все маршруты AI на паузе или разомкнуты")
+
+                try:
+                    await asyncio.wait_for(self._capacity.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    def try_acquire(self, exclude=(), prefer=None) -> Route | None:
+        """Занимает лучший маршрут, если он свободен прямо сейчас (без ожидания)"""
+        route, _ = self._pick(time.monotonic(), exclude, prefer)
+        if route is not None:
+            self._take(route)
+        return route
+
+    async def release(self, route: Route):
+        """Освобождает слот маршрута"""
+        async with self._capacity:
+            route.inflight -= 1
+            self._key_inflight[(route.provider, route.key)] -= 1
+            self._model_inflight[(route.provider, route.model)] -= 1
+            self._capacity.notify_all()
+
+    # --------------------------------------------
+    # Учёт результатов
+    # --------------------------------------------
+
+    def success(self, route: Route, latency_ms: float, output_tokens: int | None = None):
+        """Успешный ответ: обновляет EWMA (латентность, мс на токен) и замыкает breaker"""
+        self._observe_latency(route, latency_ms)
+        if output_tokens:
+            per_token = latency_ms / output_tokens
+            if route.ms_per_token is None:
+                route.ms_per_token = per_token
+            else:
+                route.ms_per_token += AI_EWMA_ALPHA * (per_token - route.ms_per_token)
+        route.error_ewma *= 1 - AI_EWMA_ALPHA
+        route.failures = 0
+
+        if route.state != CLOSED:
+            logger.info(f"✅ Маршрут снова в строю: {route.label}")
+        route.state = CLOSED
+        route.opens = 0
+
+        metrics.observe(f'ai.latency_ms.{route.provider}', latency_ms)
+
+    def cancelled(self, route: Route, elapsed_ms: float):
+        """
+        Запрос отменён (проиграл hedge): ответ был бы не раньше elapsed_ms
+
+        Учитывается в латентности как нижняя оценка — иначе зависающий
+        маршрут выглядел бы быстрым, ведь его медленные ответы не доживают до конца
+        """
+        if route.latency_ewma is None or elapsed_ms > route.latency_ewma:
+            self._observe_latency(route, elapsed_ms)
+
+    @staticmethod
+    def _observe_latency(route: Route, latency_ms: float):
+        if route.latency_ewma is None:
+            route.latency_ewma = latency_ms
+        else:
+            route.latency_ewma += AI_EWMA_ALPHA * (latency_ms - route.latency_ewma)
+        route.latencies.append(latency_ms)
+
+    @staticmethod
+    def hedge_delay(route: Route) -> float:
+        """Через сколько секунд без ответа дублировать запрос (p90 маршрута)"""
+        if len(route.latencies) < AI_HEDGE_MIN_SAMPLES:
+            return AI_HEDGE_DEFAULT_DELAY
+        return max(AI_HEDGE_MIN_DELAY, route.percentile(AI_HEDGE_PERCENTILE) / 1000)
+
+    @staticmethod
+    def timeout(route: Route, expected_tokens: float) -> float:
+        """
+        Тайм-аут запроса по маршруту (сек) для ожидаемого числа выходных токенов
+
+        Без наблюдений — AI_TIMEOUT, растущий для ответов длиннее _COLD_TIMEOUT_TOKENS
+        """
+        if not AI_ADAPTIVE_TIMEOUT:
+            return AI_TIMEOUT
+        if route.ms_per_token is None:
+            seconds = AI_TIMEOUT * max(1.0, expected_tokens / _COLD_TIMEOUT_TOKENS)
+        else:
+            seconds = AI_TIMEOUT_FACTOR * route.ms_per_token * expected_tokens / 1000
+        return min(AI_TIMEOUT_MAX, max(AI_TIMEOUT_MIN, seconds))
+
+    def failure(self, route: Route, error: BaseException) -> Failure:
+        """Ошибка запроса: пауза маршрута, при необходимости — размыкание"""
+        failure = classify_error(error)
+        now = time.monotonic()
+
+        route.error_ewma += AI_EWMA_ALPHA * (1 - route.error_ewma)
+        route.failures += 1
+        route.errors[failure.kind] = route.errors.get(failure.kind, 0) + 1
+        metrics.inc(f'ai.errors.{route.provider}.{failure.kind}')
+
+        if failure.kind in _KEY_WIDE:
+            for other in self.routes:
+                if other.provider == route.provider and other.key == route.key:
+                    self._open(other, now, AI_BREAKER_MAX_COOLDOWN, failure.kind)
+        elif failure.kind == NOT_FOUND:
+            self._open(route, now, AI_BREAKER_MAX_COOLDOWN, failure.kind)
+        elif route.state != CLOSED or route.failures >= AI_BREAKER_THRESHOLD:
+            cooldown = min(AI_BREAKER_COOLDOWN * 2 ** route.opens, AI_BREAKER_MAX_COOLDOWN)
+            self._open(route, now, max(cooldown, failure.retry_after or 0), failure.kind)
+        elif failure.kind == RATE_LIMIT:
+            pause = failure.retry_after if failure.retry_after is not None else AI_RATE_LIMIT_COOLDOWN
+            route.cooldown_until = max(route.cooldown_until, now + pause)
+            metrics.inc('ai.router.rate_limited')
+            logger.warning(f"⏸ {route.label}: 429, пауза {pause:.0f}с")
+        else:
+            pause = max(AI_RETRY_BACKOFF * 2 ** (route.failures - 1), failure.retry_after or 0)
+            route.cooldown_until = max(route.cooldown_until, now + pause)
+
+        return failure
+
+    def _open(self, route: Route, now: float, cooldown: float, reason: str):
+        route.state = OPEN
+        route.opens += 1
+        route.cooldown_until = max(route.cooldown_until, now + cooldown)
+        metrics.inc('ai.router.breaker_opened')
+        logger.warning(f"🔌 Маршрут разомкнут ({reason}) на {cooldown:.0f}с: {route.label}")
+
+    # --------------------------------------------
+    # Наблюдаемость
+    # --------------------------------------------
+
+    def health(self) -> list[dict]:
+        """Состояние маршрутов (для лога метрик)"""
+        now = time.monotonic()
+        return [
+            {
+                'route': route.label,
+                'state': route.state,
+                'latency_ms': round(route.latency_ewma) if route.latency_ewma is not None else None,
+                'ms_per_token': round(route.ms_per_token, 1) if route.ms_per_token is not None else None,
+                'error_rate': round(route.error_ewma, 2),
+                'paused_s': round(max(0.0, route.cooldown_until - now)),
+                'requests': route.requests,
+                'errors': dict(route.errors),
+            }
+            for route in self.routes
+        ]
+
+    def log_health(self):
+        """Выводит состояние маршрутов в лог"""
+        lines = [f"  {item}" for item in self.health()]
+        if lines:
+            logger.info("🧭 Маршруты AI:\n" + "\n".join(lines))
+
+
+class HedgeBudget:
+    """
+    Бюджет дублирующих запросов
+
+    Каждый запрос добавляет AI_HEDGE_BUDGET жетона (не больше AI_HEDGE_BURST),
+    дубль тратит жетон: в среднем дублей не больше AI_HEDGE_BUDGET от запросов,
+    даже когда провайдер тормозит весь и порог p90 превышают все запросы подряд
+    """
+
+    def __init__(self, ratio: float = AI_HEDGE_BUDGET, burst: int = AI_HEDGE_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = float(burst)
+
+    def on_request(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    @staticmethod
+    def stats() -> dict:
+        """Доля дублей и доля побед дубля"""
+        requests = metrics.get('ai.hedge.requests')
+        sent = metrics.get('ai.hedge.sent')
+        return {
+            'hedge_rate': round(sent / requests, 3) if requests else 0.0,
+            'win_rate': round(metrics.get('ai.hedge.won') / sent, 3) if sent else 0.0,
+            'budget_denied': metrics.get('ai.hedge.budget_denied'),
+        }
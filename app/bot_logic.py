@@ -7,11 +7,26 @@ from telethon.errors import FloodWaitError, UserAlreadyParticipantError
 from telethon.tl.functions.channels import JoinChannelRequest
 from telethon.tl.functions.messages import ImportChatInviteRequest
 
-from app.config import API_ID, API_HASH, PHONE, DEST, TEMP_DIR, SESSION_NAME
+from app.config import (
+    API_ID, API_HASH, PHONE, DEST, TEMP_DIR, SESSION_NAME,
+    SOURCES_REFRESH_INTERVAL, METRICS_LOG_INTERVAL, PIPELINE_SAFETY_POLL,
+    COLLECTOR_BUFFER, NEAR_DUP_MODE, AI_HEDGE, AI_PROMPT_CACHE,
+)
+from app import ai, metrics, pipeline, prompt_assembly
+from app.ai_clients import client_pool
 from app.database.engine import SessionLocal, init_db
+from app.database.listener import PgListener
+from app.services.album_assembler import AlbumAssembler, Album
 from app.services.collector import MessageCollector
-from app.services.processor import MessageProcessor
-from app.services.publisher import PostPublisher
+from app.services.incoming import IncomingItem
+from app.services.gluing import GluingEngine
+from app.services.processor import MessageProcessor, REWRITE_BATCH_LIMIT
+from app.services.publisher import PostPublisher, PUBLISH_BATCH_LIMIT
+from app.services.near_dup import near_dup_index
+from app.services.rewrite_cache import rewrite_cache, PURGE_INTERVAL
+from app.services.source_actors import SourceActorPool
+from app.services.source_registry import SourceRegistry
+from app.services.write_buffer import CollectorWriteBuffer
 from app.models.source import Source
 
 logger = logging.getLogger(__name__)
@@ -35,6 +50,13 @@ class TGBot:
             catch_up=True  # Догонять пропущенные updates
         )
         self.dest_chat_id = None  # Будет заполнено при старте
+        self.sources = SourceRegistry()  # Активные источники в памяти
+        self.pg_listener = PgListener()  # LISTEN/NOTIFY от PostgreSQL
+        self.write_buffer = CollectorWriteBuffer() if COLLECTOR_BUFFER else None
+        self.gluing = GluingEngine()  # Склейка медиа и текста в памяти
+        # Сборка альбомов из отдельных медиа
+        self.albums = AlbumAssembler(on_album=self.enqueue_album, on_message=self.enqueue_message)
+        self.actors = SourceActorPool()  # Порядок обработки внутри источника
     
     async def setup(self):
         """Инициализация БД и папок"""
@@ -122,6 +144,7 @@ class TGBot:
                         )
                         session.add(new_source)
                         await session.commit()
+                        self.sources.add(entity.id)
                         logger.info(f"✅ Источник добавлен в БД: {entity.id}")
                     else:
                         logger.info(f"ℹ️ Источник уже в БД: {entity.id}")
@@ -132,28 +155,65 @@ class TGBot:
         except Exception as e:
             logger.error(f"❌ Ошибка добавления источника {link}: {e}")
     
-    async def is_source_active(self, chat_id: int) -> bool:
+    def is_source_active(self, chat_id: int) -> bool:
         """
         Проверка активности источника
 
-        Возвращает True, если источник есть в БД и активен
+        Возвращает True, если источник есть в реестре активных (без обращения к БД)
         """
-        async with SessionLocal() as session:
-            from sqlalchemy import select
-
-            stmt = select(Source).where(Source.chat_id == chat_id)
-            result = await session.execute(stmt)
-            source = result.scalar_one_or_none()
-
-            if not source or not source.is_active:
-                return False
-
-            return True
+        return self.sources.is_active(chat_id)
+
+    async def enqueue_album(self, album: Album):
+        """Ставит собранный альбом в очередь его источника"""
+        async def save_album():
+            async with SessionLocal() as session:
+                collector = MessageCollector(session, self.gluing)
+                await collector.collect_album(album)
+
+        await self.actors.submit(album.chat_id, save_album)
+
+    async def enqueue_message(self, item: IncomingItem):
+        """Ставит одиночное сообщение в очередь его источника"""
+        async def save_message():
+            async with SessionLocal() as session:
+                collector = MessageCollector(session, self.gluing, self.write_buffer)
+                await collector.collect_message(item)
+
+        await self.actors.submit(item.chat_id, save_message)
+
+    async def start_notifications(self):
+        """Загрузка реестра источников и подписка на NOTIFY (sources, конвейер)"""
+        await self.sources.load()
+        logger.info(f"✅ Реестр источников: {len(self.sources)} активных")
+
+        self.pg_listener.subscribe(SourceRegistry.CHANNEL, self.sources.handle_notification)
+        self.pg_listener.subscribe(pipeline.CHANNEL, pipeline.handle_notification)
+        if not await self.pg_listener.ensure_connected():
+            logger.warning(
+                f"⚠️ NOTIFY недоступен, реестр обновляется поллингом "
+                f"каждые {SOURCES_REFRESH_INTERVAL}с, этапы конвейера — "
+                f"каждые {PIPELINE_SAFETY_POLL}с"
+            )
 
     async def shutdown(self):
         """Корректное завершение работы бота"""
         logger.info("🔄 Закрытие соединений...")
 
+        # Сохраняем недособранные альбомы и дорабатываем очереди источников (до закрытия пула!)
+        for album in self.albums.close_all():
+            await self.albums.flush(album)
+        await self.actors.close()
+
+        # Сбрасываем буфер записи коллектора (до закрытия пула!)
+        if self.write_buffer is not None:
+            await self.write_buffer.close()
+
+        # Закрываем LISTEN-соединение
+        await self.pg_listener.stop()
+
+        # Закрываем HTTP-соединения с AI-провайдерами
+        await client_pool.close()
+
         # Закрываем Telethon
         if self.client.is_connected():
             await self.client.disconnect()
@@ -179,15 +239,18 @@ class TGBot:
             raise
 
         await self.join_sources()
+        await self.start_notifications()
+        await self.gluing.restore()
+        if NEAR_DUP_MODE != 'off':
+            await near_dup_index.load()
+
+        if self.write_buffer is not None:
+            self.write_buffer.start()
         
         # ============================================
         # ОБРАБОТЧИК СООБЩЕНИЙ
         # ============================================
 
-        # Буферы для сборки альбомов
-        album_buffers = {}
-        album_timers = {}
-
         @self.client.on(events.NewMessage())
         async def message_handler(event):
             """Единственный обработчик для ВСЕХ сообщений"""
@@ -196,70 +259,32 @@ class TGBot:
             if self.dest_chat_id and event.chat_id == self.dest_chat_id:
                 return
 
-            # Source validation
-            if not await self.is_source_active(event.chat_id):
+            # Source validation (in-memory, без I/O)
+            if not self.is_source_active(event.chat_id):
                 return
 
-            msg = event.message
-            grouped_id = msg.grouped_id
+            # Сразу извлекаем нужные поля — Telethon Message дальше не держим
+            item = IncomingItem.from_message(event.chat_id, event.message)
+            grouped_id = item.grouped_id
 
-            # АЛЬБОМ: буферизуем 3 секунды
+            # АЛЬБОМ: копим в AlbumAssembler до тишины / 10 медиа
             if grouped_id:
-                if grouped_id not in album_buffers:
-                    album_buffers[grouped_id] = []
-                    logger.info(f"📥 ПЕРВОЕ фото альбома: msg_id={msg.id} grouped_id={grouped_id}")
-
-                album_buffers[grouped_id].append(msg)
-                current_count = len(album_buffers[grouped_id])
+                album = self.albums.add(item.chat_id, grouped_id, item)
+                if album is not None:
+                    await self.albums.flush(album)
+                    return
 
                 logger.info(
-                    f"📥 Фото альбома: msg_id={msg.id} grouped_id={grouped_id} | "
-                    f"В буфере: {current_count} фото | Таймер: сброшен, новый отсчет 3с"
+                    f"📥 Фото альбома: msg_id={item.message_id} grouped_id={grouped_id} | "
+                    f"окно тишины {self.albums.window(item.chat_id):.2f}с"
                 )
 
-                # Cancel previous timer
-                if grouped_id in album_timers:
-                    album_timers[grouped_id].cancel()
-
-                # Start new 3-second timer
-                async def process_album():
-                    await asyncio.sleep(3.0)
-
-                    if grouped_id in album_buffers:
-                        messages = album_buffers.pop(grouped_id)
-                        album_timers.pop(grouped_id, None)
-
-                        msg_ids = [m.id for m in messages]
-                        logger.info(
-                            f"⏰ ТАЙМЕР ИСТЁК (3с): grouped_id={grouped_id} | "
-                            f"Собрано {len(messages)} фото | msg_ids={msg_ids}"
-                        )
-
-                        # Create album event
-                        class AlbumEvent:
-                            def __init__(self, chat_id, messages):
-                                self.chat_id = chat_id
-                                self.messages = messages
-
-                        album_event = AlbumEvent(event.chat_id, messages)
-
-                        try:
-                            async with SessionLocal() as session:
-                                collector = MessageCollector(session)
-                                await collector.collect_album(album_event)
-                        except Exception as e:
-                            logger.error(f"❌ Ошибка обработки альбома {grouped_id}: {e}", exc_info=True)
-
-                album_timers[grouped_id] = asyncio.create_task(process_album())
-
-            # ОДИНОЧНОЕ СООБЩЕНИЕ: обрабатываем сразу
+            # ОДИНОЧНОЕ СООБЩЕНИЕ: в очередь своего источника
             else:
-                try:
-                    async with SessionLocal() as session:
-                        collector = MessageCollector(session)
-                        await collector.collect_message(event)
-                except Exception as e:
-                    logger.error(f"❌ Ошибка обработки сообщения: {e}", exc_info=True)
+                # Пока альбомы чата собираются, сообщение ждёт их: в очередь источника
+                # альбом встанет первым, и текст после альбома сможет к нему приклеиться
+                if not self.albums.hold(item.chat_id, item):
+                    await self.enqueue_message(item)
 
         # ============================================
         # ФОНОВЫЕ ЗАДАЧИ
@@ -268,21 +293,23 @@ class TGBot:
         post_builder_lock = asyncio.Lock()
 
         async def background_rewriter():
-            """Фоновый рерайт текстов (каждые 30 сек)"""
+            """Фоновый рерайт текстов (по событию, без паузы пока есть очередь)"""
             while True:
+                taken = 0
                 try:
                     async with SessionLocal() as session:
                         processor = MessageProcessor(session)
-                        await processor.process_pending_rewrites()
+                        taken = await processor.process_pending_rewrites()
                 except asyncio.CancelledError:
                     logger.info("🛑 Остановка rewriter...")
                     break
                 except Exception as e:
                     logger.error(f"❌ Ошибка в rewriter: {e}", exc_info=True)
-                await asyncio.sleep(30)
+                if taken < REWRITE_BATCH_LIMIT:
+                    await pipeline.wait(pipeline.REWRITE, PIPELINE_SAFETY_POLL)
         
         async def background_awaiting_closer():
-            """Закрытие ожидающих текст медиа (каждые 15 сек)"""
+            """Страховочное закрытие ожидающих текст медиа (основной путь — GluingEngine)"""
             while True:
                 try:
                     async with SessionLocal() as session:
@@ -293,10 +320,10 @@ class TGBot:
                     break
                 except Exception as e:
                     logger.error(f"❌ Ошибка в awaiting_closer: {e}", exc_info=True)
-                await asyncio.sleep(15)
+                await asyncio.sleep(PIPELINE_SAFETY_POLL)
         
         async def background_post_builder():
-            """Сборка постов из обработанных сообщений (каждые 3 сек)"""
+            """Сборка постов из обработанных сообщений (по событию)"""
             while True:
                 try:
                     async with post_builder_lock:
@@ -308,21 +335,66 @@ class TGBot:
                     break
                 except Exception as e:
                     logger.error(f"❌ Ошибка в post_builder: {e}", exc_info=True)
-                await asyncio.sleep(3)
+                await pipeline.wait(pipeline.BUILD, PIPELINE_SAFETY_POLL)
         
         async def background_publisher():
-            """Публикация готовых постов (каждые 15 секунд)"""
+            """Публикация готовых постов (по событию, без паузы пока есть очередь)"""
             while True:
+                published = 0
                 try:
                     async with SessionLocal() as session:
                         publisher = PostPublisher(self.client, session)
-                        await publisher.publish_scheduled_posts()
+                        published = await publisher.publish_scheduled_posts()
                 except asyncio.CancelledError:
                     logger.info("🛑 Остановка publisher...")
                     break
                 except Exception as e:
                     logger.error(f"❌ Ошибка в publisher: {e}", exc_info=True)
-                await asyncio.sleep(15)
+                if published < PUBLISH_BATCH_LIMIT:
+                    await pipeline.wait(pipeline.PUBLISH, PIPELINE_SAFETY_POLL)
+
+        async def background_sources_refresher():
+            """Fallback-обновление реестра источников (основной путь — NOTIFY)"""
+            while True:
+                await asyncio.sleep(SOURCES_REFRESH_INTERVAL)
+                try:
+                    await self.pg_listener.ensure_connected()
+                    await self.sources.refresh()
+                except asyncio.CancelledError:
+                    logger.info("🛑 Остановка sources_refresher...")
+                    break
+                except Exception as e:
+                    logger.error(f"❌ Ошибка в sources_refresher: {e}", exc_info=True)
+
+        async def background_metrics_reporter():
+            """Периодический вывод метрик в лог"""
+            while True:
+                try:
+                    await asyncio.sleep(METRICS_LOG_INTERVAL)
+                    metrics.log_snapshot()
+                    ai.router.log_health()
+                    if AI_HEDGE:
+                        logger.info(f"🔀 Hedging: {ai.hedge_budget.stats()}")
+                    if AI_PROMPT_CACHE:
+                        logger.info(f"🧊 Кэш промпта: {prompt_assembly.stats()}")
+                    logger.info(f"💾 Кэш рерайтов: {rewrite_cache.stats()}")
+                except asyncio.CancelledError:
+                    logger.info("🛑 Остановка metrics_reporter...")
+                    break
+                except Exception as e:
+                    logger.error(f"❌ Ошибка в metrics_reporter: {e}", exc_info=True)
+
+        async def background_cache_purger():
+            """Удаление просроченных записей кэша рерайтов"""
+            while True:
+                await asyncio.sleep(PURGE_INTERVAL)
+                try:
+                    await rewrite_cache.purge()
+                except asyncio.CancelledError:
+                    logger.info("🛑 Остановка cache_purger...")
+                    break
+                except Exception as e:
+                    logger.error(f"❌ Ошибка в cache_purger: {e}", exc_info=True)
 
         # ============================================
         # ЗАПУСК ВСЕХ ЗАДАЧ ПАРАЛЛЕЛЬНО
@@ -334,9 +406,14 @@ class TGBot:
             await asyncio.gather(
                 self.client.run_until_disconnected(),
                 background_rewriter(),
+                self.gluing.run(),
+                self.albums.run(),
                 background_awaiting_closer(),
                 background_post_builder(),
-                background_publisher()
+                background_publisher(),
+                background_sources_refresher(),
+                background_metrics_reporter(),
+                background_cache_purger()
             )
         except asyncio.CancelledError:
             logger.info("⚠️  Получен сигнал остановки, завершаем задачи...")
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 from pathlib import Path
 
@@ -32,29 +33,154 @@ TEMP_DIR = "tmp_media"
 # AI НАСТРОЙКИ
 # ============================================
 AI_PROVIDER = (os.getenv("AI_PROVIDER", "openrouter") or "openrouter").strip().lower()
+# Несколько провайдеров одновременно (через запятую): openrouter,deepseek,gemini
+AI_PROVIDERS = [p.strip().lower() for p in os.getenv("AI_PROVIDERS", AI_PROVIDER).split(",") if p.strip()]
 
 # OpenRouter
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
 OPENROUTER_MODEL = os.getenv("MODEL", "tngtech/deepseek-r1t2-chimera:free")
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL")  # свой адрес API (прокси, локальный scripts/fake_llm_server.py)
 
 # DeepSeek
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
 DEEPSEEK_MODEL = os.getenv("DEEPSEEK_MODEL", "deepseek-chat")
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL")
 
 # Google Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-3-flash-preview")
 
+# Параллельный рерайт: лимиты запросов в полёте на один ключ и на одну модель
+AI_MAX_CONCURRENCY_PER_KEY = int(os.getenv("AI_MAX_CONCURRENCY_PER_KEY", 2))
+AI_MAX_CONCURRENCY_PER_MODEL = int(os.getenv("AI_MAX_CONCURRENCY_PER_MODEL", 8))
+
+# Роутер маршрутов провайдер × ключ × модель: здоровье, кулдауны, circuit breaker
+AI_EWMA_ALPHA = float(os.getenv("AI_EWMA_ALPHA", 0.2))  # вес нового наблюдения в EWMA латентности/ошибок
+AI_RETRY_BACKOFF = float(os.getenv("AI_RETRY_BACKOFF", 1))  # секунд паузы маршрута после ошибки (×2 за каждую подряд)
+AI_RATE_LIMIT_COOLDOWN = float(os.getenv("AI_RATE_LIMIT_COOLDOWN", 30))  # секунд после 429 без Retry-After
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", 3))  # ошибок подряд до размыкания
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", 60))  # секунд до пробного запроса (×2 за каждое размыкание)
+AI_BREAKER_MAX_COOLDOWN = float(os.getenv("AI_BREAKER_MAX_COOLDOWN", 900))  # потолок; столько же — при 401/402/403/404
+AI_ROUTE_MAX_WAIT = float(os.getenv("AI_ROUTE_MAX_WAIT", 60))  # секунд ждать, пока все маршруты на паузе
+
+# Запасной локальный рерайтер (app/fallback_rewriter.py), когда все маршруты AI недоступны
+AI_FALLBACK = os.getenv("AI_FALLBACK", "1").strip().lower() not in ("0", "false", "no")
+# Секунд ждать маршрут, прежде чем переписать локально; по умолчанию — самая длинная пауза
+# после ошибки до размыкания (AI_RETRY_BACKOFF × 2^(AI_BREAKER_THRESHOLD-1)), чтобы её пережидать
+AI_FALLBACK_WAIT = float(os.getenv("AI_FALLBACK_WAIT", AI_RETRY_BACKOFF * 2 ** max(0, AI_BREAKER_THRESHOLD - 1)))
+
+# Hedging: нет ответа дольше p90 маршрута — дублируем запрос на другой маршрут, берём первый ответ
+AI_HEDGE = os.getenv("AI_HEDGE", "0").strip().lower() not in ("0", "false", "no")
+AI_HEDGE_PERCENTILE = float(os.getenv("AI_HEDGE_PERCENTILE", 90))
+AI_HEDGE_MIN_SAMPLES = int(os.getenv("AI_HEDGE_MIN_SAMPLES", 20))  # меньше наблюдений — AI_HEDGE_DEFAULT_DELAY
+AI_HEDGE_DEFAULT_DELAY = float(os.getenv("AI_HEDGE_DEFAULT_DELAY", 15))  # секунд
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", 1))  # секунд, нижняя граница порога
+AI_HEDGE_BUDGET = float(os.getenv("AI_HEDGE_BUDGET", 0.1))  # дублей на один запрос (0.1 = не больше 10%)
+AI_HEDGE_BURST = int(os.getenv("AI_HEDGE_BURST", 5))  # запас дублей для всплесков
+
+# Маршрутизация по длине и типу поста (app/ai.py): "провайдер:модель" через запятую, пусто — любой маршрут.
+# Классы длины — как в SYSTEM_PROMPT: короткий текст < 200 символов, длинный > 500.
+# Модели из правил добавляются в матрицу маршрутов, даже если их нет в MODEL / *_MODEL
+AI_ROUTE_SHORT = os.getenv("AI_ROUTE_SHORT", "")  # быстрая модель для коротких текстов
+AI_ROUTE_MEDIUM = os.getenv("AI_ROUTE_MEDIUM", "")
+AI_ROUTE_LONG = os.getenv("AI_ROUTE_LONG", "")  # сильная модель для длинных
+AI_ROUTE_ALBUM = os.getenv("AI_ROUTE_ALBUM", "")  # для альбомов (важнее длины)
+
+# Адаптивный тайм-аут запроса: ожидаемые выходные токены × наблюдаемые мс на токен маршрута × запас.
+# Пока у маршрута нет наблюдений — AI_TIMEOUT, увеличенный для длинных текстов
+AI_ADAPTIVE_TIMEOUT = os.getenv("AI_ADAPTIVE_TIMEOUT", "1").strip().lower() not in ("0", "false", "no")
+AI_TIMEOUT_FACTOR = float(os.getenv("AI_TIMEOUT_FACTOR", 3))  # запас к ожидаемой латентности
+AI_TIMEOUT_MIN = float(os.getenv("AI_TIMEOUT_MIN", 10))  # секунд
+AI_TIMEOUT_MAX = float(os.getenv("AI_TIMEOUT_MAX", 180))  # секунд
+
+# Кэш префикса промпта у провайдеров (app/prompt_assembly.py): cache_control для OpenRouter,
+# cached content для Gemini; DeepSeek кэширует префикс сам
+AI_PROMPT_CACHE = os.getenv("AI_PROMPT_CACHE", "1").strip().lower() not in ("0", "false", "no")
+AI_PROMPT_CACHE_TTL = int(os.getenv("AI_PROMPT_CACHE_TTL", 3600))  # секунд жизни cached content Gemini
+
+# HTTP-клиенты провайдеров: один долгоживущий клиент (keep-alive, TLS-сессия) на пару провайдер+ключ
+AI_HTTP2 = os.getenv("AI_HTTP2", "1").strip().lower() not in ("0", "false", "no")
+AI_TIMEOUT = float(os.getenv("AI_TIMEOUT", 45))  # секунд на запрос целиком
+AI_CONNECT_TIMEOUT = float(os.getenv("AI_CONNECT_TIMEOUT", 10))  # секунд на TCP + TLS
+AI_POOL_MAX_CONNECTIONS = int(os.getenv("AI_POOL_MAX_CONNECTIONS", 20))  # соединений на клиента
+AI_POOL_MAX_KEEPALIVE = int(os.getenv("AI_POOL_MAX_KEEPALIVE", 10))  # простаивающих соединений на клиента
+AI_KEEPALIVE_EXPIRY = float(os.getenv("AI_KEEPALIVE_EXPIRY", 90))  # секунд жизни простаивающего соединения
+
+# Число параллельных рерайтов (0 = авто: ключи × AI_MAX_CONCURRENCY_PER_KEY)
+REWRITE_WORKERS = int(os.getenv("REWRITE_WORKERS", 0))
+
+# Пакетный рерайт: до REWRITE_BATCH_SIZE коротких постов в одном запросе (ответ — JSON-массив),
+# невалидные элементы ответа переписываются поодиночке. 0 или 1 — выключено
+REWRITE_BATCH_SIZE = int(os.getenv("REWRITE_BATCH_SIZE", 0))
+REWRITE_BATCH_MAX_CHARS = int(os.getenv("REWRITE_BATCH_MAX_CHARS", 400))  # текст длиннее — только поодиночке
+
 # ============================================
 # НАСТРОЙКИ БОТА
 # ============================================
 POST_DELAY = int(os.getenv("POST_DELAY", 10))  # секунд между постами
 AWAIT_TEXT_TIMEOUT = 20  # секунд ожидания текста после медиа/альбома
+# Склейка медиа и текста в памяти (timer wheel): тик колеса и запас страховочного closer
+GLUING_TICK_MS = int(os.getenv("GLUING_TICK_MS", 100))
+AWAITING_SAFETY_GRACE = int(os.getenv("AWAITING_SAFETY_GRACE", 30))  # секунд после awaiting_until
+# Сборка альбомов: окно тишины (сек) подстраивается под источник в этих пределах
+ALBUM_WINDOW_MIN = float(os.getenv("ALBUM_WINDOW_MIN", 0.5))
+ALBUM_WINDOW_MAX = float(os.getenv("ALBUM_WINDOW_MAX", 3.0))
+ALBUM_WINDOW_FACTOR = float(os.getenv("ALBUM_WINDOW_FACTOR", 3.0))  # окно = EWMA наибольшей паузы × factor
+# Акторы источников: сообщения одного источника обрабатываются по порядку
+SOURCE_QUEUE_SIZE = int(os.getenv("SOURCE_QUEUE_SIZE", 100))  # очередь источника (дальше — backpressure)
+SOURCE_MAX_CONCURRENCY = int(os.getenv("SOURCE_MAX_CONCURRENCY", 8))  # источников, пишущих в БД одновременно
+SOURCE_ACTOR_IDLE = int(os.getenv("SOURCE_ACTOR_IDLE", 60))  # секунд простоя до остановки воркера
 MEDIA_ONLY_CAPTION = "По всем вопросам с удовольствием отвечу, для заказа пишите @VES_nn"
 
 # Лимит caption (1024 без премиума, 2048 с премиумом)
 CAPTION_LIMIT = int(os.getenv("CAPTION_LIMIT", 1024))
 
+# Кэш рерайтов (PostgreSQL + LRU в памяти): одинаковый текст рерайтится один раз
+REWRITE_CACHE = os.getenv("REWRITE_CACHE", "1").strip().lower() not in ("0", "false", "no")
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", 5000))  # записей в LRU процесса
+REWRITE_CACHE_TTL_DAYS = int(os.getenv("REWRITE_CACHE_TTL_DAYS", 30))
+
+# Предобработка перед рерайтом: цены, телефоны, @username, ссылки вырезаются локально
+PREPROCESS = os.getenv("PREPROCESS", "1").strip().lower() not in ("0", "false", "no")
+
+# Near-duplicate: перепосты с изменённой ценой/эмодзи (SimHash + LSH-индекс в памяти)
+# skip — не публиковать повтор; reuse — публиковать, но взять готовый рерайт оригинала; off — выключено
+NEAR_DUP_MODE = os.getenv("NEAR_DUP_MODE", "skip").strip().lower()
+NEAR_DUP_WINDOW_DAYS = int(os.getenv("NEAR_DUP_WINDOW_DAYS", 7))
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", 3))  # бит из 64 (гарантированно находятся ≤ 3)
+NEAR_DUP_MIN_TOKENS = int(os.getenv("NEAR_DUP_MIN_TOKENS", 8))  # короче — не сравниваем
+
+# Повтор медиа: все фото/видео поста уже были в постах за последние MEDIA_DEDUP_DAYS дней
+# suppress — пост создаётся со статусом 'suppressed' и не публикуется; flag — публикуется,
+# но помечается media_duplicate_of; off — выключено
+MEDIA_DEDUP_MODE = os.getenv("MEDIA_DEDUP_MODE", "suppress").strip().lower()
+MEDIA_DEDUP_DAYS = int(os.getenv("MEDIA_DEDUP_DAYS", 30))
+
+# ============================================
+# НЕСКОЛЬКО РЕПЛИК (захват задач через FOR UPDATE SKIP LOCKED)
+# ============================================
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+REWRITE_LEASE_SECONDS = int(os.getenv("REWRITE_LEASE_SECONDS", 600))  # аренда сообщения на рерайт
+PUBLISH_LEASE_SECONDS = int(os.getenv("PUBLISH_LEASE_SECONDS", 300))  # аренда поста на публикацию
+
+# Конвейер: этапы будятся событиями (asyncio + PostgreSQL NOTIFY),
+# поллинг — только страховка
+PIPELINE_PG_NOTIFY = os.getenv("PIPELINE_PG_NOTIFY", "1").strip().lower() not in ("0", "false", "no")
+PIPELINE_SAFETY_POLL = int(os.getenv("PIPELINE_SAFETY_POLL", 60))  # секунд
+
+# Буфер записи коллектора (micro-batching вставок в message_queue), по умолчанию выключен
+COLLECTOR_BUFFER = os.getenv("COLLECTOR_BUFFER", "0").strip().lower() in ("1", "true", "yes")
+COLLECTOR_BUFFER_MAX_ROWS = int(os.getenv("COLLECTOR_BUFFER_MAX_ROWS", 200))  # строк в одной транзакции
+COLLECTOR_BUFFER_MAX_DELAY_MS = int(os.getenv("COLLECTOR_BUFFER_MAX_DELAY_MS", 50))  # макс. задержка записи
+COLLECTOR_BUFFER_MAX_PENDING = int(os.getenv("COLLECTOR_BUFFER_MAX_PENDING", 5000))  # backpressure
+COLLECTOR_BUFFER_RETRY_BACKOFF = float(os.getenv("COLLECTOR_BUFFER_RETRY_BACKOFF", 0.5))  # секунд до повтора сброса (×2, до 30)
+
+# Fallback-поллинг реестра источников (основной канал — NOTIFY от триггера)
+SOURCES_REFRESH_INTERVAL = int(os.getenv("SOURCES_REFRESH_INTERVAL", 300))  # секунд
+
+# Периодический вывод метрик в лог
+METRICS_LOG_INTERVAL = int(os.getenv("METRICS_LOG_INTERVAL", 600))  # секунд
+
 # ============================================
 # ЗАГРУЗКА ИСТОЧНИКОВ (для миграции)
 # ============================================
@@ -34,6 +34,7 @@ async def init_db():
     from app.models.source import Source
     from app.models.message import MessageQueue
     from app.models.post import Post, PostMedia
+    from app.models.rewrite_cache import RewriteCacheEntry
     
     async with engine.begin() as conn:
         # Создаём все таблицы
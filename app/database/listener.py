@@ -0,0 +1,60 @@
+import asyncpg
+import logging
+from app.config import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+
+class PgListener:
+    """
+    Подписка на PostgreSQL LISTEN/NOTIFY
+
+    Держит одно выделенное asyncpg-соединение вне пула SQLAlchemy
+    и раздаёт payload уведомлений подписчикам по каналам.
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL):
+        # asyncpg не понимает схему SQLAlchemy "postgresql+asyncpg://"
+        self._dsn = dsn.replace("postgresql+asyncpg://", "postgresql://", 1)
+        self._conn = None
+        self._callbacks = {}  # channel → [callback(payload)]
+
+    @property
+    def is_connected(self) -> bool:
+        return self._conn is not None and not self._conn.is_closed()
+
+    def subscribe(self, channel: str, callback):
+        """Регистрирует синхронный обработчик payload для канала"""
+        self._callbacks.setdefault(channel, []).append(callback)
+
+    async def start(self):
+        """Открывает соединение и выполняет LISTEN на все каналы"""
+        self._conn = await asyncpg.connect(self._dsn)
+        for channel in self._callbacks:
+            await self._conn.add_listener(channel, self._dispatch)
+        logger.info(f"👂 LISTEN: {', '.join(self._callbacks) or '-'}")
+
+    async def ensure_connected(self) -> bool:
+        """Переподключается, если соединение потеряно"""
+        if self.is_connected:
+            return True
+        try:
+            await self.start()
+            return True
+        except Exception as e:
+            logger.warning(f"⚠️ LISTEN недоступен: {e}")
+            self._conn = None
+            return False
+
+    async def stop(self):
+        """Закрывает соединение"""
+        if self._conn is not None and not self._conn.is_closed():
+            await self._conn.close()
+        self._conn = None
+
+    def _dispatch(self, connection, pid, channel, payload):
+        for callback in self._callbacks.get(channel, []):
+            try:
+                callback(payload)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки NOTIFY {channel}: {e}", exc_info=True)
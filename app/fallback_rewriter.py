@@ -0,0 +1,133 @@
+"""
+Локальный запасной рерайтер — когда все маршруты AI недоступны
+
+Без сети и за миллисекунды делает пост той же формы, что и LLM:
+стартовая строка + переписанное описание + финальная строка.
+Все правила берутся из SYSTEM_PROMPT (app/prompts.py), отдельной копии нет:
+- замены из STEP 1 ("Подходит для" → "Применяется для" / "Используется в");
+  берутся только варианты, где осталось последнее слово исходной фразы
+  ("для", "из", "защиту") — иначе сломается падеж следующего слова
+- стартовые строки из STEP 7, финальная строка из STEP 8
+
+Перестановка предложений: внутри абзаца описательные предложения идут
+в обратном порядке, а предложения с числами и латиницей (ТТХ, модели,
+материалы) остаются на своих местах и не меняются вовсе.
+Вариант замены и стартовой строки выбирается по хэшу текста — результат
+детерминирован.
+"""
+import hashlib
+import re
+import time
+
+from app.prompts import SYSTEM_PROMPT
+from app import metrics
+
+_SECTION = re.compile(r'^## (STEP \d+)', re.MULTILINE)
+_PAIR = re.compile(r'"([^"]+)"\s*→\s*((?:"[^"]+"(?:\s*/\s*)?)+)')
+_QUOTED = re.compile(r'"([^"]+)"')
+_STARTER = re.compile(r'^\d+\)\s*(.*\[товар\].*)$', re.MULTILINE)
+_ENDING = re.compile(r'^По всем вопросам.*@\w+\s*$', re.MULTILINE)
+
+_SENTENCE = re.compile(r'(?<=[.!?…])\s+(?=[А-ЯЁA-Z«"])')
+_PROTECTED = re.compile(r'\d|[A-Za-z]')  # числа, модели, артикулы, латинские материалы
+_EDGE_SYMBOLS = re.compile(r'^[^\w«"]+|[^\w»")]+$')
+_PRODUCT_MAX = 80
+
+
+def _sections(prompt: str) -> dict[str, str]:
+    parts = _SECTION.split(prompt)
+    return {parts[i]: parts[i + 1] for i in range(1, len(parts) - 1, 2)}
+
+
+def _load_rules(prompt: str) -> tuple[list[tuple[re.Pattern, list[str]]], list[str], str]:
+    """(замены, стартовые строки, финальная строка) из текста промпта"""
+    sections = _sections(prompt)
+
+    substitutions = []
+    for source, targets in _PAIR.findall(sections.get('STEP 1', '')):
+        last_word = source.split()[-1].lower()
+        safe = [t for t in _QUOTED.findall(targets) if last_word in t.lower().split()]
+        if safe:
+            pattern = re.compile(rf'(?<!\w){re.escape(source)}(?!\w)', re.IGNORECASE)
+            substitutions.append((pattern, safe))
+    # Длинные фразы раньше коротких, чтобы не заменить часть более длинной
+    substitutions.sort(key=lambda item: -len(item[0].pattern))
+
+    starters = [line.strip() for line in _STARTER.findall(sections.get('STEP 7', ''))]
+    ending = _ENDING.search(sections.get('STEP 8', ''))
+    return substitutions, starters, ending.group(0).strip() if ending else ''
+
+
+_SUBSTITUTIONS, _STARTERS, _ENDING_LINE = _load_rules(SYSTEM_PROMPT)
+
+
+def _choice(options: list[str], seed: int, salt: int = 0):
+    return options[(seed + salt) % len(options)]
+
+
+def _match_case(replacement: str, original: str) -> str:
+    if original[:1].isupper():
+        return replacement[:1].upper() + replacement[1:]
+    return replacement[:1].lower() + replacement[1:]
+
+
+def _substitute(sentence: str, seed: int) -> str:
+    for salt, (pattern, targets) in enumerate(_SUBSTITUTIONS):
+        sentence = pattern.sub(
+            lambda m: _match_case(_choice(targets, seed, salt), m.group(0)),
+            sentence
+        )
+    return sentence
+
+
+def _rewrite_paragraph(paragraph: str, seed: int) -> str:
+    """Замены + обратный порядок описательных предложений (защищённые — на месте)"""
+    lines = []
+    for line in paragraph.split('\n'):
+        sentences = _SENTENCE.split(line.strip())
+        free = [i for i, s in enumerate(sentences) if not _PROTECTED.search(s)]
+        reordered = list(sentences)
+        for i, j in zip(free, reversed(free)):
+            reordered[i] = sentences[j]
+        lines.append(' '.join(
+            s if _PROTECTED.search(s) else _substitute(s, seed) for s in reordered
+        ))
+    return '\n'.join(lines)
+
+
+def _split_product(text: str) -> tuple[str, str]:
+    """(название товара для стартовой строки, остальной текст)"""
+    first, _, rest = text.strip().partition('\n')
+    first = _EDGE_SYMBOLS.sub('', first.strip())
+    if len(first) <= _PRODUCT_MAX:
+        return first.rstrip('.'), rest.strip()
+
+    # Длинная первая строка: товар — до первой точки/запятой
+    head = re.split(r'[.,;:!?]\s', first, maxsplit=1)
+    if len(head) == 2 and len(head[0]) <= _PRODUCT_MAX:
+        return head[0], (head[1] + '\n' + rest).strip()
+    return '', text.strip()
+
+
+def fallback_rewrite(text: str) -> str:
+    """Переписывает текст локально по правилам SYSTEM_PROMPT"""
+    started = time.perf_counter()
+    seed = int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=4).digest(), 'big')
+
+    product, body = _split_product(text)
+    paragraphs = [p for p in re.split(r'\n\s*\n', body) if p.strip()]
+    body = '\n\n'.join(_rewrite_paragraph(p, seed) for p in paragraphs)
+
+    parts = []
+    if product and _STARTERS:
+        parts.append(_choice(_STARTERS, seed).replace('[товар]', product))
+    elif product:
+        parts.append(product)
+    if body:
+        parts.append(body)
+    if _ENDING_LINE:
+        parts.append(_ENDING_LINE)
+
+    metrics.inc('ai.fallback')
+    metrics.observe('ai.fallback_us', (time.perf_counter() - started) * 1_000_000)
+    return '\n\n'.join(parts)
@@ -0,0 +1,54 @@
+"""
+Простые in-process метрики бота
+
+Счётчики (inc) и тайминги (observe) живут в памяти процесса
+и периодически выводятся в лог через log_snapshot().
+"""
+import logging
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+_counters = defaultdict(int)
+_timings = {}  # name → [count, total, max]
+
+
+def inc(name: str, value: int = 1):
+    """Увеличивает счётчик"""
+    _counters[name] += value
+
+
+def observe(name: str, value: float):
+    """Добавляет наблюдение (например, латентность в мс)"""
+    stat = _timings.get(name)
+    if stat is None:
+        _timings[name] = [1, value, value]
+        return
+    stat[0] += 1
+    stat[1] += value
+    if value > stat[2]:
+        stat[2] = value
+
+
+def get(name: str) -> int:
+    """Текущее значение счётчика"""
+    return _counters.get(name, 0)
+
+
+def snapshot() -> dict:
+    """Снимок всех метрик: счётчики + count/avg/max по таймингам"""
+    data = dict(_counters)
+    for name, (count, total, max_value) in _timings.items():
+        data[f"{name}.count"] = count
+        data[f"{name}.avg"] = round(total / count, 2) if count else 0
+        data[f"{name}.max"] = round(max_value, 2)
+    return data
+
+
+def log_snapshot():
+    """Выводит снимок метрик в лог"""
+    data = snapshot()
+    if not data:
+        return
+    lines = [f"  {name} = {value}" for name, value in sorted(data.items())]
+    logger.info("📊 Метрики:\n" + "\n".join(lines))
@@ -11,6 +11,7 @@ from app.models.base import Base
 from app.models.source import Source
 from app.models.message import MessageQueue
 from app.models.post import Post, PostMedia
+from app.models.rewrite_cache import RewriteCacheEntry
 
 # Экспортируем все модели
 __all__ = [
@@ -19,4 +20,5 @@ __all__ = [
     'MessageQueue',
     'Post',
     'PostMedia',
+    'RewriteCacheEntry',
 ]
\ No newline at end of file
@@ -46,12 +46,25 @@ class MessageQueue(Base):
     # ОБРАБОТАННЫЕ ДАННЫЕ (РЕРАЙТ)
     # ============================================
     rewritten_text = Column(Text, nullable=True)
-    rewrite_status = Column(String(20), default='pending')  # pending, processing, done, failed, skipped
+    rewrite_status = Column(String(20), default='pending')  # pending, processing, done, failed, skipped, duplicate
     rewrite_error = Column(Text, nullable=True)
     rewritten_at = Column(TIMESTAMP, nullable=True)
     ai_provider = Column(String(50), nullable=True)
     ai_model = Column(String(100), nullable=True)
     
+    # ============================================
+    # ЗАХВАТ В РАБОТУ (несколько реплик)
+    # ============================================
+    claimed_by = Column(String(100), nullable=True)  # WORKER_ID реплики, взявшей рерайт
+    lease_until = Column(TIMESTAMP, nullable=True)  # после истечения строку можно перехватить
+    
+    # ============================================
+    # ДЕДУПЛИКАЦИЯ (near-duplicate)
+    # ============================================
+    text_simhash = Column(BigInteger, nullable=True)  # SimHash original_text (uint64 как int64)
+    duplicate_of = Column(BigInteger, nullable=True)  # id сообщения, повтором которого оказалось
+    dup_cluster_id = Column(BigInteger, nullable=True)  # кластер повторов (scripts/dedup_backlog.py)
+    
     # ============================================
     # СКЛЕЙКА МЕДИА + ТЕКСТ
     # ============================================
@@ -78,6 +91,18 @@ class MessageQueue(Base):
               postgresql_where=(grouped_id.isnot(None))),
         Index('idx_queue_awaiting', 'awaiting_text', 'awaiting_until',
               postgresql_where=(awaiting_text == True)),
+        Index('idx_queue_processing_lease', 'lease_until',
+              postgresql_where=(rewrite_status == 'processing')),
+        # Сборка постов: только несобранные строки, без истории
+        Index('idx_queue_unbuilt_grouped', 'grouped_id',
+              postgresql_where=((ready_to_post == False) & grouped_id.isnot(None))),
+        Index('idx_queue_unbuilt_singles', 'collected_at',
+              postgresql_where=((ready_to_post == False) & grouped_id.is_(None))),
+        # Восстановление индекса near-duplicate при старте
+        Index('idx_queue_simhash_window', 'collected_at',
+              postgresql_where=(text_simhash.isnot(None))),
+        Index('idx_queue_dup_cluster', 'dup_cluster_id',
+              postgresql_where=(dup_cluster_id.isnot(None))),
     )
     
     def __repr__(self):
@@ -27,11 +27,18 @@ class Post(Base):
     
     final_text = Column(Text, nullable=True)  # финальный текст для публикации
     
-    status = Column(String(20), default='scheduled')  # scheduled, posting, posted, failed
+    status = Column(String(20), default='scheduled')  # scheduled, posting, posted, failed, suppressed
     scheduled_at = Column(TIMESTAMP, nullable=True)
     posted_at = Column(TIMESTAMP, nullable=True)
     post_error = Column(Text, nullable=True)
     
+    # Захват в работу (несколько реплик)
+    claimed_by = Column(String(100), nullable=True)  # WORKER_ID реплики-публикатора
+    lease_until = Column(TIMESTAMP, nullable=True)  # после истечения пост можно перехватить
+    
+    dup_cluster_id = Column(BigInteger, nullable=True)  # кластер повторов (scripts/dedup_backlog.py)
+    media_duplicate_of = Column(BigInteger, nullable=True)  # пост, в котором уже были все медиа этого
+    
     created_at = Column(TIMESTAMP, server_default=func.now())
     
     # Связи
@@ -40,6 +47,10 @@ class Post(Base):
     __table_args__ = (
         Index('idx_posts_scheduled', 'status', 'scheduled_at',
               postgresql_where=(status == 'scheduled')),
+        Index('idx_posts_posting_lease', 'lease_until',
+              postgresql_where=(status == 'posting')),
+        Index('idx_posts_dup_cluster', 'dup_cluster_id',
+              postgresql_where=(dup_cluster_id.isnot(None))),
     )
     
     def __repr__(self):
@@ -80,6 +91,9 @@ class PostMedia(Base):
     
     __table_args__ = (
         Index('idx_media_post_id', 'post_id'),
+        # Дедупликация по медиа при сборке постов
+        Index('idx_media_file', 'media_type', 'media_file_id',
+              postgresql_where=(media_file_id.isnot(None))),
     )
     
     def __repr__(self):
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, String, Text, Integer, TIMESTAMP, Index
+from sqlalchemy.sql import func
+from app.models.base import Base
+
+
+class RewriteCacheEntry(Base):
+    """
+    Кэш рерайтов
+
+    Ключ — sha256 от нормализованного текста + версии промпта + провайдера + модели:
+    один и тот же текст из разных источников рерайтится один раз
+    """
+
+    __tablename__ = 'rewrite_cache'
+
+    key = Column(String(64), primary_key=True)  # sha256 hex
+    provider = Column(String(50), nullable=False)
+    model = Column(String(200), nullable=False)
+    prompt_version = Column(String(20), nullable=False)
+    rewritten_text = Column(Text, nullable=False)
+
+    # Сколько токенов стоил исходный запрос (для подсчёта экономии)
+    input_tokens = Column(Integer, nullable=True)
+    output_tokens = Column(Integer, nullable=True)
+
+    hits = Column(Integer, default=0, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
+    last_hit_at = Column(TIMESTAMP, nullable=True)
+
+    __table_args__ = (
+        Index('idx_rewrite_cache_created', 'created_at'),
+    )
+
+    def __repr__(self):
+        return f"<RewriteCacheEntry(key={self.key[:12]}, model='{self.model}', hits={self.hits})>"
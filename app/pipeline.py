@@ -0,0 +1,81 @@
+"""
+Пробуждение этапов конвейера событиями
+
+Вместо фиксированных интервалов фоновые задачи ждут asyncio.Event своего этапа.
+Событие взводится:
+- локально — сразу после commit, сделавшего работу для этапа (commit());
+- между процессами — через PostgreSQL NOTIFY в той же транзакции
+  (доставляется только после commit), см. handle_notification().
+
+Поллинг остаётся как страховка с большим интервалом (PIPELINE_SAFETY_POLL).
+"""
+import asyncio
+import logging
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.config import PIPELINE_PG_NOTIFY, WORKER_ID
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'pipeline'
+
+REWRITE = 'rewrite'
+BUILD = 'build'
+PUBLISH = 'publish'
+
+STAGES = (REWRITE, BUILD, PUBLISH)
+
+_events = {stage: asyncio.Event() for stage in STAGES}
+
+
+def wake(*stages: str):
+    """Будит этапы в текущем процессе"""
+    for stage in stages:
+        _events[stage].set()
+        metrics.inc(f'pipeline.wake.{stage}')
+
+
+async def commit(session: AsyncSession, *stages: str):
+    """
+    Commit + пробуждение этапов
+
+    NOTIFY ставится в ту же транзакцию, поэтому другие реплики увидят
+    событие только вместе с закоммиченными данными
+    """
+    if PIPELINE_PG_NOTIFY:
+        for stage in stages:
+            await session.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {'channel': CHANNEL, 'payload': f"{stage}:{WORKER_ID}"}
+            )
+    await session.commit()
+    wake(*stages)
+
+
+async def wait(stage: str, timeout: float) -> bool:
+    """
+    Ждёт пробуждения этапа не дольше timeout секунд
+
+    Возвращает True, если этап разбудили (False — сработал страховочный таймаут)
+    """
+    event = _events[stage]
+    try:
+        await asyncio.wait_for(event.wait(), timeout=max(timeout, 0))
+        woken = True
+    except asyncio.TimeoutError:
+        woken = False
+    # Сбрасываем ДО обработки: события во время прохода не потеряются
+    event.clear()
+    return woken
+
+
+def handle_notification(payload: str):
+    """Обработчик NOTIFY pipeline (payload = "stage:worker_id")"""
+    stage, _, sender = (payload or '').partition(':')
+    if sender == WORKER_ID:
+        return  # своё событие уже обработано локально в commit()
+    if stage in _events:
+        wake(stage)
+    else:
+        logger.warning(f"⚠️ Неизвестный этап в NOTIFY {CHANNEL}: {payload!r}")
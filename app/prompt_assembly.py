@@ -0,0 +1,202 @@
+"""
+Сборка запросов к LLM: неизменный префикс + текст поста
+
+Системный промпт одинаков во всех запросах — это префикс, который провайдеры
+умеют кэшировать (платится дешевле и обрабатывается быстрее). Кэш срабатывает
+только при побайтовом совпадении префикса, поэтому:
+- префикс — только константы из app/prompts.py, всё переменное (текст поста,
+  пакет постов) идёт после него, в сообщении пользователя
+- у каждого префикса есть версия: PROMPT_VERSION + хэш текста. Любая правка
+  промпта даёт новую версию, старые кэш-хэндлы не используются
+
+Кэширование по провайдерам:
+- DeepSeek, OpenAI-совместимые — автоматический кэш префикса, ничего не нужно
+- OpenRouter — для моделей Anthropic/Gemini префикс помечается cache_control
+- Gemini — cached content: префикс загружается один раз на (ключ, модель, версия),
+  запросы ссылаются на него по имени (GeminiCache)
+
+Метрики (по каждому запросу, из usage провайдера):
+- ai.input_tokens_cached / ai.input_tokens_uncached
+- ai.prompt_cache.<provider>.cached_tokens / .uncached_tokens / .hits / .requests
+"""
+import asyncio
+import hashlib
+import logging
+import time
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from google.genai import types as genai_types
+
+from app.config import AI_PROMPT_CACHE, AI_PROMPT_CACHE_TTL
+from app.prompts import PROMPT_VERSION, SYSTEM_PROMPT, BATCH_SYSTEM_PROMPT
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Модели OpenRouter, которым нужна явная точка кэширования (cache_control)
+_CACHE_CONTROL_MODELS = ('anthropic/', 'google/')
+_CACHE_REFRESH_MARGIN = 60  # секунд до истечения cached content — пересоздаём заранее
+
+
+class PromptPrefix(NamedTuple):
+    """Кэшируемый префикс запроса"""
+    name: str
+    text: str
+    version: str  # PROMPT_VERSION + хэш текста
+
+    @property
+    def label(self) -> str:
+        return f"tg-userbot:{self.name}:{self.version}"
+
+
+def _prefix(name: str, text: str) -> PromptPrefix:
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+    return PromptPrefix(name, text, f"{PROMPT_VERSION}-{digest}")
+
+
+REWRITE_PREFIX = _prefix('rewrite', SYSTEM_PROMPT)
+# Начинается с SYSTEM_PROMPT — автоматический кэш префикса общий с одиночными запросами
+BATCH_PREFIX = _prefix('batch', BATCH_SYSTEM_PROMPT)
+
+
+def openai_messages(prefix: PromptPrefix, text: str, provider: str, model: str) -> list[dict]:
+    """Сообщения для OpenAI-совместимого API: префикс — первым, без изменений"""
+    if AI_PROMPT_CACHE and provider == 'openrouter' and model.startswith(_CACHE_CONTROL_MODELS):
+        system = {
+            "role": "system",
+            "content": [{"type": "text", "text": prefix.text, "cache_control": {"type": "ephemeral"}}],
+        }
+    else:
+        system = {"role": "system", "content": prefix.text}
+    return [system, {"role": "user", "content": text}]
+
+
+def openai_cached_tokens(usage) -> int | None:
+    """Входные токены из кэша по usage OpenAI-совместимого ответа"""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached = getattr(details, 'cached_tokens', None)
+    if cached is None:
+        cached = getattr(usage, 'prompt_cache_hit_tokens', None)  # DeepSeek
+    return cached
+
+
+def record_usage(provider: str, prefix: PromptPrefix, input_tokens: int | None, cached_tokens: int | None):
+    """Учёт закэшированных и незакэшированных входных токенов одного запроса"""
+    prefix_metric = f'ai.prompt_cache.{provider}'
+    metrics.inc(f'{prefix_metric}.requests')
+    if input_tokens is None:
+        return
+
+    cached = min(cached_tokens or 0, input_tokens)
+    metrics.inc('ai.input_tokens_cached', cached)
+    metrics.inc('ai.input_tokens_uncached', input_tokens - cached)
+    metrics.inc(f'{prefix_metric}.cached_tokens', cached)
+    metrics.inc(f'{prefix_metric}.uncached_tokens', input_tokens - cached)
+    if cached:
+        metrics.inc(f'{prefix_metric}.hits')
+    logger.debug(f"🧊 {provider} [{prefix.name} {prefix.version}]: вход {input_tokens}, из кэша {cached}")
+
+
+def stats() -> dict:
+    """Доля входных токенов из кэша: всего и по провайдерам"""
+    def share(cached, uncached):
+        total = cached + uncached
+        return round(cached / total, 3) if total else None
+
+    result = {'cached_share': share(metrics.get('ai.input_tokens_cached'), metrics.get('ai.input_tokens_uncached'))}
+    for name, value in metrics.snapshot().items():
+        if name.startswith('ai.prompt_cache.') and name.endswith('.requests'):
+            provider = name.split('.')[2]
+            key = f'ai.prompt_cache.{provider}'
+            result[provider] = {
+                'requests': value,
+                'hits': metrics.get(f'{key}.hits'),
+                'cached_share': share(metrics.get(f'{key}.cached_tokens'), metrics.get(f'{key}.uncached_tokens')),
+            }
+    return result
+
+
+class GeminiCache:
+    """
+    Хэндлы cached content Gemini по (ключ, модель, версия префикса)
+
+    Хэндл создаётся при первом запросе (или находится среди уже созданных —
+    по display_name, например после рестарта) и пересоздаётся перед истечением
+    AI_PROMPT_CACHE_TTL. Если модель не поддерживает кэш или префикс меньше
+    её минимума — запросы идут с обычным system_instruction, повторная попытка
+    создать хэндл — через AI_PROMPT_CACHE_TTL.
+    """
+
+    def __init__(self):
+        self._handles = {}  # (key, model, version) → (имя cached content, истекает в unix-времени)
+        self._unsupported = {}  # (key, model, version) → когда пробовать снова (monotonic)
+        self._locks = {}
+
+    async def handle(self, client, key: str, model: str, prefix: PromptPrefix) -> str | None:
+        """Имя cached content для префикса или None (запрос без кэша)"""
+        if not AI_PROMPT_CACHE:
+            return None
+        cache_key = (key, model, prefix.version)
+        cached = self._handles.get(cache_key)
+        if cached and cached[1] - time.time() > _CACHE_REFRESH_MARGIN:
+            return cached[0]
+        if self._unsupported.get(cache_key, 0) > time.monotonic():
+            return None
+
+        lock = self._locks.setdefault(cache_key, asyncio.Lock())
+        async with lock:
+            cached = self._handles.get(cache_key)
+            if cached and cached[1] - time.time() > _CACHE_REFRESH_MARGIN:
+                return cached[0]
+            try:
+                name, expires = await self._find(client, model, prefix) or await self._create(client, model, prefix)
+            except Exception as e:
+                self._unsupported[cache_key] = time.monotonic() + AI_PROMPT_CACHE_TTL
+                logger.warning(f"⚠️ Gemini cached content для {model} недоступен, запросы без кэша: {e}")
+                return None
+            self._handles[cache_key] = (name, expires)
+            return name
+
+    def reset_loop_state(self):
+        """Забыть asyncio.Lock'и, привязанные к завершённому event loop (хэндлы остаются)"""
+        self._locks.clear()
+
+    def invalidate(self, key: str, model: str, prefix: PromptPrefix):
+        """Забыть хэндл (удалён или истёк на стороне Gemini) — создастся заново"""
+        self._handles.pop((key, model, prefix.version), None)
+
+    @staticmethod
+    def _expires(content) -> float:
+        expire_time = content.expire_time
+        if expire_time is None:
+            return time.time() + AI_PROMPT_CACHE_TTL
+        if expire_time.tzinfo is None:
+            expire_time = expire_time.replace(tzinfo=timezone.utc)
+        return expire_time.timestamp()
+
+    async def _find(self, client, model: str, prefix: PromptPrefix):
+        """Живой cached content этого префикса, созданный раньше (в т.ч. другой репликой)"""
+        async for content in await client.aio.caches.list():
+            if content.display_name != prefix.label or not (content.model or '').endswith(model):
+                continue
+            expires = self._expires(content)
+            if expires - time.time() > _CACHE_REFRESH_MARGIN:
+                return content.name, expires
+        return None
+
+    async def _create(self, client, model: str, prefix: PromptPrefix):
+        content = await client.aio.caches.create(
+            model=model,
+            config=genai_types.CreateCachedContentConfig(
+                system_instruction=prefix.text,
+                display_name=prefix.label,
+                ttl=f"{AI_PROMPT_CACHE_TTL}s",
+            ),
+        )
+        logger.info(f"🧊 Gemini cached content {prefix.label} для {model} создан до "
+                    f"{datetime.fromtimestamp(self._expires(content)):%H:%M}")
+        return content.name, self._expires(content)
+
+
+gemini_cache = GeminiCache()
@@ -1,5 +1,10 @@
 # prompts.py
 
+# Версия промпта: входит в ключ кэша рерайтов (app/services/rewrite_cache.py)
+# и в версию кэшируемого у провайдера префикса (app/prompt_assembly.py).
+# Меняйте при любой правке SYSTEM_PROMPT — иначе из кэша придут рерайты по старому промпту
+PROMPT_VERSION = "1"
+
 # Основной промпт для рерайта (оптимизирован для MiMo-V2-Flash)
 SYSTEM_PROMPT = """# System Prompt: Rewriter for Military Gear Sales Posts
 
@@ -293,3 +298,22 @@ Output:
 **LENGTH:** Match input length (±30%)
 **NEVER:** Invent specs, add features, expand short texts
 """
+
+# Дополнение для пакетного рерайта (app.ai.rewrite_batch_async): несколько коротких
+# постов в одном запросе — длинный SYSTEM_PROMPT оплачивается один раз на пакет
+BATCH_PROMPT_SUFFIX = """
+---
+
+## BATCH MODE
+
+Input is a JSON array of UNRELATED posts: [{"id": 0, "text": "..."}, {"id": 1, "text": "..."}]
+Rewrite EACH post separately by ALL the rules above: own starter line, own ending line.
+NEVER move facts, specs or names from one post to another.
+
+Output ONLY a JSON array, no markdown fences, no comments:
+[{"id": 0, "text": "<rewritten post 0>"}, {"id": 1, "text": "<rewritten post 1>"}]
+- exactly one item for every input id, ids unchanged
+- "text" is the whole rewritten post as a JSON string (line breaks as \\n)
+"""
+
+BATCH_SYSTEM_PROMPT = SYSTEM_PROMPT + BATCH_PROMPT_SUFFIX
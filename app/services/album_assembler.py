@@ -0,0 +1,231 @@
+from app.config import ALBUM_WINDOW_MIN, ALBUM_WINDOW_MAX, ALBUM_WINDOW_FACTOR
+from app.services.incoming import IncomingItem
+from app import metrics
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+import asyncio
+import heapq
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+ALBUM_MAX_ITEMS = 10  # Telegram не отдаёт в альбоме больше 10 медиа
+
+
+@dataclass
+class Album:
+    """Альбом в процессе сборки (chat_id + messages — то, что читает collect_album)"""
+    chat_id: int
+    grouped_id: int
+    messages: list[IncomingItem] = field(default_factory=list)
+    first_seen: float = 0.0
+    last_seen: float = 0.0
+    max_gap: float = 0.0  # наибольшая пауза между соседними медиа
+    deadline: float = 0.0
+    followers: list[IncomingItem] = field(default_factory=list)  # одиночные сообщения, ждавшие альбом (hold)
+
+
+class AlbumAssembler:
+    """
+    Сборщик альбомов
+
+    Медиа альбома приходят отдельными NewMessage с общим grouped_id.
+    Альбом закрывается:
+    - по тишине: нет новых медиа дольше окна источника
+    - досрочно: набралось ALBUM_MAX_ITEMS медиа
+
+    Сообщение не из альбома альбом не закрывает: Telethon обрабатывает апдейты
+    конкурентно, и медиа альбома может прийти после него — досрочное закрытие
+    дало бы второй Album с тем же grouped_id. Вместо этого одиночное сообщение
+    чата с открытыми альбомами ждёт их закрытия (hold) и уходит в on_message
+    сразу после последнего из них — текст после альбома по-прежнему может к нему приклеиться.
+
+    Окно тишины адаптивное: EWMA наибольшей паузы внутри альбомов источника
+    × ALBUM_WINDOW_FACTOR, в пределах [ALBUM_WINDOW_MIN, ALBUM_WINDOW_MAX].
+    Пока наблюдений нет — ALBUM_WINDOW_MAX.
+
+    Таймеры — одна куча дедлайнов и один sweeper (run()) вместо задачи на альбом.
+    Часы подставляются (clock), поэтому логику можно проверять без event loop:
+    add() / hold() / pop_due() — синхронные.
+    """
+
+    def __init__(self,
+                 on_album: Callable[[Album], Awaitable] | None = None,
+                 on_message: Callable[[IncomingItem], Awaitable] | None = None,
+                 clock: Callable[[], float] = time.monotonic,
+                 min_window: float = ALBUM_WINDOW_MIN,
+                 max_window: float = ALBUM_WINDOW_MAX,
+                 factor: float = ALBUM_WINDOW_FACTOR,
+                 alpha: float = 0.3):
+        self.on_album = on_album
+        self.on_message = on_message
+        self.clock = clock
+        self.min_window = min_window
+        self.max_window = max_window
+        self.factor = factor
+        self.alpha = alpha
+
+        self._open = {}  # (chat_id, grouped_id) → Album
+        self._open_per_chat = {}  # chat_id → открытых альбомов
+        self._held = {}  # chat_id → одиночные сообщения, ждущие закрытия альбомов чата
+        self._heap = []  # (deadline, seq, key); устаревшие записи пропускаются лениво
+        self._seq = 0
+        self._gap_ewma = {}  # chat_id → EWMA наибольшей паузы
+        self._wakeup = None
+
+    def __len__(self):
+        return len(self._open)
+
+    # ============================================
+    # ОКНО ТИШИНЫ
+    # ============================================
+
+    def window(self, chat_id: int) -> float:
+        """Текущее окно тишины источника (сек)"""
+        gap = self._gap_ewma.get(chat_id)
+        if gap is None:
+            return self.max_window
+        return min(max(gap * self.factor, self.min_window), self.max_window)
+
+    def _observe(self, album: Album):
+        """Учитывает паузы закрытого альбома в EWMA источника"""
+        if len(album.messages) < 2:
+            return
+        prev = self._gap_ewma.get(album.chat_id)
+        if prev is None:
+            self._gap_ewma[album.chat_id] = album.max_gap
+        else:
+            self._gap_ewma[album.chat_id] = self.alpha * album.max_gap + (1 - self.alpha) * prev
+
+    # ============================================
+    # СБОРКА
+    # ============================================
+
+    def add(self, chat_id: int, grouped_id: int, item: IncomingItem) -> Album | None:
+        """
+        Добавляет медиа в альбом
+
+        Возвращает альбом, если он закрылся досрочно (набралось ALBUM_MAX_ITEMS)
+        """
+        now = self.clock()
+        key = (chat_id, grouped_id)
+
+        album = self._open.get(key)
+        if album is None:
+            album = Album(chat_id, grouped_id, first_seen=now, last_seen=now)
+            self._open[key] = album
+            self._open_per_chat[chat_id] = self._open_per_chat.get(chat_id, 0) + 1
+        else:
+            album.max_gap = max(album.max_gap, now - album.last_seen)
+            album.last_seen = now
+
+        album.messages.append(item)
+
+        if len(album.messages) >= ALBUM_MAX_ITEMS:
+            metrics.inc('albums.closed_full')
+            return self._close(key)
+
+        album.deadline = now + self.window(chat_id)
+        self._seq += 1
+        heapq.heappush(self._heap, (album.deadline, self._seq, key))
+        if self._wakeup is not None:
+            self._wakeup.set()
+        return None
+
+    def hold(self, chat_id: int, item: IncomingItem) -> bool:
+        """
+        Придерживает одиночное сообщение, пока в чате есть открытые альбомы
+
+        True — сообщение отдастся в on_message после закрытия последнего альбома
+        чата (Album.followers); False — альбомов нет, обрабатывать сразу
+        """
+        if not self._open_per_chat.get(chat_id):
+            return False
+        self._held.setdefault(chat_id, []).append(item)
+        metrics.inc('albums.held_messages')
+        return True
+
+    def pop_due(self, now: float | None = None) -> list[Album]:
+        """Забирает альбомы, у которых истекло окно тишины"""
+        now = self.clock() if now is None else now
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, _, key = heapq.heappop(self._heap)
+            album = self._open.get(key)
+            if album is None or album.deadline != deadline:
+                continue  # альбом уже закрыт или дедлайн сдвинут
+            metrics.inc('albums.closed_quiet')
+            due.append(self._close(key))
+        return due
+
+    def next_deadline(self) -> float | None:
+        """Ближайший актуальный дедлайн (None — открытых альбомов нет)"""
+        while self._heap:
+            deadline, _, key = self._heap[0]
+            album = self._open.get(key)
+            if album is not None and album.deadline == deadline:
+                return deadline
+            heapq.heappop(self._heap)
+        return None
+
+    def close_all(self) -> list[Album]:
+        """Закрывает все открытые альбомы (остановка бота)"""
+        return [self._close(key) for key in list(self._open)]
+
+    def _close(self, key) -> Album:
+        album = self._open.pop(key)
+        chat_id = album.chat_id
+        self._open_per_chat[chat_id] -= 1
+        if not self._open_per_chat[chat_id]:
+            del self._open_per_chat[chat_id]
+            album.followers = self._held.pop(chat_id, [])
+        self._observe(album)
+        metrics.observe('albums.items', len(album.messages))
+        metrics.observe('albums.assembly_ms', (self.clock() - album.first_seen) * 1000)
+        return album
+
+    # ============================================
+    # SWEEPER
+    # ============================================
+
+    async def run(self):
+        """Единственный таймер: ждёт ближайший дедлайн и отдаёт альбомы в on_album"""
+        self._wakeup = asyncio.Event()
+        while True:
+            deadline = self.next_deadline()
+            self._wakeup.clear()
+            if deadline is None:
+                await self._wakeup.wait()
+                continue
+
+            timeout = deadline - self.clock()
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    continue  # пришло новое медиа — пересчитываем ближайший дедлайн
+                except asyncio.TimeoutError:
+                    pass
+
+            for album in self.pop_due():
+                await self.flush(album)
+
+    async def flush(self, album: Album):
+        """Отдаёт закрытый альбом в on_album, затем придержанные за ним сообщения в on_message"""
+        msg_ids = [m.message_id for m in album.messages]
+        logger.info(
+            f"⏰ Альбом собран: grouped_id={album.grouped_id} | "
+            f"{len(album.messages)} медиа за {album.last_seen - album.first_seen:.2f}с | "
+            f"окно {self.window(album.chat_id):.2f}с | msg_ids={msg_ids}"
+        )
+        try:
+            await self.on_album(album)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки альбома {album.grouped_id}: {e}", exc_info=True)
+
+        # Придержанные сообщения — строго после альбома (текст приклеится к нему)
+        for item in album.followers:
+            try:
+                await self.on_message(item)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки сообщения {item.chat_id}/{item.message_id}: {e}", exc_info=True)
@@ -1,10 +1,12 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import update, and_, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from app.models.message import MessageQueue
 from app.config import AWAIT_TEXT_TIMEOUT
+from app.services.gluing import GluingEngine, PendingMedia, RecentAlbum
+from app.services.incoming import IncomingItem
+from app import pipeline
 from datetime import datetime, timedelta
-from collections import defaultdict
-import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
@@ -15,27 +17,31 @@ class MessageCollector:
     Сборщик сообщений из источников
 
     Два режима обработки:
-    1. collect_album() - обрабатывает альбомы (собранные вручную через NewMessage + буфер)
+    1. collect_album() - обрабатывает альбомы (собранные AlbumAssembler)
     2. collect_message() - обрабатывает одиночные сообщения
 
+    На вход — IncomingItem (уже извлечённые из Telethon Message поля)
+
     Умная логика:
     - Склеивает медиа и текст, если они пришли раздельно
     - Ждёт текст после одиночного медиа в течение AWAIT_TEXT_TIMEOUT секунд
     - Связывает текст с недавним альбомом, если текст пришел после альбома
+      (голова альбома без подписи ждёт текст AWAIT_TEXT_TIMEOUT секунд, как одиночное медиа)
     """
 
-    def __init__(self, db_session: AsyncSession):
+    def __init__(self, db_session: AsyncSession, gluing: GluingEngine, write_buffer=None):
         self.db = db_session
-        self._album_locks = defaultdict(asyncio.Lock)
+        self.gluing = gluing  # in-memory состояние склейки (общее для всех сессий)
+        self.write_buffer = write_buffer  # CollectorWriteBuffer или None (запись сразу)
 
-    async def collect_album(self, event):
+    async def collect_album(self, album):
         """
-        Обработка альбома (собранного вручную)
+        Обработка альбома (Album из AlbumAssembler)
 
-        Фото собраны через NewMessage handler + буфер в bot_logic
+        album.messages — список IncomingItem всех медиа альбома
         """
-        chat_id = event.chat_id
-        messages = event.messages  # Список всех медиа в альбоме
+        chat_id = album.chat_id
+        messages: list[IncomingItem] = album.messages
 
         if not messages:
             logger.warning(f"⚠️ Пустой альбом от {chat_id}")
@@ -44,8 +50,8 @@ class MessageCollector:
         # Собираем ВСЕ тексты из всех сообщений альбома
         captions = []
         for msg in messages:
-            if msg.message and len(msg.message.strip()) > 0:
-                captions.append(msg.message)
+            if msg.has_text:
+                captions.append(msg.text)
 
         # Объединяем все подписи через двойной перенос
         caption = "\n\n".join(captions) if captions else None
@@ -53,7 +59,7 @@ class MessageCollector:
         grouped_id = messages[0].grouped_id
 
         # Диагностика: логируем ID всех сообщений в альбоме и временной разброс
-        msg_ids = [msg.id for msg in messages]
+        msg_ids = [msg.message_id for msg in messages]
         msg_dates = [msg.date for msg in messages]
         time_span = (max(msg_dates) - min(msg_dates)).total_seconds() if len(msg_dates) > 1 else 0
 
@@ -63,48 +69,60 @@ class MessageCollector:
             f"time_span={time_span:.2f}s msg_ids={msg_ids}"
         )
 
-        # Сохраняем все медиа альбома
-        saved_count = 0
-        duplicates = []
-
+        # Сохраняем все медиа альбома одним INSERT ... ON CONFLICT DO NOTHING
+        head_id = messages[0].message_id
+        until = datetime.utcnow() + timedelta(seconds=AWAIT_TEXT_TIMEOUT)
+        rows = []
         for msg in messages:
-            # Проверяем дубликат
-            stmt = select(MessageQueue).where(
-                MessageQueue.source_id == chat_id,
-                MessageQueue.message_id == msg.id
-            )
-            result = await self.db.execute(stmt)
-            existing = result.scalar_one_or_none()
+            # Текст сохраняем ТОЛЬКО к первому медиа — это "голова" альбома:
+            # её rewrite_status и есть статус рерайта всего альбома
+            is_first = (msg.message_id == head_id)
+            is_album_job = is_first and caption is not None
 
-            if existing:
-                logger.warning(f"⚠️ Дубликат медиа из альбома: {chat_id}/{msg.id}")
-                duplicates.append(msg.id)
-                continue
-
-            file_id, access_hash, file_ref = self._extract_media_data(msg)
-
-            # Текст сохраняем ТОЛЬКО к первому медиа
-            is_first = (msg.id == messages[0].id)
-
-            queue_msg = MessageQueue(
+            rows.append(dict(
                 source_id=chat_id,
-                message_id=msg.id,
+                message_id=msg.message_id,
                 grouped_id=grouped_id,
                 original_text=caption if is_first else None,
-                media_type=self._get_media_type(msg),
-                media_file_id=file_id,
-                media_access_hash=access_hash,
-                media_file_reference=file_ref,
+                media_type=msg.media_type,
+                media_file_id=msg.media_file_id,
+                media_access_hash=msg.media_access_hash,
+                media_file_reference=msg.media_file_reference,
                 original_chat_id=chat_id,
-                original_message_id=msg.id,
-                rewrite_status='skipped',  # Рерайт будет в processor для всего альбома
-                awaiting_text=False
-            )
+                original_message_id=msg.message_id,
+                rewrite_status='pending' if is_album_job else 'skipped',  # рерайт альбома — один на голову
+                # Голова альбома без подписи ждёт текст: до awaiting_until сборщик альбом не берёт
+                awaiting_text=is_first and caption is None,
+                awaiting_until=until if is_first and caption is None else None,
+                ready_to_post=False
+            ))
+
+        stmt = pg_insert(MessageQueue).values(rows).on_conflict_do_nothing(
+            constraint='uq_source_message'
+        ).returning(MessageQueue.message_id, MessageQueue.id)
+        result = await self.db.execute(stmt)
+        inserted = dict(result.all())  # message_id → id строки
 
-            self.db.add(queue_msg)
-            saved_count += 1
+        saved_count = len(inserted)
+        duplicates = [msg_id for msg_id in msg_ids if msg_id not in inserted]
 
-        await self.db.commit()
+        if not inserted:
+            await self.db.commit()
+        elif head_id in inserted and caption:
+            await pipeline.commit(self.db, pipeline.REWRITE)
+        elif head_id in inserted:
+            # Без подписи: BUILD разбудит GluingEngine, когда окно склейки закроется
+            await self.db.commit()
+        else:
+            await pipeline.commit(self.db, pipeline.BUILD)
+
+        # Текст, пришедший после альбома, приклеится к его голове
+        if head_id in inserted:
+            self.gluing.register_album(
+                chat_id, grouped_id, inserted[head_id], head_id,
+                has_text=caption is not None,
+                until=until
+            )
 
         logger.info(
             f"✅ Альбом сохранен: grouped_id={grouped_id}, "
@@ -117,44 +135,32 @@ class MessageCollector:
                 f"(уже были обработаны ранее)"
             )
 
-    async def collect_message(self, event):
+    async def collect_message(self, msg: IncomingItem):
         """
         Сохраняет сообщение в очередь с умной логикой склейки
 
+        Дубликаты отсекаются самим INSERT ... ON CONFLICT (source_id, message_id)
+        DO NOTHING — без предварительного SELECT.
+
         Обрабатывает 4 случая:
         1. Текст без медиа → проверяем ожидающее медиа
         2. Медиа + текст → обычное сохранение
         3. Медиа без текста → помечаем "ждём текст"
         4. Пустое → игнорируем
         """
-        msg = event.message
-        chat_id = event.chat_id
+        chat_id = msg.chat_id
+
+        # Определяем тип сообщения
+        has_media = msg.has_media
+        has_text = msg.has_text
 
         # ДИАГНОСТИКА: логируем ВСЕ входящие сообщения (DEST канал фильтруется в bot_logic.py)
-        has_media_debug = bool(msg.photo or msg.video or msg.document or msg.voice)
-        has_text_debug = bool(msg.message and len(msg.message.strip()) > 0)
         logger.info(
-            f"📥 Входящее: {chat_id}/{msg.id} "
+            f"📥 Входящее: {chat_id}/{msg.message_id} "
             f"grouped_id={msg.grouped_id} "
-            f"has_media={has_media_debug} has_text={has_text_debug} "
-            f"media_type={type(msg.media).__name__ if msg.media else None}"
+            f"has_media={has_media} has_text={has_text} "
+            f"media_type={msg.media_type}"
         )
-
-        # Проверяем дубликат
-        stmt = select(MessageQueue).where(
-            MessageQueue.source_id == chat_id,
-            MessageQueue.message_id == msg.id
-        )
-        result = await self.db.execute(stmt)
-        existing = result.scalar_one_or_none()
-        
-        if existing:
-            logger.debug(f"⏭️ Дубликат: {chat_id}/{msg.id}")
-            return
-        
-        # Определяем тип сообщения
-        has_media = msg.photo or msg.video or msg.document or msg.voice
-        has_text = msg.message and len(msg.message.strip()) > 0
         
         # СЛУЧАЙ 1: Текст без медиа
         if has_text and not has_media:
@@ -172,133 +178,100 @@ class MessageCollector:
             return
         
         # СЛУЧАЙ 4: Пустое сообщение
-        logger.debug(f"⏭️ Пустое сообщение: {chat_id}/{msg.id}")
+        logger.debug(f"⏭️ Пустое сообщение: {chat_id}/{msg.message_id}")
     
     async def _handle_text_message(self, msg, chat_id):
         """
         Обработка текста без медиа
 
-        Проверяем:
-        1. Есть ли одиночное медиа, которое ждёт текст (awaiting_text)
-        2. Есть ли недавний альбом без текста от этого источника
+        Цель склейки ищется в памяти (GluingEngine), без запросов к БД:
+        1. Одиночное медиа, которое ждёт текст (awaiting_text)
+        2. Недавний альбом без текста от этого источника
         3. Иначе — обычное текстовое сообщение
-        """
-        now = datetime.utcnow()
 
-        # 1. Ищем одиночное медиа, которое ждёт текст
-        stmt = select(MessageQueue).where(
-            and_(
-                MessageQueue.source_id == chat_id,
-                MessageQueue.awaiting_text == True,
-                MessageQueue.awaiting_until > now,
-                MessageQueue.message_id < msg.id
+        В БД пишется только итог склейки — одним условным UPDATE.
+        Если строку уже закрыли (тайм-аут, другая реплика), текст сохраняется отдельно.
+        """
+        target = self.gluing.match_text(chat_id, msg.message_id)
+
+        # 1. Склеиваем с одиночным медиа
+        if isinstance(target, PendingMedia):
+            stmt = update(MessageQueue).where(
+                MessageQueue.id == target.row_id,
+                MessageQueue.awaiting_text == True
+            ).values(
+                original_text=msg.text,
+                awaiting_text=False,
+                linked_message_id=msg.message_id,
+                rewrite_status='pending'
             )
-        ).order_by(MessageQueue.message_id.desc()).limit(1)
-
-        result = await self.db.execute(stmt)
-        media_msg = result.scalar_one_or_none()
-
-        if media_msg:
-            # ✅ Склеиваем с одиночным медиа
-            media_msg.original_text = msg.message
-            media_msg.awaiting_text = False
-            media_msg.linked_message_id = msg.id
-            media_msg.rewrite_status = 'pending'
-
+            result = await self.db.execute(stmt)
+            if result.rowcount:
+                await pipeline.commit(self.db, pipeline.REWRITE)
+                logger.info(f"🔗 Склеено: медиа {target.message_id} + текст {msg.message_id}")
+                return
             await self.db.commit()
-            logger.info(f"🔗 Склеено: медиа {media_msg.message_id} + текст {msg.id}")
-            return
-
-        # 2. Ищем недавний альбом без текста от этого источника
-        album_cutoff = now - timedelta(seconds=AWAIT_TEXT_TIMEOUT)
 
-        # Находим любое медиа из недавнего альбома
-        stmt = select(MessageQueue).where(
-            and_(
-                MessageQueue.source_id == chat_id,
-                MessageQueue.grouped_id.isnot(None),
+        # 2. Альбом без текста — прикрепляем текст к первому медиа (голове)
+        elif isinstance(target, RecentAlbum):
+            stmt = update(MessageQueue).where(
+                MessageQueue.id == target.head_row_id,
+                MessageQueue.awaiting_text == True,  # окно склейки ещё открыто, сборщик альбом не брал
                 MessageQueue.ready_to_post == False,
-                MessageQueue.collected_at > album_cutoff,
-                MessageQueue.message_id < msg.id
+                or_(MessageQueue.original_text.is_(None), MessageQueue.original_text == '')
+            ).values(
+                original_text=msg.text,
+                awaiting_text=False,
+                linked_message_id=msg.message_id,
+                rewrite_status='pending'  # рерайт альбома — обычным этапом rewriter
             )
-        ).order_by(MessageQueue.collected_at.desc()).limit(1)
-
-        result = await self.db.execute(stmt)
-        album_msg = result.scalar_one_or_none()
-
-        if album_msg:
-            # Используем Lock для синхронизации привязки текста к альбому
-            async with self._album_locks[album_msg.grouped_id]:
-                # Проверяем: есть ли уже текст в этом альбоме?
-                stmt_check = select(MessageQueue).where(
-                    and_(
-                        MessageQueue.source_id == chat_id,
-                        MessageQueue.grouped_id == album_msg.grouped_id,
-                        MessageQueue.original_text.isnot(None),
-                        MessageQueue.original_text != ''
-                    )
-                ).limit(1)
-                result_check = await self.db.execute(stmt_check)
-                has_text = result_check.scalar_one_or_none()
-
-                if not has_text:
-                    # ✅ Альбом без текста — прикрепляем текст к первому медиа
-                    stmt_first = select(MessageQueue).where(
-                        and_(
-                            MessageQueue.source_id == chat_id,
-                            MessageQueue.grouped_id == album_msg.grouped_id
-                        )
-                    ).order_by(MessageQueue.message_id).limit(1)
-                    result_first = await self.db.execute(stmt_first)
-                    first_media = result_first.scalar_one_or_none()
-
-                    if first_media:
-                        first_media.original_text = msg.message
-                        first_media.linked_message_id = msg.id
-                        # Сбрасываем таймер альбома (даём время на сборку)
-                        await self._update_album_collected_at(chat_id, album_msg.grouped_id)
-                        await self.db.commit()
-                        logger.info(
-                            f"🔗 Склеено: альбом grouped_id={album_msg.grouped_id} "
-                            f"+ текст {msg.id}"
-                        )
-                        return
+            result = await self.db.execute(stmt)
+            if result.rowcount:
+                # Сбрасываем таймер альбома (даём время на сборку)
+                await self._update_album_collected_at(chat_id, target.grouped_id)
+                await pipeline.commit(self.db, pipeline.REWRITE)
+                logger.info(
+                    f"🔗 Склеено: альбом grouped_id={target.grouped_id} "
+                    f"+ текст {msg.message_id}"
+                )
+                return
+            await self.db.commit()
 
         # 3. Обычное текстовое сообщение
-        queue_msg = MessageQueue(
+        saved = await self._save(
+            pipeline.REWRITE,
             source_id=chat_id,
-            message_id=msg.id,
+            message_id=msg.message_id,
             grouped_id=msg.grouped_id,
-            original_text=msg.message,
+            original_text=msg.text,
             media_type=None,
             rewrite_status='pending'
         )
-        self.db.add(queue_msg)
-        await self.db.commit()
-        logger.info(f"✅ Текст без медиа: {chat_id}/{msg.id} (grouped_id={msg.grouped_id})")
+        if not saved:
+            return
+        logger.info(f"✅ Текст без медиа: {chat_id}/{msg.message_id} (grouped_id={msg.grouped_id})")
 
     async def _handle_media_with_text(self, msg, chat_id):
         """Обработка одиночного медиа + текст (альбомы обрабатываются в collect_album)"""
-        file_id, access_hash, file_ref = self._extract_media_data(msg)
-
         # Одиночное медиа (альбомы не должны попадать сюда)
-        queue_msg = MessageQueue(
+        saved = await self._save(
+            pipeline.REWRITE,
             source_id=chat_id,
-            message_id=msg.id,
+            message_id=msg.message_id,
             grouped_id=None,
-            original_text=msg.message,
-            media_type=self._get_media_type(msg),
-            media_file_id=file_id,
-            media_access_hash=access_hash,
-            media_file_reference=file_ref,
+            original_text=msg.text,
+            media_type=msg.media_type,
+            media_file_id=msg.media_file_id,
+            media_access_hash=msg.media_access_hash,
+            media_file_reference=msg.media_file_reference,
             original_chat_id=chat_id,
-            original_message_id=msg.id,
+            original_message_id=msg.message_id,
             rewrite_status='pending',
             awaiting_text=False
         )
-        self.db.add(queue_msg)
-        await self.db.commit()
-        logger.info(f"✅ Медиа+текст (одиночное): {chat_id}/{msg.id}")
+        if not saved:
+            return
+        logger.info(f"✅ Медиа+текст (одиночное): {chat_id}/{msg.message_id}")
 
     async def _handle_media_without_text(self, msg, chat_id):
         """
@@ -306,39 +279,71 @@ class MessageCollector:
 
         Логика: одиночное медиа → ждём текст 20 сек
         """
-        file_id, access_hash, file_ref = self._extract_media_data(msg)
-
         # Одиночное медиа — ЖДЁМ текст
         awaiting_until = datetime.utcnow() + timedelta(seconds=AWAIT_TEXT_TIMEOUT)
 
-        queue_msg = MessageQueue(
+        row_id = await self._insert(
             source_id=chat_id,
-            message_id=msg.id,
+            message_id=msg.message_id,
             grouped_id=None,
             original_text=None,
-            media_type=self._get_media_type(msg),
-            media_file_id=file_id,
-            media_access_hash=access_hash,
-            media_file_reference=file_ref,
+            media_type=msg.media_type,
+            media_file_id=msg.media_file_id,
+            media_access_hash=msg.media_access_hash,
+            media_file_reference=msg.media_file_reference,
             original_chat_id=chat_id,
-            original_message_id=msg.id,
+            original_message_id=msg.message_id,
             rewrite_status='skipped',
             awaiting_text=True,  # ЖДЁМ текст
             awaiting_until=awaiting_until
         )
-
-        self.db.add(queue_msg)
+        if row_id is None:
+            return
         await self.db.commit()
-        logger.info(f"⏳ Одиночное медиа без текста (ждём {AWAIT_TEXT_TIMEOUT}с): {chat_id}/{msg.id}")
+        self.gluing.register_media(chat_id, msg.message_id, row_id, awaiting_until)
+        logger.info(f"⏳ Одиночное медиа без текста (ждём {AWAIT_TEXT_TIMEOUT}с): {chat_id}/{msg.message_id}")
     
+    async def _save(self, stage: str, **values) -> bool:
+        """
+        Сохраняет "конечную" строку (от неё не зависит дальнейшая склейка)
+
+        Через буфер записи, если он включён, иначе — сразу отдельной транзакцией.
+        Возвращает False только для дубликата, обнаруженного при прямой записи
+        """
+        if self.write_buffer is not None:
+            values.setdefault('ready_to_post', False)
+            await self.write_buffer.put(stage, **values)
+            return True
+
+        if await self._insert(**values) is None:
+            return False
+        await pipeline.commit(self.db, stage)
+        return True
+
+    async def _insert(self, **values) -> int | None:
+        """
+        INSERT ... ON CONFLICT (source_id, message_id) DO NOTHING RETURNING id
+
+        Возвращает id строки или None, если сообщение уже есть в очереди (дубликат)
+        """
+        values.setdefault('ready_to_post', False)
+        stmt = pg_insert(MessageQueue).values(**values).on_conflict_do_nothing(
+            constraint='uq_source_message'
+        ).returning(MessageQueue.id)
+
+        result = await self.db.execute(stmt)
+        row_id = result.scalar_one_or_none()
+        if row_id is None:
+            logger.debug(f"⏭️ Дубликат: {values['source_id']}/{values['message_id']}")
+        return row_id
+
     async def _update_album_collected_at(self, chat_id: int, grouped_id: int):
         """
         Обновляет collected_at у всех медиа в альбоме
 
         Используется только когда текст приходит ПОСЛЕ альбома
+        (commit — в вызывающем коде, вместе с самой склейкой)
         """
-        from sqlalchemy import update
-
         now = datetime.utcnow()
 
         stmt = update(MessageQueue).where(
@@ -350,37 +355,5 @@ class MessageCollector:
         ).values(collected_at=now)
 
         await self.db.execute(stmt)
-        await self.db.commit()
 
         logger.debug(f"🔗 Альбом {grouped_id}: обновлен collected_at (привязан текст)")
-
-    def _extract_media_data(self, msg):
-        """Извлекает file_id, access_hash, file_reference из медиа"""
-        file_id, access_hash, file_ref = None, None, None
-        
-        if msg.photo:
-            file_id = msg.photo.id
-            access_hash = msg.photo.access_hash
-            file_ref = msg.photo.file_reference
-        elif msg.video:
-            file_id = msg.video.id
-            access_hash = msg.video.access_hash
-            file_ref = msg.video.file_reference
-        elif msg.document:
-            file_id = msg.document.id
-            access_hash = msg.document.access_hash
-            file_ref = msg.document.file_reference
-        
-        return file_id, access_hash, file_ref
-    
-    def _get_media_type(self, msg):
-        """Определяет тип медиа"""
-        if msg.photo:
-            return 'photo'
-        if msg.video:
-            return 'video'
-        if msg.document:
-            return 'document'
-        if msg.voice:
-            return 'voice'
-        return 'other'
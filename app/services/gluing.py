@@ -0,0 +1,292 @@
+from sqlalchemy import select, update, and_, or_
+from app.database.engine import SessionLocal
+from app.models.message import MessageQueue
+from app.config import AWAIT_TEXT_TIMEOUT, GLUING_TICK_MS
+from app import metrics, pipeline
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel
+
+    Таймер попадает в слот (deadline_tick % slots); schedule/cancel — O(1),
+    advance() проходит только слоты тиков, прошедших с прошлого вызова.
+    Точность срабатывания — один тик.
+    """
+
+    def __init__(self, tick: float, slots: int = 512):
+        self.tick = tick
+        self._slots = [dict() for _ in range(slots)]  # key → deadline_tick
+        self._where = {}  # key → индекс слота
+        self._current_tick = None
+
+    def __len__(self):
+        return len(self._where)
+
+    def _to_tick(self, moment: float) -> int:
+        return int(moment / self.tick)
+
+    def schedule(self, key, deadline: float, now: float):
+        """Ставит (или переставляет) таймер key на момент deadline (now — текущий loop.time())"""
+        self.cancel(key)
+        if self._current_tick is None:
+            self._current_tick = self._to_tick(now) - 1
+        deadline_tick = self._to_tick(deadline)
+        if deadline_tick <= self._current_tick:
+            deadline_tick = self._current_tick + 1  # уже просрочен — сработает на ближайшем тике
+        slot = deadline_tick % len(self._slots)
+        self._slots[slot][key] = deadline_tick
+        self._where[key] = slot
+
+    def cancel(self, key) -> bool:
+        slot = self._where.pop(key, None)
+        if slot is None:
+            return False
+        self._slots[slot].pop(key, None)
+        return True
+
+    def advance(self, now: float) -> list:
+        """Сдвигает колесо до момента now и возвращает ключи сработавших таймеров"""
+        now_tick = self._to_tick(now)
+        if self._current_tick is None:
+            self._current_tick = now_tick
+            return []
+
+        expired = []
+        # Если простояли больше оборота — достаточно одного прохода по всем слотам
+        first = max(self._current_tick + 1, now_tick - len(self._slots) + 1)
+        for tick in range(first, now_tick + 1):
+            slot = self._slots[tick % len(self._slots)]
+            if not slot:
+                continue
+            due = [key for key, deadline_tick in slot.items() if deadline_tick <= now_tick]
+            for key in due:
+                del slot[key]
+                del self._where[key]
+            expired.extend(due)
+
+        self._current_tick = max(self._current_tick, now_tick)
+        return expired
+
+
+@dataclass(slots=True)
+class PendingMedia:
+    """Одиночное медиа, ждущее текст"""
+    chat_id: int
+    message_id: int
+    row_id: int
+
+
+@dataclass(slots=True)
+class RecentAlbum:
+    """Последний альбом источника, к которому ещё можно приклеить текст"""
+    chat_id: int
+    grouped_id: int
+    head_row_id: int
+    head_message_id: int
+    has_text: bool
+
+
+class GluingEngine:
+    """
+    In-memory склейка медиа и текста
+
+    Для каждого источника держит ожидающие текст медиа и последний альбом.
+    Текст сопоставляется с ними в памяти (без запросов к БД), в БД пишется
+    только итог: склейка (collector) или закрытие по таймауту (здесь).
+
+    Таймауты — на hashed timer wheel с тиком GLUING_TICK_MS, поэтому медиа
+    закрывается ровно к awaiting_until, а не на следующем проходе поллинга.
+    При старте состояние восстанавливается из БД (restore()).
+    """
+
+    def __init__(self, tick_ms: int = GLUING_TICK_MS):
+        self._wheel = TimerWheel(tick_ms / 1000)
+        self._media = {}  # chat_id → {message_id: PendingMedia}
+        self._albums = {}  # chat_id → RecentAlbum
+        self._album_timers = {}  # (chat_id, grouped_id) → RecentAlbum (и вытесненные более новым альбомом)
+        self._wakeup = asyncio.Event()
+
+    def _now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    @staticmethod
+    def _deadline(until: datetime, now: float) -> float:
+        """awaiting_until (UTC) → момент loop.time()"""
+        return now + (until - datetime.utcnow()).total_seconds()
+
+    # ============================================
+    # РЕГИСТРАЦИЯ
+    # ============================================
+
+    def register_media(self, chat_id: int, message_id: int, row_id: int, awaiting_until: datetime):
+        """Медиа без текста сохранено с awaiting_text=True — ждём текст"""
+        self._media.setdefault(chat_id, {})[message_id] = PendingMedia(chat_id, message_id, row_id)
+        now = self._now()
+        self._wheel.schedule(('media', chat_id, message_id), self._deadline(awaiting_until, now), now)
+        self._wakeup.set()
+
+    def register_album(self, chat_id: int, grouped_id: int, head_row_id: int,
+                       head_message_id: int, has_text: bool, until: datetime):
+        """Альбом сохранён — в течение AWAIT_TEXT_TIMEOUT к нему можно приклеить текст"""
+        album = RecentAlbum(chat_id, grouped_id, head_row_id, head_message_id, has_text)
+        self._albums[chat_id] = album
+        self._album_timers[(chat_id, grouped_id)] = album
+        now = self._now()
+        self._wheel.schedule(('album', chat_id, grouped_id), self._deadline(until, now), now)
+        self._wakeup.set()
+
+    # ============================================
+    # СОПОСТАВЛЕНИЕ
+    # ============================================
+
+    def match_text(self, chat_id: int, text_message_id: int):
+        """
+        Ищет, к чему приклеить текст
+
+        Порядок как раньше в БД-версии:
+        1. Последнее ожидающее медиа источника с message_id < текста
+        2. Последний альбом источника, если в нём ещё нет текста
+
+        Возвращает PendingMedia / RecentAlbum (цель сразу снимается с ожидания) или None
+        """
+        pending = self._media.get(chat_id)
+        if pending:
+            candidates = [mid for mid in pending if mid < text_message_id]
+            if candidates:
+                media = pending.pop(max(candidates))
+                if not pending:
+                    del self._media[chat_id]
+                self._wheel.cancel(('media', chat_id, media.message_id))
+                metrics.inc('gluing.media_matched')
+                return media
+
+        album = self._albums.get(chat_id)
+        if album and album.head_message_id < text_message_id and not album.has_text:
+            album.has_text = True
+            metrics.inc('gluing.album_matched')
+            return album
+
+        return None
+
+    # ============================================
+    # ТАЙМАУТЫ
+    # ============================================
+
+    async def run(self):
+        """Единственный sweeper: крутит колесо и закрывает просроченные медиа и альбомы"""
+        tick = self._wheel.tick
+        while True:
+            if not len(self._wheel):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+
+            await asyncio.sleep(tick)
+
+            expired_media, expired_albums = [], []
+            for kind, chat_id, item_id in self._wheel.advance(self._now()):
+                if kind == 'media':
+                    media = self._media.get(chat_id, {}).pop(item_id, None)
+                    if self._media.get(chat_id) == {}:
+                        del self._media[chat_id]
+                    if media:
+                        expired_media.append(media)
+                else:
+                    album = self._album_timers.pop((chat_id, item_id), None)
+                    if self._albums.get(chat_id) is album:
+                        del self._albums[chat_id]
+                    if album and not album.has_text:
+                        expired_albums.append(album)
+
+            if expired_media or expired_albums:
+                try:
+                    await self._close_expired(expired_media, expired_albums)
+                except Exception as e:
+                    # Не страшно: строки закроет страховочный close_expired_awaiting
+                    logger.error(f"❌ Ошибка закрытия ожидающих медиа: {e}", exc_info=True)
+
+    async def _close_expired(self, expired: list[PendingMedia], albums: list[RecentAlbum] = ()):
+        """
+        Медиа и альбомы так и не дождались текста — публикуем как есть
+
+        Снятый с головы альбома awaiting_text открывает альбом для сборщика
+        (_select_complete_albums), поэтому BUILD будится именно здесь
+        """
+        row_ids = [m.row_id for m in expired] + [a.head_row_id for a in albums]
+        async with SessionLocal() as session:
+            stmt = update(MessageQueue).where(
+                MessageQueue.id.in_(row_ids),
+                MessageQueue.awaiting_text == True
+            ).values(
+                awaiting_text=False,
+                original_text="",
+                rewrite_status='skipped'
+            )
+            result = await session.execute(stmt)
+            await pipeline.commit(session, pipeline.BUILD)
+
+        metrics.inc('gluing.media_expired', result.rowcount)
+        for media in expired:
+            logger.info(f"📸 Медиа без текста (тайм-аут): {media.chat_id}/{media.message_id}")
+        for album in albums:
+            logger.info(f"📸 Альбом без текста (тайм-аут): {album.chat_id} grouped_id={album.grouped_id}")
+
+    # ============================================
+    # ВОССТАНОВЛЕНИЕ ПОСЛЕ РЕСТАРТА
+    # ============================================
+
+    async def restore(self):
+        """Поднимает ожидающие медиа и недавние альбомы из БД"""
+        now = datetime.utcnow()
+
+        async with SessionLocal() as session:
+            stmt = select(MessageQueue).where(
+                MessageQueue.awaiting_text == True,
+                MessageQueue.grouped_id.is_(None)
+            )
+            awaiting = (await session.execute(stmt)).scalars().all()
+
+            # Недавние альбомы и альбомы, голова которых ещё ждёт текст
+            stmt = select(MessageQueue).where(
+                and_(
+                    MessageQueue.grouped_id.isnot(None),
+                    MessageQueue.ready_to_post == False,
+                    or_(
+                        MessageQueue.collected_at > now - timedelta(seconds=AWAIT_TEXT_TIMEOUT),
+                        MessageQueue.awaiting_text == True
+                    )
+                )
+            ).order_by(MessageQueue.message_id)
+            album_rows = (await session.execute(stmt)).scalars().all()
+
+        for row in awaiting:
+            self.register_media(row.source_id, row.message_id, row.id, row.awaiting_until or now)
+
+        albums = {}  # (chat_id, grouped_id) → строки по возрастанию message_id
+        for row in album_rows:
+            albums.setdefault((row.source_id, row.grouped_id), []).append(row)
+
+        # Берём последний альбом каждого источника
+        latest = {}
+        for (chat_id, _), rows in albums.items():
+            if chat_id not in latest or rows[0].message_id > latest[chat_id][0].message_id:
+                latest[chat_id] = rows
+
+        for chat_id, rows in latest.items():
+            head = rows[0]
+            has_text = any(r.original_text for r in rows)
+            if head.awaiting_text:
+                until = head.awaiting_until or now
+            else:
+                until = max(r.collected_at for r in rows) + timedelta(seconds=AWAIT_TEXT_TIMEOUT)
+            self.register_album(chat_id, head.grouped_id, head.id, head.message_id, has_text, until)
+
+        logger.info(
+            f"✅ Склейка восстановлена: ожидающих медиа={len(awaiting)}, альбомов={len(latest)}"
+        )
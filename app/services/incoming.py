@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from datetime import datetime
+
+# Медиа, которые коллектор склеивает с текстом; прочее (опрос, геопозиция, превью ссылки) — 'other'
+_MEDIA_TYPES = ('photo', 'video', 'document', 'voice')
+
+
+@dataclass(slots=True)
+class IncomingItem:
+    """
+    Компактное представление входящего сообщения
+
+    Извлекается из Telethon Message сразу в handler — дальше (сборка альбома,
+    collector) тяжёлый объект с entities, peer и ссылкой на клиент не держим.
+    Здесь только то, что реально пишется в message_queue.
+    """
+    chat_id: int
+    message_id: int
+    grouped_id: int | None
+    text: str | None
+    date: datetime | None
+    media_type: str | None = None  # photo / video / document / voice / other
+    media_file_id: int | None = None
+    media_access_hash: int | None = None
+    media_file_reference: bytes | None = None
+
+    @property
+    def has_text(self) -> bool:
+        return bool(self.text and self.text.strip())
+
+    @property
+    def has_media(self) -> bool:
+        return self.media_type in _MEDIA_TYPES
+
+    @classmethod
+    def from_message(cls, chat_id: int, msg) -> 'IncomingItem':
+        """Извлекает нужные поля из Telethon Message"""
+        media_type = 'other' if msg.media else None
+        media_obj = None
+        if msg.photo:
+            media_type, media_obj = 'photo', msg.photo
+        elif msg.video:
+            media_type, media_obj = 'video', msg.video
+        elif msg.document:
+            media_type, media_obj = 'document', msg.document
+        elif msg.voice:
+            media_type = 'voice'
+
+        return cls(
+            chat_id=chat_id,
+            message_id=msg.id,
+            grouped_id=msg.grouped_id,
+            text=msg.message,
+            date=msg.date,
+            media_type=media_type,
+            media_file_id=media_obj.id if media_obj else None,
+            media_access_hash=media_obj.access_hash if media_obj else None,
+            media_file_reference=media_obj.file_reference if media_obj else None,
+        )
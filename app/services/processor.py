@@ -1,14 +1,48 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, or_, func
+from sqlalchemy import select, update, and_, or_, func, case, tuple_
 from app.models.message import MessageQueue
 from app.models.post import Post, PostMedia
+from app.services.rewrite_cache import rewrite_cache
+from app.services.near_dup import near_dup_index, simhash, to_signed, to_unsigned
+from app.text_preprocess import preprocess
 
-from app import ai
-from datetime import datetime
+from app import ai, metrics, pipeline
+from app.config import (
+    REWRITE_WORKERS, REWRITE_BATCH_SIZE, REWRITE_BATCH_MAX_CHARS, REWRITE_LEASE_SECONDS, WORKER_ID, AWAITING_SAFETY_GRACE, NEAR_DUP_MODE,
+    MEDIA_DEDUP_MODE, MEDIA_DEDUP_DAYS, PREPROCESS,
+)
+from datetime import datetime, timedelta
+import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
+REWRITE_BATCH_LIMIT = 50  # сообщений за один проход rewriter
+BUILD_ALBUM_BATCH_LIMIT = 50  # альбомов за один проход post_builder
+BUILD_SINGLE_BATCH_LIMIT = 200  # одиночных за один проход post_builder
+
+# Сообщение готово к сборке: рерайт готов или это медиа без рерайта
+_READY_TO_BUILD = or_(
+    MessageQueue.rewrite_status == 'done',
+    and_(
+        MessageQueue.rewrite_status == 'skipped',
+        MessageQueue.media_type.isnot(None)
+    )
+)
+
+# Посты, медиа которых считаются уже опубликованными (для дедупликации по медиа)
+_MEDIA_DEDUP_STATUSES = ('scheduled', 'posting', 'posted')
+
+# Для альбома неудачный рерайт головы не блокирует сборку (публикуем оригинал);
+# голова без подписи, ждущая текст (awaiting_text), — блокирует до закрытия окна склейки
+_ALBUM_MEMBER_READY = and_(
+    MessageQueue.awaiting_text.isnot(True),
+    or_(
+        _READY_TO_BUILD,
+        MessageQueue.rewrite_status == 'failed'
+    )
+)
+
 
 class MessageProcessor:
     """
@@ -23,204 +57,604 @@ class MessageProcessor:
     def __init__(self, db_session: AsyncSession):
         self.db = db_session
     
-    async def process_pending_rewrites(self):
+    async def process_pending_rewrites(self) -> int:
         """
         Шаг 1: Рерайт текстов
         
-        Обрабатывает сообщения со статусом 'pending'
+        Обрабатывает сообщения со статусом 'pending' параллельно:
+        до REWRITE_WORKERS запросов к AI одновременно (лимиты по ключам
+        и моделям соблюдает app.ai). Короткие тексты с REWRITE_BATCH_SIZE > 1
+        уходят пакетами (_plan_batches). Результаты пишутся в БД по мере готовности.
+
+        Возвращает количество взятых в работу сообщений
+        """
+        claimed = await self._claim_pending_rewrites(REWRITE_BATCH_LIMIT)
+        
+        if not claimed:
+            return 0
+
+        messages = await self._resolve_near_duplicates(claimed)
+        messages, texts = await self._prepare_texts(messages)
+        if not messages:
+            return len(claimed)
+        
+        workers = REWRITE_WORKERS or ai.max_concurrency()
+        logger.info(f"📝 Взято {len(messages)} сообщений для рерайта (параллельно: {workers})")
+
+        # Сеть — параллельно, запись в БД — последовательно (одна сессия)
+        semaphore = asyncio.Semaphore(workers)
+
+        async def rewrite(msg):
+            text = texts[msg.id]
+            cached = await self._cached_rewrite(text)
+            if cached is not None:
+                logger.info(f"💾 Рерайт из кэша: msg_id={msg.id}")
+                return [(msg, cached, None)]
+
+            async with semaphore:
+                try:
+                    result = await ai.rewrite_text_async(text, album=msg.grouped_id is not None)
+                except Exception as e:
+                    return [(msg, None, e)]
+
+            await self._cache_rewrite(text, result)
+            return [(msg, result, None)]
+
+        async def rewrite_batch(batch):
+            # Попадания в кэш — сразу, остальное одним запросом
+            done, to_send = [], []
+            for msg in batch:
+                cached = await self._cached_rewrite(texts[msg.id])
+                if cached is not None:
+                    logger.info(f"💾 Рерайт из кэша: msg_id={msg.id}")
+                    done.append((msg, cached, None))
+                else:
+                    to_send.append(msg)
+            if len(to_send) < 2:
+                for msg in to_send:
+                    done.extend(await rewrite(msg))
+                return done
+
+            async with semaphore:
+                results = await ai.rewrite_batch_async(
+                    [texts[msg.id] for msg in to_send],
+                    album=any(msg.grouped_id is not None for msg in to_send),
+                )
+
+            for msg, result in zip(to_send, results):
+                if result is None:
+                    done.extend(await rewrite(msg))  # невалидный элемент — поодиночке
+                    continue
+                await self._cache_rewrite(texts[msg.id], result)
+                done.append((msg, result, None))
+            return done
+
+        singles, batches = self._plan_batches(messages, texts)
+        if batches:
+            logger.info(f"📦 Пакетный рерайт: {sum(map(len, batches))} коротких текстов в {len(batches)} запросах")
+
+        jobs = [rewrite(msg) for msg in singles] + [rewrite_batch(batch) for batch in batches]
+        for next_done in asyncio.as_completed(jobs):
+            for msg, rewritten, error in await next_done:
+                await self._save_rewrite(msg, rewritten, error)
+
+        return len(claimed)
+
+    @staticmethod
+    def _plan_batches(messages: list[MessageQueue], texts: dict[int, str]):
+        """
+        Раскладка на пакетный и одиночный рерайт
+
+        Тексты не длиннее REWRITE_BATCH_MAX_CHARS собираются в пакеты по
+        REWRITE_BATCH_SIZE (app.ai.rewrite_batch_async); длинные и остаток
+        из одного текста идут поодиночке. Возвращает (одиночные, пакеты)
+        """
+        if REWRITE_BATCH_SIZE < 2:
+            return messages, []
+
+        singles, short = [], []
+        for msg in messages:
+            (short if len(texts[msg.id]) <= REWRITE_BATCH_MAX_CHARS else singles).append(msg)
+
+        batches = [short[i:i + REWRITE_BATCH_SIZE] for i in range(0, len(short), REWRITE_BATCH_SIZE)]
+        if batches and len(batches[-1]) == 1:
+            singles.extend(batches.pop())
+        return singles, batches
+    
+    async def _resolve_near_duplicates(self, messages: list[MessageQueue]) -> list[MessageQueue]:
+        """
+        Отсев near-duplicate до вызова LLM
+
+        Отпечаток (посчитан при захвате) ищется в LSH-индексе процесса;
+        перед поиском индекс добирает отпечатки других реплик (sync).
+        Оригиналом считается только более раннее сообщение (меньший id).
+        - skip: повтор помечается 'duplicate' и не публикуется
+          (для альбома — все его строки, иначе сборка альбома не завершится).
+          Сравнивается и медиа: тот же текст с другими фото — новый пост
+        - reuse: если у оригинала уже есть рерайт — берём его, LLM не вызываем
+        Уникальные сообщения попадают в индекс и идут на рерайт.
+
+        Возвращает сообщения, которым нужен рерайт
+        """
+        if NEAR_DUP_MODE == 'off':
+            return messages
+
+        await near_dup_index.sync(self.db)
+
+        to_rewrite = []
+        for msg in messages:
+            if msg.text_simhash is None:
+                to_rewrite.append(msg)
+                continue
+
+            fingerprint = to_unsigned(msg.text_simhash)
+            match = near_dup_index.find(fingerprint, before_row=msg.id)
+            if match is None:
+                near_dup_index.add(fingerprint, msg.id)
+                to_rewrite.append(msg)
+                continue
+
+            original_id, distance = match
+            metrics.inc('near_dup.hit')
+
+            if NEAR_DUP_MODE == 'reuse':
+                reused = await self._reuse_rewrite(original_id)
+                if reused is None:
+                    to_rewrite.append(msg)
+                else:
+                    logger.info(f"♻️ Near-duplicate msg_id={msg.id} ≈ {original_id} (d={distance}): рерайт оригинала")
+                    await self._save_rewrite(msg, reused, None)
+                continue
+
+            if await self._media_ids(msg.id) != await self._media_ids(original_id):
+                metrics.inc('near_dup.media_differs')
+                logger.info(f"🖼 Near-duplicate msg_id={msg.id} ≈ {original_id} (d={distance}): другие медиа, рерайт")
+                to_rewrite.append(msg)
+                continue
+
+            await self._mark_duplicate(msg, original_id)
+            logger.info(f"🚫 Near-duplicate msg_id={msg.id} ≈ {original_id} (d={distance}): пропущено")
+
+        return to_rewrite
+
+    async def _prepare_texts(self, messages: list[MessageQueue]) -> tuple[list[MessageQueue], dict[int, str]]:
+        """
+        Локальная предобработка перед LLM (app/text_preprocess.py)
+
+        Цены, телефоны, @username и ссылки вырезаются регулярками. Если после
+        чистки переписывать нечего (пусто или одни контакты) — сообщение
+        помечается 'skipped' без вызова LLM.
+
+        Возвращает (сообщения для рерайта, id → текст для LLM)
+        """
+        if not PREPROCESS:
+            return messages, {msg.id: msg.original_text for msg in messages}
+
+        to_rewrite, texts = [], {}
+        for msg in messages:
+            prepared = preprocess(msg.original_text)
+            if prepared.skip:
+                await self._skip_rewrite(msg)
+                continue
+            to_rewrite.append(msg)
+            texts[msg.id] = prepared.text
+
+        return to_rewrite, texts
+
+    async def _skip_rewrite(self, msg: MessageQueue):
+        """Рерайт не нужен: медиа публикуются без текста, текст без медиа — никуда"""
+        text_only = msg.media_type is None and msg.grouped_id is None
+
+        stmt = update(MessageQueue).where(
+            MessageQueue.id == msg.id,
+            MessageQueue.rewrite_status == 'processing',
+            MessageQueue.claimed_by == WORKER_ID
+        ).values(
+            rewrite_status='skipped',
+            ready_to_post=text_only,  # текст без медиа обработан, пост не собирается
+            claimed_by=None,
+            lease_until=None
+        )
+        await self.db.execute(stmt)
+        if text_only:
+            await self.db.commit()
+        else:
+            await pipeline.commit(self.db, pipeline.BUILD)
+        logger.info(f"✂️ После предобработки нечего переписывать, LLM не вызываем: msg_id={msg.id}")
+
+    async def _reuse_rewrite(self, original_id: int):
+        """Готовый рерайт оригинала (None — ещё не готов)"""
+        stmt = select(
+            MessageQueue.rewritten_text, MessageQueue.ai_provider, MessageQueue.ai_model
+        ).where(
+            MessageQueue.id == original_id,
+            MessageQueue.rewrite_status == 'done'
+        )
+        row = (await self.db.execute(stmt)).first()
+        if row is None:
+            return None
+        return ai.RewriteResult(row.rewritten_text, row.ai_provider, row.ai_model)
+
+    async def _media_ids(self, row_id: int) -> frozenset[int]:
+        """media_file_id сообщения или всего его альбома"""
+        head = (await self.db.execute(
+            select(MessageQueue.source_id, MessageQueue.grouped_id, MessageQueue.media_file_id)
+            .where(MessageQueue.id == row_id)
+        )).first()
+        if head is None:
+            return frozenset()
+        if head.grouped_id is None:
+            ids = [head.media_file_id]
+        else:
+            ids = (await self.db.execute(
+                select(MessageQueue.media_file_id).where(
+                    MessageQueue.source_id == head.source_id,
+                    MessageQueue.grouped_id == head.grouped_id
+                )
+            )).scalars().all()
+        return frozenset(i for i in ids if i is not None)
+
+    async def _mark_duplicate(self, msg: MessageQueue, original_id: int):
+        """Помечает сообщение (или весь альбом) как повтор — в сборку не пойдёт"""
+        if msg.grouped_id is None:
+            target = MessageQueue.id == msg.id
+        else:
+            target = and_(
+                MessageQueue.source_id == msg.source_id,
+                MessageQueue.grouped_id == msg.grouped_id
+            )
+
+        stmt = update(MessageQueue).where(
+            target,
+            MessageQueue.ready_to_post == False
+        ).values(
+            rewrite_status='duplicate',
+            duplicate_of=original_id,
+            ready_to_post=True,  # строка обработана, пост не собирается
+            claimed_by=None,
+            lease_until=None
+        )
+        await self.db.execute(stmt)
+        await self.db.commit()
+
+    async def _cached_rewrite(self, text: str):
+        """Готовый рерайт из кэша (ошибка кэша не мешает рерайту)"""
+        try:
+            return await rewrite_cache.get(text)
+        except Exception as e:
+            logger.warning(f"⚠️ Кэш рерайтов недоступен: {e}")
+            return None
+
+    async def _cache_rewrite(self, text: str, result):
+        """Сохраняет успешный рерайт в кэш"""
+        try:
+            await rewrite_cache.put(text, result)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить рерайт в кэш: {e}")
+
+    async def _claim_pending_rewrites(self, limit: int) -> list[MessageQueue]:
         """
-        """Рерайт только одиночных сообщений (не альбомов)"""
+        Захват сообщений на рерайт (безопасно для нескольких реплик)
+
+        SELECT ... FOR UPDATE SKIP LOCKED: параллельные реплики не берут
+        одни и те же строки. Взятые строки получают аренду (lease_until);
+        если реплика упала, после истечения аренды строку перехватит другая.
+        """
+        now = datetime.utcnow()
+
+        # Одиночные сообщения и "головы" альбомов (первое медиа с текстом альбома)
         stmt = select(MessageQueue).where(
-            MessageQueue.rewrite_status == 'pending',
             MessageQueue.original_text.isnot(None),
             MessageQueue.original_text != '',
-            MessageQueue.grouped_id.is_(None)  # ← ДОБАВЬ ЭТО
-        ).limit(50)
+            or_(
+                MessageQueue.rewrite_status == 'pending',
+                and_(
+                    MessageQueue.rewrite_status == 'processing',
+                    or_(
+                        MessageQueue.lease_until.is_(None),
+                        MessageQueue.lease_until < now
+                    )
+                )
+            )
+        ).order_by(MessageQueue.id).limit(limit).with_for_update(skip_locked=True)
 
         result = await self.db.execute(stmt)
         messages = result.scalars().all()
-        
-        if not messages:
-            return
-        
-        logger.info(f"📝 Найдено {len(messages)} сообщений для рерайта")
-        
+
+        lease_until = now + timedelta(seconds=REWRITE_LEASE_SECONDS)
         for msg in messages:
-            await self._rewrite_message(msg)
-    
-    async def _rewrite_message(self, msg: MessageQueue):
-        """Рерайт одного сообщения через AI"""
-        try:
+            if msg.rewrite_status == 'processing':
+                logger.warning(f"♻️ Перехват просроченной аренды: msg_id={msg.id} (была у {msg.claimed_by})")
             msg.rewrite_status = 'processing'
+            msg.claimed_by = WORKER_ID
+            msg.lease_until = lease_until
+            if NEAR_DUP_MODE != 'off' and msg.text_simhash is None:
+                fingerprint = simhash(msg.original_text)
+                if fingerprint is not None:
+                    msg.text_simhash = to_signed(fingerprint)
+
+        await self.db.commit()
+        return messages
+
+    async def _save_rewrite(self, msg: MessageQueue, rewritten, error):
+        """
+        Сохраняет результат рерайта одного сообщения
+
+        Пишем только если аренда всё ещё наша — иначе строку уже перехватили
+        """
+        if error is not None:
+            values = dict(rewrite_status='failed', rewrite_error=str(error))
+        else:
+            values = dict(
+                rewritten_text=rewritten.text,
+                rewrite_status='done',
+                rewritten_at=datetime.utcnow(),
+                ai_provider=rewritten.provider,
+                ai_model=rewritten.model,
+            )
+
+        stmt = update(MessageQueue).where(
+            MessageQueue.id == msg.id,
+            MessageQueue.rewrite_status == 'processing',
+            MessageQueue.claimed_by == WORKER_ID
+        ).values(claimed_by=None, lease_until=None, **values)
+
+        result = await self.db.execute(stmt)
+        if result.rowcount and error is None:
+            await pipeline.commit(self.db, pipeline.BUILD)
+        else:
             await self.db.commit()
-            
-            # РЕРАЙТ
-            rewritten = ai.rewrite_text(msg.original_text)
-            
-            # Сохраняем результат
-            msg.rewritten_text = rewritten
-            msg.rewrite_status = 'done'
-            msg.rewritten_at = datetime.utcnow()
-            msg.ai_provider = ai._PROVIDER
-            msg.ai_model = ai.get_current_model()
-            
-            await self.db.commit()
+
+        if result.rowcount == 0:
+            logger.warning(f"⚠️ Аренда потеряна, результат отброшен: msg_id={msg.id}")
+        elif error is not None:
+            logger.error(f"❌ Ошибка рерайта msg_id={msg.id}: {error}")
+        else:
             logger.info(f"✅ Рерайт готов: msg_id={msg.id}")
-            
-        except Exception as e:
-            msg.rewrite_status = 'failed'
-            msg.rewrite_error = str(e)
-            await self.db.commit()
-            logger.error(f"❌ Ошибка рерайта msg_id={msg.id}: {e}")
     
-    async def close_expired_awaiting(self):
+    async def close_expired_awaiting(self) -> int:
         """
-        Шаг 2: Закрытие медиа, которые не дождались текста
-        
-        Запускать каждые 15-30 секунд
+        Шаг 2: Страховочное закрытие медиа, которые не дождались текста
+
+        Основной путь — GluingEngine (закрывает ровно к awaiting_until).
+        Здесь добираем то, что он пропустил: рестарт, падение реплики, ошибка БД.
+        Закрываем только с запасом AWAITING_SAFETY_GRACE, одним атомарным UPDATE
+        (awaiting_text=True означает, что текста нет — склейка снимает флаг).
+
+        Возвращает количество закрытых медиа
         """
-        now = datetime.utcnow()
-        
-        stmt = select(MessageQueue).where(
+        cutoff = datetime.utcnow() - timedelta(seconds=AWAITING_SAFETY_GRACE)
+
+        stmt = update(MessageQueue).where(
             and_(
                 MessageQueue.awaiting_text == True,
-                MessageQueue.awaiting_until <= now
+                MessageQueue.awaiting_until <= cutoff
             )
-        )
-        
+        ).values(
+            awaiting_text=False,
+            original_text="",
+            rewrite_status='skipped'
+        ).returning(MessageQueue.source_id, MessageQueue.message_id)
+
         result = await self.db.execute(stmt)
-        expired = result.scalars().all()
-        
+        expired = result.all()
+
         if not expired:
-            return
-        
-        logger.info(f"⏰ Найдено {len(expired)} медиа с истёкшим ожиданием текста")
-        
-        for msg in expired:
-            msg.awaiting_text = False
-            
-            # Если текста так и не пришло
-            if not msg.original_text:
-                msg.original_text = ""
-                msg.rewrite_status = 'skipped'
-                logger.info(f"📸 Медиа без текста (тайм-аут): {msg.source_id}/{msg.message_id}")
-        
-        await self.db.commit()
+            await self.db.commit()
+            return 0
+
+        await pipeline.commit(self.db, pipeline.BUILD)
+        logger.info(f"⏰ Страховочно закрыто {len(expired)} медиа с истёкшим ожиданием текста")
+        for source_id, message_id in expired:
+            logger.info(f"📸 Медиа без текста (тайм-аут): {source_id}/{message_id}")
+        return len(expired)
     
     async def build_posts_from_messages(self):
         """
         Шаг 3: Сборка готовых постов
         
         Обрабатывает:
-        - Альбомы (grouped_id) — ВАЖНО: ждём таймаут перед сборкой!
+        - Альбомы (grouped_id) — собираются, только когда ВСЕ медиа альбома готовы
         - Одиночные сообщения
-        """
-        now = datetime.utcnow()
-        
-        # Берём все готовые к сборке сообщения
-        stmt = select(MessageQueue).where(
-            MessageQueue.ready_to_post == False,
-            or_(
-                MessageQueue.rewrite_status == 'done',
-                and_(
-                    MessageQueue.rewrite_status == 'skipped',
-                    MessageQueue.media_type.isnot(None)
-                )
-            )
-        ).order_by(MessageQueue.collected_at)
 
-        result = await self.db.execute(stmt)
-        messages = result.scalars().all()
+        Стоимость прохода — O(новой работы): полнота альбомов считается одним
+        агрегатным запросом по grouped_id, выборки ограничены BUILD_*_BATCH_LIMIT.
 
-        if not messages:
-            return
+        Строки блокируются FOR UPDATE SKIP LOCKED до конца транзакции
+        (один commit на весь проход), чтобы две реплики не собрали один пост дважды
 
-        # Группируем по типам (логирование после фильтрации)
-        albums = {}  # grouped_id → {"messages": [...], "collected_at": datetime}
-        singles = []
+        Повторы медиа проверяются одним запросом на весь проход (_published_media)
+        """
+        albums = await self._select_complete_albums(BUILD_ALBUM_BATCH_LIMIT)
+        singles = await self._select_ready_singles(BUILD_SINGLE_BATCH_LIMIT)
 
-        for msg in messages:
-            if msg.grouped_id:
-                if msg.grouped_id not in albums:
-                    albums[msg.grouped_id] = {
-                        "messages": [],
-                        "collected_at": msg.collected_at
-                    }
-                albums[msg.grouped_id]["messages"].append(msg)
-
-                # ✅ ИСПРАВЛЕНИЕ: Берем МАКСИМАЛЬНЫЙ collected_at
-                if msg.collected_at > albums[msg.grouped_id]["collected_at"]:
-                    albums[msg.grouped_id]["collected_at"] = msg.collected_at
-            else:
-                singles.append(msg)
-
-        # Обрабатываем альбомы сразу
-        albums_built = 0
-        for gid, data in albums.items():
-            msgs = data["messages"]
+        published = await self._published_media([*albums.values(), *([msg] for msg in singles)])
 
-            # Проверяем: нет ли ещё медиа с тем же grouped_id, которые не попали в выборку
-            total_in_db = await self._count_album_members(gid)
-            if total_in_db > len(msgs):
-                logger.debug(
-                    f"⏳ Альбом {gid}: в выборке {len(msgs)}, в БД {total_in_db} — ждём остальные"
-                )
-                continue
-
-            # ✅ Все медиа альбома готовы — собираем
-            await self._build_album_post(msgs)
+        # Обрабатываем альбомы
+        albums_built = 0
+        for msgs in albums.values():
+            await self._build_album_post(msgs, published)
             albums_built += 1
 
-        # Обрабатываем одиночные (сразу)
+        # Обрабатываем одиночные
         singles_built = 0
         for msg in singles:
-            await self._build_single_post(msg)
+            await self._build_single_post(msg, published)
             singles_built += 1
 
+        if albums_built > 0 or singles_built > 0:
+            await pipeline.commit(self.db, pipeline.PUBLISH)
+        else:
+            await self.db.commit()
+
+        # Выборка упёрлась в лимит — сразу следующий проход
+        if len(albums) >= BUILD_ALBUM_BATCH_LIMIT or len(singles) >= BUILD_SINGLE_BATCH_LIMIT:
+            pipeline.wake(pipeline.BUILD)
+
         # Логируем только если что-то реально собрали
         if albums_built > 0 or singles_built > 0:
             logger.info(f"📦 Собрано постов: {albums_built + singles_built} ({singles_built} одиночных, {albums_built} альбомов)")
 
+    async def _select_complete_albums(self, limit: int) -> dict[int, list[MessageQueue]]:
+        """
+        Выбирает альбомы, у которых готовы ВСЕ несобранные медиа
+
+        1. Агрегат по grouped_id: count(*) == count(готовых) — альбом полный
+        2. Загрузка строк найденных альбомов с блокировкой SKIP LOCKED
+        """
+        is_ready = case((_ALBUM_MEMBER_READY, 1), else_=0)
+
+        stmt = select(MessageQueue.grouped_id, func.count()).where(
+            MessageQueue.ready_to_post == False,
+            MessageQueue.grouped_id.isnot(None)
+        ).group_by(
+            MessageQueue.grouped_id
+        ).having(
+            func.count() == func.sum(is_ready)
+        ).order_by(
+            func.max(MessageQueue.collected_at)
+        ).limit(limit)
 
-    async def _count_album_members(self, grouped_id: int) -> int:
-        """Считает ВСЕ сообщения альбома в БД (включая не готовые к сборке)"""
-        stmt = select(func.count()).select_from(MessageQueue).where(
-            and_(
-                MessageQueue.grouped_id == grouped_id,
-                MessageQueue.ready_to_post == False
-            )
-        )
         result = await self.db.execute(stmt)
-        return result.scalar() or 0
-
-    async def _build_album_post(self, messages: list[MessageQueue]):
-        """Создаёт пост из альбома (несколько медиа)"""
-
-        # Склеиваем весь ОРИГИНАЛЬНЫЙ текст (не rewritten!)
-        original_texts = [m.original_text for m in messages if m.original_text]
-        combined_original = "\n\n".join(original_texts) if original_texts else ""
-
-        # РЕРАЙТ ЗДЕСЬ (один раз для всего альбома)
-        final_text = ""
-        if combined_original:
-            try:
-                final_text = ai.rewrite_text(combined_original)
-            except Exception as e:
-                logger.error(f"❌ Ошибка рерайта альбома: {e}")
-                final_text = combined_original  # fallback на оригинал
-        else:
-            final_text = ""
+        expected = dict(result.all())  # grouped_id → кол-во медиа
+
+        if not expected:
+            return {}
+
+        stmt = select(MessageQueue).where(
+            MessageQueue.grouped_id.in_(expected),
+            MessageQueue.ready_to_post == False
+        ).order_by(MessageQueue.grouped_id, MessageQueue.message_id).with_for_update(skip_locked=True)
+
+        result = await self.db.execute(stmt)
+
+        albums = {}
+        for msg in result.scalars().all():
+            albums.setdefault(msg.grouped_id, []).append(msg)
+
+        # Часть строк могла быть заблокирована другой репликой — такие альбомы не трогаем
+        for gid in list(albums):
+            if len(albums[gid]) != expected[gid]:
+                logger.debug(
+                    f"⏳ Альбом {gid}: получено {len(albums[gid])} из {expected[gid]} — пропускаем проход"
+                )
+                del albums[gid]
+
+        return albums
+
+    async def _select_ready_singles(self, limit: int) -> list[MessageQueue]:
+        """Выбирает готовые одиночные сообщения (с блокировкой SKIP LOCKED)"""
+        stmt = select(MessageQueue).where(
+            MessageQueue.ready_to_post == False,
+            MessageQueue.grouped_id.is_(None),
+            _READY_TO_BUILD
+        ).order_by(MessageQueue.collected_at).limit(limit).with_for_update(skip_locked=True)
+
+        result = await self.db.execute(stmt)
+        return result.scalars().all()
+
+    @staticmethod
+    def _media_key(msg: MessageQueue) -> tuple[str, int] | None:
+        if not msg.media_type or msg.media_file_id is None:
+            return None
+        return msg.media_type, msg.media_file_id
+
+    async def _published_media(self, batches: list[list[MessageQueue]]) -> dict[tuple[str, int], int]:
+        """
+        Медиа прохода сборки, уже бывшие в постах за MEDIA_DEDUP_DAYS
+
+        Один запрос по индексу post_media (media_type, media_file_id) на весь проход.
+        Возвращает (media_type, media_file_id) → id самого свежего поста с этим медиа
+        """
+        if MEDIA_DEDUP_MODE == 'off':
+            return {}
+
+        keys = {key for messages in batches for msg in messages if (key := self._media_key(msg))}
+        if not keys:
+            return {}
+
+        stmt = select(
+            PostMedia.media_type, PostMedia.media_file_id, func.max(PostMedia.post_id)
+        ).join(
+            Post, Post.id == PostMedia.post_id
+        ).where(
+            tuple_(PostMedia.media_type, PostMedia.media_file_id).in_(sorted(keys)),
+            Post.status.in_(_MEDIA_DEDUP_STATUSES),
+            Post.created_at > datetime.utcnow() - timedelta(days=MEDIA_DEDUP_DAYS)
+        ).group_by(PostMedia.media_type, PostMedia.media_file_id)
+
+        result = await self.db.execute(stmt)
+        return {(media_type, file_id): post_id for media_type, file_id, post_id in result.all()}
+
+    def _check_media_duplicate(self, messages: list[MessageQueue],
+                               published: dict[tuple[str, int], int]) -> int | None:
+        """
+        id поста, в котором уже были ВСЕ медиа сообщений (None — есть новое медиа)
+
+        Пост без медиа повтором по медиа не считается
+        """
+        if MEDIA_DEDUP_MODE == 'off':
+            return None
+
+        keys = [key for msg in messages if (key := self._media_key(msg))]
+        if not keys or any(key not in published for key in keys):
+            return None
+        return max(published[key] for key in keys)
+
+    def _create_post(self, messages: list[MessageQueue], final_text: str,
+                     published: dict[tuple[str, int], int]) -> Post:
+        """Пост со статусом с учётом повтора медиа"""
+        duplicate_of = self._check_media_duplicate(messages, published)
+        suppressed = duplicate_of is not None and MEDIA_DEDUP_MODE == 'suppress'
+
+        if duplicate_of is not None:
+            metrics.inc('media_dedup.suppressed' if suppressed else 'media_dedup.flagged')
+            logger.info(
+                f"🖼 Медиа уже публиковались в посте {duplicate_of}: "
+                f"{'пост не публикуется' if suppressed else 'пост помечен'} (msg_id={messages[0].id})"
+            )
 
-        # Создаём пост
         post = Post(
             grouped_id=messages[0].grouped_id,
             original_source_id=messages[0].source_id,
             final_text=final_text,
-            status='scheduled',
-            scheduled_at=datetime.utcnow()
+            status='suppressed' if suppressed else 'scheduled',
+            scheduled_at=datetime.utcnow(),
+            media_duplicate_of=duplicate_of
         )
         self.db.add(post)
+        return post
+
+    def _remember_media(self, post: Post, messages: list[MessageQueue],
+                        published: dict[tuple[str, int], int]):
+        """Медиа нового поста — повтор для следующих постов того же прохода"""
+        if MEDIA_DEDUP_MODE == 'off' or post.status == 'suppressed':
+            return
+        for msg in messages:
+            key = self._media_key(msg)
+            if key is not None:
+                published.setdefault(key, post.id)
+
+    async def _build_album_post(self, messages: list[MessageQueue], published: dict[tuple[str, int], int]):
+        """
+        Создаёт пост из альбома (несколько медиа)
+
+        Только сборка в БД, без сети: текст альбома уже переписан rewriter'ом
+        (голова альбома проходит тот же этап рерайта, что и одиночные)
+        """
+        texts = []
+        for m in messages:
+            if m.rewrite_status == 'done' and m.rewritten_text:
+                texts.append(m.rewritten_text)
+            elif m.rewrite_status == 'failed' and m.original_text:
+                logger.warning(f"⚠️ Рерайт альбома не удался, берём оригинал: msg_id={m.id}")
+                texts.append(m.original_text)  # fallback на оригинал
+        final_text = "\n\n".join(texts)
+
+        # Создаём пост
+        post = self._create_post(messages, final_text, published)
         await self.db.flush()
+        self._remember_media(post, messages, published)
 
         # Добавляем медиа из альбома
         for idx, msg in enumerate(messages):
@@ -236,28 +670,22 @@ class MessageProcessor:
                 )
                 self.db.add(media)
 
-        # Помечаем как готовые
+        # Помечаем как готовые (commit — в build_posts_from_messages)
         for msg in messages:
             msg.ready_to_post = True
 
-        await self.db.commit()
-        logger.info(f"✅ Альбом собран и рерайтнут: grouped_id={post.grouped_id}, {len(messages)} файлов")
+        await self.db.flush()
+        logger.info(f"✅ Альбом собран: grouped_id={post.grouped_id}, {len(messages)} файлов")
 
-    async def _build_single_post(self, msg: MessageQueue):
+    async def _build_single_post(self, msg: MessageQueue, published: dict[tuple[str, int], int]):
         """Создаёт пост из одиночного сообщения"""
         final_text = msg.rewritten_text or ""
         
         
         # Создаём пост
-        post = Post(
-            grouped_id=None,
-            original_source_id=msg.source_id,
-            final_text=final_text,
-            status='scheduled',
-            scheduled_at=datetime.utcnow()
-        )
-        self.db.add(post)
+        post = self._create_post([msg], final_text, published)
         await self.db.flush()
+        self._remember_media(post, [msg], published)
         
         # Если есть медиа — добавляем
         if msg.media_type:
@@ -273,6 +701,6 @@ class MessageProcessor:
             self.db.add(media)
         
         msg.ready_to_post = True
-        await self.db.commit()
+        await self.db.flush()
         
         logger.info(f"✅ Одиночный пост: msg_id={msg.id}, media={msg.media_type}, text_len={len(final_text)}")
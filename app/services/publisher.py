@@ -1,9 +1,9 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_
+from sqlalchemy import select, update, and_, or_
 from app.models.post import Post, PostMedia
 from app.utils import split_text
-from app.config import DEST, POST_DELAY, CAPTION_LIMIT
-from datetime import datetime
+from app.config import DEST, POST_DELAY, CAPTION_LIMIT, PUBLISH_LEASE_SECONDS, WORKER_ID
+from datetime import datetime, timedelta
 from telethon import TelegramClient
 from telethon.tl.types import (
     InputMediaPhoto, InputPhoto,
@@ -14,6 +14,8 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+PUBLISH_BATCH_LIMIT = 10  # постов за один проход publisher
+
 
 class PostPublisher:
     """
@@ -29,38 +31,73 @@ class PostPublisher:
         self.client = client
         self.db = db_session
     
-    async def publish_scheduled_posts(self):
-        """Публикует посты по расписанию"""
-        now = datetime.utcnow()
-        
-        stmt = select(Post).where(
-            and_(
-                Post.status == 'scheduled',
-                Post.scheduled_at <= now
-            )
-        ).order_by(Post.scheduled_at).limit(10)
-        
-        result = await self.db.execute(stmt)
-        posts = result.scalars().all()
-        
-        if not posts:
-            return
-        
-        logger.info(f"📤 Найдено {len(posts)} постов для публикации")
-        
-        for post in posts:
+    async def publish_scheduled_posts(self) -> int:
+        """
+        Публикует посты по расписанию (возвращает количество обработанных)
+
+        Посты захватываются по одному (FOR UPDATE SKIP LOCKED + аренда),
+        поэтому несколько реплик-публикаторов не отправят один пост дважды.
+        Пост со статусом 'posting' и истёкшей арендой (реплика упала) перехватывается.
+        """
+        published = 0
+
+        while published < PUBLISH_BATCH_LIMIT:
+            post = await self._claim_next_post()
+            if post is None:
+                break
+
             try:
                 await self._publish_post(post)
-                post.status = 'posted'
-                post.posted_at = datetime.utcnow()
+                values = dict(status='posted', posted_at=datetime.utcnow())
                 logger.info(f"✅ Опубликовано: post_id={post.id}")
             except Exception as e:
                 logger.error(f"❌ Ошибка публикации {post.id}: {e}", exc_info=True)
-                post.status = 'failed'
-                post.post_error = str(e)
-            
+                values = dict(status='failed', post_error=str(e))
+
+            stmt = update(Post).where(
+                Post.id == post.id,
+                Post.claimed_by == WORKER_ID
+            ).values(claimed_by=None, lease_until=None, **values)
+            await self.db.execute(stmt)
             await self.db.commit()
+
+            published += 1
             await asyncio.sleep(POST_DELAY)
+
+        return published
+
+    async def _claim_next_post(self) -> Post | None:
+        """Захватывает следующий пост для публикации"""
+        now = datetime.utcnow()
+
+        stmt = select(Post).where(
+            or_(
+                and_(
+                    Post.status == 'scheduled',
+                    Post.scheduled_at <= now
+                ),
+                and_(
+                    Post.status == 'posting',
+                    or_(Post.lease_until.is_(None), Post.lease_until < now)
+                )
+            )
+        ).order_by(Post.scheduled_at).limit(1).with_for_update(skip_locked=True)
+
+        result = await self.db.execute(stmt)
+        post = result.scalar_one_or_none()
+
+        if post is None:
+            await self.db.commit()
+            return None
+
+        if post.status == 'posting':
+            logger.warning(f"♻️ Перехват просроченной аренды: post_id={post.id} (была у {post.claimed_by})")
+
+        post.status = 'posting'
+        post.claimed_by = WORKER_ID
+        post.lease_until = now + timedelta(seconds=PUBLISH_LEASE_SECONDS)
+        await self.db.commit()
+        return post
     
     async def _publish_post(self, post: Post):
         """
@@ -0,0 +1,192 @@
+from sqlalchemy import select, update, delete
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from app.database.engine import SessionLocal
+from app.models.rewrite_cache import RewriteCacheEntry
+from app.config import REWRITE_CACHE, REWRITE_CACHE_SIZE, REWRITE_CACHE_TTL_DAYS
+from app.prompts import PROMPT_VERSION
+from app.ai import RewriteResult, configured_models
+from app import metrics
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL = 3600  # секунд между удалениями просроченных записей
+
+_SPACES = re.compile(r'[ \t]+')
+_BLANK_LINES = re.compile(r'\n{3,}')
+
+
+def normalize_text(text: str) -> str:
+    """
+    Нормализация текста для ключа кэша
+
+    Убирает то, что не влияет на рерайт: юникод-варианты символов (NFKC),
+    повторные пробелы, пробелы по краям строк, лишние пустые строки.
+    Регистр и пунктуацию не трогаем — от них зависит результат.
+    """
+    text = unicodedata.normalize('NFKC', text).replace('\r\n', '\n')
+    lines = [_SPACES.sub(' ', line).strip() for line in text.split('\n')]
+    return _BLANK_LINES.sub('\n\n', '\n'.join(lines)).strip()
+
+
+def cache_key(normalized: str, provider: str, model: str) -> str:
+    """sha256(версия промпта + провайдер + модель + нормализованный текст)"""
+    raw = '\0'.join((PROMPT_VERSION, provider, model, normalized))
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class RewriteCache:
+    """
+    Кэш рерайтов: PostgreSQL (rewrite_cache) + LRU в памяти процесса
+
+    - get(): сначала LRU, затем один SELECT по ключам всех настроенных моделей
+      (рерайт, сделанный любой из них, годится)
+    - put(): запись после успешного рерайта (ошибочные результаты не кэшируются)
+    - TTL: записи старше REWRITE_CACHE_TTL_DAYS не отдаются и удаляются purge()
+
+    Метрики: rewrite_cache.hit / .miss (+ .hit_memory), сэкономленные токены
+    rewrite_cache.saved_input_tokens / .saved_output_tokens
+    """
+
+    def __init__(self,
+                 max_size: int = REWRITE_CACHE_SIZE,
+                 ttl_days: int = REWRITE_CACHE_TTL_DAYS,
+                 enabled: bool = REWRITE_CACHE):
+        self.max_size = max_size
+        self.ttl = timedelta(days=ttl_days)
+        self.enabled = enabled
+        self._lru = OrderedDict()  # key → (RewriteResult, monotonic-время записи)
+
+    def _keys(self, text: str) -> list[str]:
+        normalized = normalize_text(text)
+        return [cache_key(normalized, provider, model) for provider, model in configured_models()]
+
+    def _remember(self, key: str, result: RewriteResult):
+        self._lru[key] = (result, time.monotonic())
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def _from_memory(self, keys: list[str]) -> tuple[str, RewriteResult] | None:
+        max_age = self.ttl.total_seconds()
+        for key in keys:
+            entry = self._lru.get(key)
+            if entry is None:
+                continue
+            result, stored_at = entry
+            if time.monotonic() - stored_at > max_age:
+                del self._lru[key]
+                continue
+            self._lru.move_to_end(key)
+            return key, result
+        return None
+
+    async def get(self, text: str) -> RewriteResult | None:
+        """Ищет готовый рерайт текста"""
+        if not self.enabled or not text:
+            return None
+
+        keys = self._keys(text)
+        if not keys:
+            return None
+
+        found = self._from_memory(keys)
+        if found is not None:
+            metrics.inc('rewrite_cache.hit_memory')
+        else:
+            found = await self._from_db(keys)
+
+        if found is None:
+            metrics.inc('rewrite_cache.miss')
+            return None
+
+        key, result = found
+        metrics.inc('rewrite_cache.hit')
+        metrics.inc('rewrite_cache.saved_input_tokens', result.input_tokens or 0)
+        metrics.inc('rewrite_cache.saved_output_tokens', result.output_tokens or 0)
+        return result
+
+    async def _from_db(self, keys: list[str]) -> tuple[str, RewriteResult] | None:
+        now = datetime.utcnow()
+
+        async with SessionLocal() as session:
+            stmt = select(RewriteCacheEntry).where(
+                RewriteCacheEntry.key.in_(keys),
+                RewriteCacheEntry.created_at > now - self.ttl
+            ).order_by(RewriteCacheEntry.created_at.desc()).limit(1)
+            entry = (await session.execute(stmt)).scalar_one_or_none()
+
+            if entry is None:
+                return None
+
+            stmt = update(RewriteCacheEntry).where(
+                RewriteCacheEntry.key == entry.key
+            ).values(hits=RewriteCacheEntry.hits + 1, last_hit_at=now)
+            await session.execute(stmt)
+            await session.commit()
+
+        result = RewriteResult(
+            entry.rewritten_text, entry.provider, entry.model,
+            entry.input_tokens, entry.output_tokens
+        )
+        self._remember(entry.key, result)
+        return entry.key, result
+
+    async def put(self, text: str, result: RewriteResult):
+        """Сохраняет успешный рерайт"""
+        if not self.enabled or not text or not result.text or result.model is None:
+            return
+
+        key = cache_key(normalize_text(text), result.provider, result.model)
+
+        async with SessionLocal() as session:
+            stmt = pg_insert(RewriteCacheEntry).values(
+                key=key,
+                provider=result.provider,
+                model=result.model,
+                prompt_version=PROMPT_VERSION,
+                rewritten_text=result.text,
+                input_tokens=result.input_tokens,
+                output_tokens=result.output_tokens,
+            ).on_conflict_do_nothing(index_elements=['key'])
+            await session.execute(stmt)
+            await session.commit()
+
+        self._remember(key, result)
+
+    async def purge(self) -> int:
+        """Удаляет просроченные записи (возвращает количество)"""
+        if not self.enabled:
+            return 0
+
+        async with SessionLocal() as session:
+            stmt = delete(RewriteCacheEntry).where(
+                RewriteCacheEntry.created_at <= datetime.utcnow() - self.ttl
+            )
+            result = await session.execute(stmt)
+            await session.commit()
+
+        if result.rowcount:
+            metrics.inc('rewrite_cache.purged', result.rowcount)
+            logger.info(f"🧹 Кэш рерайтов: удалено {result.rowcount} просроченных записей")
+        return result.rowcount
+
+    def stats(self) -> dict:
+        """Доля попаданий и размер LRU"""
+        hits = metrics.get('rewrite_cache.hit')
+        total = hits + metrics.get('rewrite_cache.miss')
+        return {
+            'hit_ratio': round(hits / total, 3) if total else 0.0,
+            'memory_entries': len(self._lru),
+            'saved_input_tokens': metrics.get('rewrite_cache.saved_input_tokens'),
+            'saved_output_tokens': metrics.get('rewrite_cache.saved_output_tokens'),
+        }
+
+
+rewrite_cache = RewriteCache()
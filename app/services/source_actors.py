@@ -0,0 +1,85 @@
+from app.config import SOURCE_QUEUE_SIZE, SOURCE_MAX_CONCURRENCY, SOURCE_ACTOR_IDLE
+from app import metrics
+from typing import Awaitable, Callable
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+Job = Callable[[], Awaitable]
+
+
+class SourceActorPool:
+    """
+    Акторы источников: по очереди и воркеру на chat_id
+
+    Telethon вызывает handler конкурентно, а склейка текста с медиа/альбомом
+    корректна, только если сообщения одного источника обрабатываются по порядку.
+    Поэтому handler не пишет в БД сам, а кладёт задачу в очередь своего источника:
+    - задачи одного chat_id выполняются строго последовательно
+    - разные источники идут параллельно, но не больше max_concurrency разом
+      (общий семафор — пул соединений БД не бесконечный)
+    - очередь ограничена queue_size: при переполнении submit() ждёт (backpressure)
+    - воркер без задач idle_timeout секунд завершается, актор создаётся заново по требованию
+    """
+
+    def __init__(self,
+                 queue_size: int = SOURCE_QUEUE_SIZE,
+                 max_concurrency: int = SOURCE_MAX_CONCURRENCY,
+                 idle_timeout: float = SOURCE_ACTOR_IDLE):
+        self.queue_size = queue_size
+        self.idle_timeout = idle_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._actors = {}  # chat_id → (очередь, задача воркера)
+        self._closed = False
+
+    def __len__(self):
+        return len(self._actors)
+
+    async def submit(self, chat_id: int, job: Job):
+        """Ставит задачу в очередь источника (ждёт, если очередь полна)"""
+        if self._closed:
+            raise RuntimeError("Пул акторов источников уже остановлен")
+
+        actor = self._actors.get(chat_id)
+        if actor is None:
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            task = asyncio.create_task(self._worker(chat_id, queue))
+            actor = self._actors[chat_id] = (queue, task)
+
+        queue = actor[0]
+        if queue.full():
+            metrics.inc('source_actors.backpressure')
+        await queue.put((time.perf_counter(), job))
+
+    async def _worker(self, chat_id: int, queue: asyncio.Queue):
+        while True:
+            try:
+                enqueued_at, job = await asyncio.wait_for(queue.get(), self.idle_timeout)
+            except asyncio.TimeoutError:
+                if queue.empty():
+                    # Между проверкой и удалением нет await — новая задача не потеряется
+                    self._actors.pop(chat_id, None)
+                    return
+                continue
+
+            try:
+                async with self._semaphore:
+                    metrics.observe('source_actors.queue_wait_ms', (time.perf_counter() - enqueued_at) * 1000)
+                    await job()
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки сообщения источника {chat_id}: {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def close(self):
+        """Дожидается выполнения всех поставленных задач и останавливает воркеры"""
+        self._closed = True
+        actors = list(self._actors.values())
+        for queue, _ in actors:
+            await queue.join()
+        for _, task in actors:
+            task.cancel()
+        self._actors.clear()
+        logger.info(f"✅ Очереди источников обработаны ({len(actors)} акторов)")
@@ -0,0 +1,110 @@
+from sqlalchemy import select
+from app.database.engine import SessionLocal
+from app.models.source import Source
+from app import metrics
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class SourceRegistry:
+    """
+    In-memory реестр активных источников
+
+    Хранит множество chat_id активных источников, чтобы NewMessage handler
+    отбрасывал чужие чаты без обращения к БД.
+
+    Обновление:
+    - load()/refresh() — полная перезагрузка из БД (при старте и как fallback-поллинг)
+    - handle_notification() — инкрементальное обновление по NOTIFY от триггера на sources
+    """
+
+    CHANNEL = 'sources_changed'
+
+    def __init__(self):
+        self._active = set()
+
+    def __len__(self):
+        return len(self._active)
+
+    def is_active(self, chat_id: int) -> bool:
+        """Проверка без I/O: есть ли chat_id среди активных источников"""
+        if chat_id in self._active:
+            metrics.inc('sources.hit')
+            return True
+        metrics.inc('sources.miss')
+        return False
+
+    def add(self, chat_id: int):
+        self._active.add(chat_id)
+
+    def discard(self, chat_id: int):
+        self._active.discard(chat_id)
+
+    async def load(self):
+        """Полная загрузка активных источников из БД"""
+        started = time.perf_counter()
+
+        async with SessionLocal() as session:
+            stmt = select(Source.chat_id).where(Source.is_active == True)
+            result = await session.execute(stmt)
+            fresh = set(result.scalars().all())
+
+        added = fresh - self._active
+        removed = self._active - fresh
+        self._active = fresh
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics.inc('sources.refresh')
+        metrics.observe('sources.refresh_ms', elapsed_ms)
+
+        if added or removed:
+            logger.info(
+                f"🔄 Реестр источников: {len(fresh)} активных "
+                f"(+{len(added)} / -{len(removed)}, {elapsed_ms:.1f} мс)"
+            )
+
+    async def refresh(self):
+        """Fallback-поллинг на случай пропущенных NOTIFY"""
+        await self.load()
+
+    def handle_notification(self, payload: str):
+        """
+        Инкрементальное обновление по NOTIFY
+
+        Payload (см. триггер notify_sources_changed):
+        {"op": "INSERT|UPDATE|DELETE", "chat_id": ..., "old_chat_id": ..., "is_active": ...}
+        """
+        try:
+            data = json.loads(payload)
+        except (TypeError, ValueError):
+            logger.warning(f"⚠️ Некорректный payload {self.CHANNEL}: {payload!r}")
+            return
+
+        old_chat_id = data.get('old_chat_id')
+        chat_id = data.get('chat_id')
+
+        if old_chat_id is not None and old_chat_id != chat_id:
+            self.discard(old_chat_id)
+
+        if chat_id is None:
+            return
+
+        if data.get('op') != 'DELETE' and data.get('is_active'):
+            self.add(chat_id)
+        else:
+            self.discard(chat_id)
+
+        metrics.inc('sources.notify')
+        logger.debug(f"🔔 Источник {chat_id}: {data.get('op')} active={data.get('is_active')}")
+
+    def stats(self) -> dict:
+        return {
+            'active': len(self._active),
+            'hit': metrics.get('sources.hit'),
+            'miss': metrics.get('sources.miss'),
+            'refresh': metrics.get('sources.refresh'),
+            'notify': metrics.get('sources.notify'),
+        }
@@ -0,0 +1,192 @@
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError, DataError
+from app.database.engine import SessionLocal
+from app.models.message import MessageQueue
+from app.config import (
+    COLLECTOR_BUFFER_MAX_ROWS,
+    COLLECTOR_BUFFER_MAX_DELAY_MS,
+    COLLECTOR_BUFFER_MAX_PENDING,
+    COLLECTOR_BUFFER_RETRY_BACKOFF,
+)
+from app import metrics, pipeline
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()  # маркер остановки в очереди
+_BATCH_ATTEMPTS = 3  # попыток записать пачку целиком, дальше — по строкам
+_MAX_RETRY_BACKOFF = 30  # потолок паузы между повторами (сек)
+
+
+class CollectorWriteBuffer:
+    """
+    Буфер записи коллектора (micro-batching)
+
+    Копит строки message_queue и пишет их одной транзакцией:
+    не дольше max_delay_ms или не больше max_rows строк за раз.
+
+    - Backpressure: put() ждёт, если в буфере уже max_pending строк
+    - Дубликаты отсекает INSERT ... ON CONFLICT (source_id, message_id) DO NOTHING
+    - close() гарантированно сбрасывает всё накопленное (вызывается при shutdown)
+    - Неудачный сброс повторяется с паузой (пачка остаётся в памяти до успешного
+      commit), затем пишется по строкам: битая строка не тянет за собой остальные
+
+    В буфер идут только "конечные" вставки, от которых не зависит склейка
+    (текст без медиа, медиа с текстом). Медиа, ждущее текст, пишется сразу.
+    """
+
+    def __init__(self,
+                 max_rows: int = COLLECTOR_BUFFER_MAX_ROWS,
+                 max_delay_ms: int = COLLECTOR_BUFFER_MAX_DELAY_MS,
+                 max_pending: int = COLLECTOR_BUFFER_MAX_PENDING):
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+        self._closed = False
+
+    def start(self):
+        """Запускает фоновую задачу сброса"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"🧺 Буфер записи коллектора: до {self.max_rows} строк / "
+                f"{self.max_delay * 1000:.0f} мс, очередь {self._queue.maxsize}"
+            )
+
+    async def put(self, stage: str, **values):
+        """Кладёт строку в буфер (ждёт, если буфер полон)"""
+        if self._closed:
+            raise RuntimeError("Буфер записи уже закрыт")
+        if self._queue.full():
+            metrics.inc('collector_buffer.backpressure')
+        await self._queue.put((stage, values))
+
+    async def close(self):
+        """Сбрасывает всё накопленное и останавливает задачу"""
+        if self._closed:
+            return
+        self._closed = True
+        if self._task is None:
+            return
+        await self._queue.put(_CLOSE)
+        await self._task
+        self._task = None
+        logger.info("✅ Буфер записи коллектора сброшен")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        closing = False
+
+        while not closing:
+            item = await self._queue.get()
+            if item is _CLOSE:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self.max_delay
+
+            while len(batch) < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is _CLOSE:
+                    closing = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        """
+        Пишет пачку строк одной транзакцией
+
+        Ошибка — повтор с паузой COLLECTOR_BUFFER_RETRY_BACKOFF (×2), после
+        _BATCH_ATTEMPTS неудач — по одной строке на транзакцию. Строки, которые
+        отвергла сама БД (IntegrityError, DataError), отбрасываются; остальные
+        (БД недоступна) остаются в памяти и повторяются до успешного commit —
+        новые строки тем временем упираются в backpressure. При close() не
+        записанное после очередного прохода по строкам теряется
+        """
+        started = time.perf_counter()
+        total = len(batch)
+        delay = COLLECTOR_BUFFER_RETRY_BACKOFF
+        attempt = inserted = lost = 0
+
+        while batch:
+            attempt += 1
+            try:
+                inserted += await self._write(batch)
+                break
+            except Exception as e:
+                logger.warning(f"⚠️ Ошибка сброса буфера коллектора ({len(batch)} строк, попытка {attempt}): {e}")
+                metrics.inc('collector_buffer.retries')
+
+            if attempt >= _BATCH_ATTEMPTS:
+                written, rejected, batch = await self._write_rows(batch)
+                inserted += written
+                lost += rejected
+                if self._closed:
+                    lost += len(batch)
+                    break
+                attempt = 0  # оставшееся — снова пачкой
+
+            if batch:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, _MAX_RETRY_BACKOFF)
+
+        if lost:
+            metrics.inc('collector_buffer.lost_rows', lost)
+            logger.error(f"❌ Не записано строк буфера коллектора: {lost} из {total}")
+
+        duplicates = total - lost - inserted
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics.inc('collector_buffer.flushes')
+        metrics.inc('collector_buffer.rows', inserted)
+        metrics.inc('collector_buffer.duplicates', duplicates)
+        metrics.observe('collector_buffer.flush_ms', elapsed_ms)
+
+        logger.info(
+            f"🧺 Сброс буфера: строк={total} сохранено={inserted} "
+            f"дубликатов={duplicates} ({elapsed_ms:.1f} мс)"
+        )
+
+    async def _write(self, batch) -> int:
+        """Одна транзакция на всю пачку, возвращает число вставленных строк"""
+        # Multi-row INSERT требует одинаковый набор колонок — группируем по ключам
+        groups = {}
+        stages = set()
+        for stage, values in batch:
+            groups.setdefault(tuple(sorted(values)), []).append(values)
+            stages.add(stage)
+
+        inserted = 0
+        async with SessionLocal() as session:
+            for rows in groups.values():
+                stmt = pg_insert(MessageQueue).values(rows).on_conflict_do_nothing(
+                    constraint='uq_source_message'
+                ).returning(MessageQueue.id)
+                result = await session.execute(stmt)
+                inserted += len(result.scalars().all())
+            await pipeline.commit(session, *stages)
+        return inserted
+
+    async def _write_rows(self, batch) -> tuple[int, int, list]:
+        """По транзакции на строку: (вставлено, отвергнуто БД, не записано — повторить)"""
+        inserted, rejected, pending = 0, 0, []
+        for item in batch:
+            try:
+                inserted += await self._write([item])
+            except (IntegrityError, DataError) as e:
+                rejected += 1
+                values = item[1]
+                logger.error(f"❌ Строка буфера коллектора {values.get('source_id')}/{values.get('message_id')} отвергнута: {e}")
+            except Exception:
+                pending.append(item)
+        return inserted, rejected, pending
@@ -0,0 +1,122 @@
+"""
+Детерминированная предобработка текста перед рерайтом
+
+То, что SYSTEM_PROMPT просит модель удалить (цены, телефоны, @username,
+ссылки), вырезается локально регулярками: меньше входных и выходных
+токенов и меньше работы модели. Удаляется только сам фрагмент с суммой или
+контактом — строка с описанием товара остаётся. Заодно схлопываются пробелы и повторы эмодзи.
+
+Если после чистки не осталось содержательного текста (пусто или одни
+контакты: "Пишите @manager, +7 900 ..."), LLM не вызывается вовсе.
+"""
+import re
+import time
+from typing import NamedTuple
+
+from app import metrics
+
+_CURRENCY = r'(?:₽|руб(?:лей|ля|ль)?\.?|р\.(?!\w)|rub\b)'
+_NUMBER = r'(?:\d{1,3}(?:[ \u00a0\u202f]\d{3})+|\d+)(?:[.,]\d{1,2})?'  # 15 000,00
+
+_PRICE_WORD = r'(?:цена|стоимость|прайс|price)'
+# Сумма с валютой вместе с подписью, если она есть ("Цена 5 000 руб.", "15 000,00 ₽/шт", "от 3500 до 4000 рублей")
+_PRICE = re.compile(
+    rf'(?:\b{_PRICE_WORD}\b\s*[:\-—–]?\s*)?'
+    rf'(?:\bот\s+{_NUMBER}\s*(?:до\s+)?)?{_NUMBER}\s?{_CURRENCY}(?:\s*/\s*(?:шт|ед|комплект)\.?)?',
+    re.IGNORECASE
+)
+# Подпись цены с суммой без валюты или уже без суммы ("Цена: 5000", "Стоимость:"); "Цена договорная" не трогаем
+_PRICE_LABEL = re.compile(
+    rf'\b{_PRICE_WORD}\b\s*[:\-—–]?\s*(?:от\s+)?(?:{_NUMBER}(?!\w))?(?:\s*[,;]\s*|(?=\s*(?:[.!)]|$)))',
+    re.IGNORECASE | re.MULTILINE
+)
+_DISCOUNT = re.compile(r'(?<![\w%])[-−–]\s?\d{1,2}\s?%')  # "-20%"; "100% хлопок" не трогаем
+_DISCOUNT_SIZE = re.compile(r'(?<=\bскидка)\s*(?:до\s+)?\d{1,2}\s?%', re.IGNORECASE)  # "Скидка 20%" → "Скидка"
+
+_UNIT = r'(?:мм|см|дм|км|м|мл|л|кг|гр?|шт|mm|cm|kg)\.?(?!\w)'
+# Телефон; за числом единица измерения ("8 800 555 35 35 см") — это размер, не телефон
+_PHONE = re.compile(
+    rf'(?<!\w)(?:\+7|8|\+\d{{1,3}})[\s\-(]*\d{{3}}[\s\-)]*\d{{3}}[\s\-]*\d{{2}}[\s\-]*\d{{2}}(?!\d|\s*{_UNIT})'
+)
+_EMAIL = re.compile(r'\b[\w.+-]+@[\w-]+\.[\w.-]+\b')
+_LINK = re.compile(r'(?:https?://|www\.|\bt\.me/|\btelegram\.me/)\S+', re.IGNORECASE)
+_HANDLE = re.compile(r'(?<![\w@])@\w{3,}')
+
+# Строка-подводка к контакту, оставшаяся пустой после удаления контакта ("Для заказа:", "Менеджер —")
+_CONTACT_LEAD = re.compile(
+    r'^[^\w\n]*(?:для\s+заказа|заказ(?:ать)?|пиши(?:те)?|писать|звони(?:те)?|по\s+(?:всем\s+)?вопросам'
+    r'|подробн\w*|контакт\w*|менеджер\w*|администратор\w*|тел(?:ефон)?\.?|whats\s?app|вотсап|связь)[^\w\n]*$',
+    re.IGNORECASE | re.MULTILINE
+)
+
+# Призыв связаться, от которого после удаления контактов остались одни связки
+# ("Пишите  или ", "Для заказа звоните:"); "Пишите отзывы" не трогаем
+_CALL_VERB = r'(?:пиши(?:те)?|напиши(?:те)?|звони(?:те)?|позвони(?:те)?|обращайтесь)'
+_CALL_WORD = rf'(?:{_CALL_VERB}|или|и|в|на|по|лс|личку|директ|whats\s?app|вотсап|telegram|телеграм|менеджеру|телефону)'
+_CONTACT_CALL = re.compile(
+    rf'(?:\b(?:для\s+заказа|по\s+(?:всем\s+)?вопросам)[\s,:—–-]*)?'
+    rf'\b{_CALL_VERB}\b(?:[\s,:—–-]*\b{_CALL_WORD}\b)*[\s,:—–-]*(?:[.!;]|$)',
+    re.IGNORECASE | re.MULTILINE
+)
+
+_EMOJI = r'[\U0001F000-\U0001FAFF\u2600-\u27bf\u2b00-\u2bff\u2300-\u23ff]\ufe0f?'
+_EMOJI_RUN = re.compile(rf'({_EMOJI})(?:[ \u200d]*{_EMOJI})+')
+_SPACES = re.compile(r'[ \t\u00a0\u202f]+')
+_DANGLING = re.compile(r'[ \t]*[—–,-]+[ \t]*$', re.MULTILINE)  # "2 шт —" после удаления цены
+_PUNCT_ONLY_LINE = re.compile(r'^[^\w\n]*$', re.MULTILINE)
+_BLANK_LINES = re.compile(r'\n{3,}')
+_WORD = re.compile(r'[^\W\d_]{2,}')
+
+# Слова, из которых состоят "контактные" тексты — не считаются содержательными
+_CONTACT_WORDS = frozenset({
+    'пишите', 'писать', 'напишите', 'звоните', 'звонить', 'позвоните', 'или', 'и', 'в', 'во', 'на',
+    'по', 'для', 'за', 'заказа', 'заказ', 'заказать', 'всем', 'вопросам', 'вопросы', 'личку', 'лс',
+    'личные', 'сообщения', 'директ', 'тел', 'телефон', 'менеджер', 'менеджеру', 'администратор',
+    'контакты', 'связь', 'связи', 'подробнее', 'подробности', 'whatsapp', 'вотсап', 'telegram', 'телеграм',
+})
+
+
+class PreprocessResult(NamedTuple):
+    """Очищенный текст и нужен ли для него рерайт"""
+    text: str
+    skip: bool  # после чистки нечего переписывать — LLM не вызываем
+    removed_chars: int
+
+
+def preprocess(text: str) -> PreprocessResult:
+    """Удаляет цены и контакты, схлопывает пробелы и повторы эмодзи"""
+    started = time.perf_counter()
+    original = text or ''
+
+    cleaned = original.replace('\r\n', '\n')
+    cleaned = _LINK.sub('', cleaned)
+    cleaned = _EMAIL.sub('', cleaned)
+    cleaned = _HANDLE.sub('', cleaned)
+    cleaned = _PHONE.sub('', cleaned)
+    cleaned = _PRICE.sub('', cleaned)
+    cleaned = _PRICE_LABEL.sub('', cleaned)
+    cleaned = _DISCOUNT.sub('', cleaned)
+    cleaned = _DISCOUNT_SIZE.sub('', cleaned)
+    cleaned = _EMOJI_RUN.sub(r'\1', cleaned)
+
+    lines = [_SPACES.sub(' ', line).strip() for line in cleaned.split('\n')]
+    cleaned = '\n'.join(lines)
+    cleaned = _CONTACT_CALL.sub('', cleaned)
+    cleaned = '\n'.join(_SPACES.sub(' ', line).strip() for line in cleaned.split('\n'))
+    cleaned = _DANGLING.sub('', cleaned)
+    cleaned = _CONTACT_LEAD.sub('', cleaned)
+    cleaned = _PUNCT_ONLY_LINE.sub('', cleaned)
+    cleaned = _BLANK_LINES.sub('\n\n', cleaned).strip()
+
+    # Короткий пост ("Прицел 3-9x40, 2024 года") — всё равно пост: пропускаем, только если не осталось ничего
+    skip = not any(w.lower() not in _CONTACT_WORDS for w in _WORD.findall(cleaned))
+    removed = len(original) - len(cleaned)
+
+    metrics.inc('preprocess.chars_in', len(original))
+    metrics.inc('preprocess.chars_removed', removed)
+    if skip:
+        metrics.inc('preprocess.skipped')
+    metrics.observe('preprocess.us', (time.perf_counter() - started) * 1_000_000)
+
+    return PreprocessResult(cleaned, skip, removed)
+
@@ -0,0 +1,136 @@
+"""
+Бенчмарк пакетного рерайта против одиночного (app.ai.rewrite_batch_async)
+
+Один и тот же корпус коротких постов переписывается дважды через
+настроенные в .env провайдеры (нужны API-ключи, запросы платные):
+- single: по одному запросу на пост (rewrite_text_async)
+- batch: пакеты по --size постов (rewrite_batch_async), невалидные
+  элементы ответа переписываются поодиночке, как в processor
+
+Считает постов в секунду, входные/выходные токены на пост (по usage
+провайдера) и долю невалидных элементов пакета.
+
+Корпус (как у bench_preprocess; тексты проходят предобработку):
+- файл: посты разделены строкой "---" (или .jsonl с полем "text")
+- --db N: последние N original_text из message_queue (нужна БД)
+- без аргументов: встроенные примеры
+
+Использование:
+  python -m scripts.bench_batch_rewrite
+  python -m scripts.bench_batch_rewrite posts.txt --size 8 --limit 40
+  python -m scripts.bench_batch_rewrite --db 200 --size 5 --concurrency 4
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app import ai, metrics
+from app.ai_clients import client_pool
+from app.config import REWRITE_BATCH_SIZE, REWRITE_BATCH_MAX_CHARS
+from app.text_preprocess import preprocess
+from scripts.bench_preprocess import SAMPLE, load_db, load_file
+
+
+class Usage:
+    """Токены и время одного режима (по счётчикам app.metrics)"""
+
+    def __init__(self):
+        self.input_before = metrics.get('ai.input_tokens')
+        self.output_before = metrics.get('ai.output_tokens')
+        self.started = time.perf_counter()
+
+    def report(self, title: str, posts: int, requests: int):
+        elapsed = time.perf_counter() - self.started
+        input_tokens = metrics.get('ai.input_tokens') - self.input_before
+        output_tokens = metrics.get('ai.output_tokens') - self.output_before
+        print(f"\n{title}")
+        print(f"  Запросов к AI:        {requests}")
+        print(f"  Время:                {elapsed:.1f} с ({posts / elapsed:.2f} постов/с)")
+        print(f"  Входных токенов/пост: {input_tokens / posts:.0f}")
+        print(f"  Выходных токенов/пост: {output_tokens / posts:.0f}")
+        return elapsed, input_tokens + output_tokens
+
+
+async def run_single(texts: list[str], concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(text):
+        async with semaphore:
+            return await ai.rewrite_text_async(text)
+
+    usage = Usage()
+    await asyncio.gather(*(one(text) for text in texts))
+    return usage.report("Одиночный режим", len(texts), len(texts))
+
+
+async def run_batch(texts: list[str], size: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    invalid = 0
+
+    async def batch(chunk):
+        nonlocal invalid
+        async with semaphore:
+            results = await ai.rewrite_batch_async(chunk)
+        for text, result in zip(chunk, results):
+            if result is None:
+                invalid += 1
+                async with semaphore:
+                    await ai.rewrite_text_async(text)
+
+    usage = Usage()
+    chunks = [texts[i:i + size] for i in range(0, len(texts), size)]
+    await asyncio.gather(*(batch(chunk) for chunk in chunks))
+    elapsed, tokens = usage.report(f"Пакетный режим (по {size})", len(texts), len(chunks) + invalid)
+    print(f"  Невалидных элементов: {invalid} ({100 * invalid / len(texts):.1f}%)")
+    return elapsed, tokens
+
+
+async def main_async(texts: list[str], size: int, concurrency: int):
+    try:
+        single_time, single_tokens = await run_single(texts, concurrency)
+        batch_time, batch_tokens = await run_batch(texts, size, concurrency)
+    finally:
+        await client_pool.close()
+
+    print(f"\nПакетный / одиночный: время ×{batch_time / single_time:.2f}, "
+          f"токены ×{batch_tokens / max(single_tokens, 1):.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк пакетного рерайта")
+    parser.add_argument('corpus', nargs='?', type=Path, help="файл с постами")
+    parser.add_argument('--db', type=int, default=None, help="взять N последних текстов из message_queue")
+    parser.add_argument('--size', type=int, default=max(REWRITE_BATCH_SIZE, 5), help="постов в пакете")
+    parser.add_argument('--limit', type=int, default=20, help="сколько коротких постов переписать")
+    parser.add_argument('--concurrency', type=int, default=2, help="запросов к AI одновременно")
+    args = parser.parse_args()
+
+    if args.db:
+        posts = asyncio.run(load_db(args.db))
+    elif args.corpus:
+        posts = load_file(args.corpus)
+    else:
+        posts = SAMPLE
+
+    # Как в processor: предобработка, в пакеты — только короткие тексты
+    texts = []
+    for post in posts:
+        prepared = preprocess(post)
+        if not prepared.skip and len(prepared.text) <= REWRITE_BATCH_MAX_CHARS:
+            texts.append(prepared.text)
+    texts = texts[:args.limit]
+    if len(texts) < 2:
+        print(f"Коротких постов (≤ {REWRITE_BATCH_MAX_CHARS} симв.) меньше двух — сравнивать нечего")
+        return
+
+    print(f"Постов: {len(texts)}, маршрутов AI: {len(ai.router.routes)}")
+    asyncio.run(main_async(texts, args.size, args.concurrency))
+
+
+if __name__ == '__main__':
+    main()
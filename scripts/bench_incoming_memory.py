@@ -0,0 +1,102 @@
+"""
+Бенчмарк памяти: Telethon Message против IncomingItem в буфере альбомов
+
+Строит всплеск из N сообщений-медиа (альбомы по 10 фото, с подписью и entities)
+и через tracemalloc сравнивает, сколько памяти удерживает буфер:
+1. полными Telethon Message (как было в album_buffers)
+2. IncomingItem, извлечёнными в handler (Message после извлечения освобождается)
+
+Сеть и сессия не нужны — сообщения собираются из TL-типов напрямую.
+
+Использование:
+  python -m scripts.bench_incoming_memory [N]   (по умолчанию 10000)
+"""
+
+import gc
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from telethon.tl.custom.message import Message
+from telethon.tl.types import (
+    PeerChannel, MessageMediaPhoto, Photo, PhotoSize,
+    MessageEntityBold, MessageEntityTextUrl, MessageReplies,
+)
+from app.services.incoming import IncomingItem
+
+CHAT_ID = -1001234567890
+CAPTION = (
+    "Новое поступление! Размеры 42-52, ткань хлопок. "
+    "Цена 2500 ₽, доставка по всей России. Подробнее по ссылке."
+)
+
+
+def make_message(i: int) -> Message:
+    """Сообщение-медиа альбома, по составу полей как из реального канала"""
+    now = datetime.now(timezone.utc)
+    photo = Photo(
+        id=10_000_000 + i,
+        access_hash=int.from_bytes(os.urandom(7), 'big'),
+        file_reference=os.urandom(27),
+        date=now,
+        sizes=[
+            PhotoSize(type=t, w=w, h=w, size=w * 40)
+            for t, w in (('s', 90), ('m', 320), ('x', 800), ('y', 1280))
+        ],
+        dc_id=2,
+    )
+    return Message(
+        id=i,
+        peer_id=PeerChannel(channel_id=1234567890),
+        date=now,
+        message=CAPTION if i % 10 == 0 else "",
+        media=MessageMediaPhoto(photo=photo),
+        grouped_id=1_000_000 + i // 10,
+        entities=[
+            MessageEntityBold(offset=0, length=17),
+            MessageEntityTextUrl(offset=100, length=12, url="https://example.com/item"),
+        ] if i % 10 == 0 else None,
+        views=1500,
+        forwards=3,
+        replies=MessageReplies(replies=0, replies_pts=0),
+        post=True,
+    )
+
+
+def measure(n: int, compact: bool) -> int:
+    """Сколько байт удерживает буфер из n сообщений"""
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+
+    buffer = []
+    for i in range(n):
+        msg = make_message(i)
+        buffer.append(IncomingItem.from_message(CHAT_ID, msg) if compact else msg)
+    del msg
+
+    gc.collect()
+    held = tracemalloc.get_traced_memory()[0] - base
+    tracemalloc.stop()
+    del buffer
+    return held
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+
+    full = measure(n, compact=False)
+    compact = measure(n, compact=True)
+
+    print(f"Сообщений: {n}")
+    print(f"Telethon Message: {full / 1024 / 1024:8.2f} МБ  ({full / n:7.0f} байт/сообщение)")
+    print(f"IncomingItem:     {compact / 1024 / 1024:8.2f} МБ  ({compact / n:7.0f} байт/сообщение)")
+    print(f"Экономия:         {full / compact:8.1f}×")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Бенчмарк near-duplicate индекса (SimHash + LSH)
+
+Заполняет NearDupIndex N случайными отпечатками (по умолчанию 1M) и меряет
+время find() на 10k запросов: случайные (промах) и с 1–3 изменёнными битами
+(попадание). Цель — доли миллисекунды на поиск.
+
+БД не нужна (load() не вызывается).
+
+Использование:
+  python -m scripts.bench_near_dup [N]
+"""
+
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.services.near_dup import NearDupIndex
+
+QUERIES = 10_000
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def bench(index: NearDupIndex, queries: list[int]) -> tuple[list[float], int]:
+    timings, hits = [], 0
+    for fingerprint in queries:
+        started = time.perf_counter()
+        if index.find(fingerprint) is not None:
+            hits += 1
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings, hits
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    random.seed(42)
+
+    index = NearDupIndex()
+    fingerprints = [random.getrandbits(64) for _ in range(n)]
+
+    started = time.perf_counter()
+    for row_id, fingerprint in enumerate(fingerprints):
+        index.add(fingerprint, row_id)
+    print(f"Индекс: {len(index)} отпечатков за {time.perf_counter() - started:.1f} с")
+
+    misses = [random.getrandbits(64) for _ in range(QUERIES)]
+    near = []
+    for fingerprint in random.sample(fingerprints, QUERIES):
+        for bit in random.sample(range(64), random.randint(1, 3)):
+            fingerprint ^= 1 << bit
+        near.append(fingerprint)
+
+    for name, queries in (("случайные", misses), ("1–3 бита", near)):
+        timings, hits = bench(index, queries)
+        print(
+            f"{name:10s}: avg {sum(timings) / len(timings):6.1f} мкс | "
+            f"p99 {percentile(timings, 0.99):6.1f} мкс | найдено {hits}/{len(queries)}"
+        )
+
+
+if __name__ == '__main__':
+    main()
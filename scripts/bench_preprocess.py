@@ -0,0 +1,129 @@
+"""
+Бенчмарк предобработки текста перед рерайтом (app/text_preprocess.py)
+
+Прогоняет корпус постов через preprocess() и считает:
+- сколько символов входа срезано (цены, контакты, пробелы, повторы эмодзи)
+- сколько постов отсеяно без LLM (пусто / одни контакты)
+- время на пост (p50 / p99)
+
+Корпус:
+- файл: посты разделены строкой "---" (или .jsonl с полем "text")
+- --db N: последние N original_text из message_queue (нужна БД)
+- без аргументов: несколько встроенных примеров
+
+Использование:
+  python -m scripts.bench_preprocess posts.txt
+  python -m scripts.bench_preprocess --db 5000
+  python -m scripts.bench_preprocess --show 5 posts.txt   # + показать 5 примеров до/после
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.text_preprocess import preprocess
+
+REPEAT = 20  # прогонов корпуса для устойчивых таймингов
+
+SAMPLE = [
+    """🔥🔥🔥 Бронежилет Корсар М3 🔥🔥🔥
+
+Класс защиты Бр4, размер 50-54, вес 8 кг.
+Материал: кордура 500D, система MOLLE.
+
+Цена: 15 000 ₽
+Для заказа: @Svo_Manager
+Тел. +7 (900) 123-45-67""",
+    """Подсумок под магазин АК, выполнен из кордуры, 2 шт в комплекте — 3500 руб.
+Подробнее: https://t.me/some_shop/123 📦📦📦""",
+    """Пишите @manager или звоните 8 900 123 45 67""",
+    """Тактические перчатки Mechanix M-Pact.
+Размеры: S, M, L, XL.
+Скидка -20% до конца недели!
+Стоимость 2 900 р.
+✅✅ В наличии""",
+    """Аптечка АИ-4, новая. Комплектация по ГОСТ, жгут, бинты, ИПП.
+    Цена со скидкой 1 200 рублей/шт
+📞 +7-912-000-11-22, WhatsApp""",
+]
+
+
+def load_file(path: Path) -> list[str]:
+    if path.suffix == '.jsonl':
+        with path.open(encoding='utf-8') as f:
+            return [json.loads(line)['text'] for line in f if line.strip()]
+    content = path.read_text(encoding='utf-8')
+    return [post.strip() for post in content.split('\n---\n') if post.strip()]
+
+
+async def load_db(limit: int) -> list[str]:
+    from sqlalchemy import select
+    from app.database.engine import SessionLocal, engine
+    from app.models.message import MessageQueue
+
+    try:
+        async with SessionLocal() as session:
+            stmt = select(MessageQueue.original_text).where(
+                MessageQueue.original_text.isnot(None),
+                MessageQueue.original_text != ''
+            ).order_by(MessageQueue.id.desc()).limit(limit)
+            return list((await session.execute(stmt)).scalars().all())
+    finally:
+        await engine.dispose()
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк предобработки текста")
+    parser.add_argument('corpus', nargs='?', type=Path, help="файл с постами")
+    parser.add_argument('--db', type=int, default=None, help="взять N последних текстов из message_queue")
+    parser.add_argument('--show', type=int, default=0, help="показать N примеров до/после")
+    args = parser.parse_args()
+
+    if args.db:
+        posts = asyncio.run(load_db(args.db))
+    elif args.corpus:
+        posts = load_file(args.corpus)
+    else:
+        posts = SAMPLE
+    if not posts:
+        print("Корпус пуст")
+        return
+
+    results = [preprocess(post) for post in posts]
+
+    timings = []
+    for _ in range(REPEAT):
+        for post in posts:
+            started = time.perf_counter()
+            preprocess(post)
+            timings.append((time.perf_counter() - started) * 1_000_000)
+
+    chars_in = sum(len(post) for post in posts)
+    chars_out = sum(len(r.text) for r in results if not r.skip)
+    skipped = sum(r.skip for r in results)
+
+    print(f"Постов: {len(posts)}")
+    print(f"Символов на входе:   {chars_in} (в среднем {chars_in / len(posts):.0f} на пост)")
+    print(f"Символов уйдёт в LLM: {chars_out} (срезано {100 * (1 - chars_out / chars_in):.1f}%)")
+    print(f"Без вызова LLM:      {skipped} ({100 * skipped / len(posts):.1f}%)")
+    print(f"Время на пост: p50 {percentile(timings, 0.5):.1f} мкс, p99 {percentile(timings, 0.99):.1f} мкс")
+
+    for post, result in list(zip(posts, results))[:args.show]:
+        print("\n" + "=" * 60)
+        print(post)
+        print("-" * 60 + (" [без LLM]" if result.skip else ""))
+        print(result.text)
+
+
+if __name__ == '__main__':
+    main()
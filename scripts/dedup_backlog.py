@@ -0,0 +1,267 @@
+"""
+Офлайн-дедупликация истории message_queue / posts
+
+Для аудита или перед повторной публикацией: находит кластеры почти одинаковых
+текстов по всей истории и записывает номер кластера в dup_cluster_id.
+
+1. Тексты читаются из PostgreSQL потоком (server-side cursor, пачками по --chunk)
+2. SimHash считается в пуле процессов (та же функция, что и в live-детекторе,
+   app/services/near_dup.py) и собирается в NumPy-массивы uint64
+3. Одинаковые отпечатки схлопываются (np.unique), остальные сравниваются
+   только внутри LSH-корзин: 4 полосы по 16 бит, по полосе на процесс;
+   расстояние Хэмминга — векторно (XOR + np.bitwise_count) блоками
+4. Пары ≤ --max-distance объединяются union-find; номер кластера — минимальный id
+5. dup_cluster_id пишется пачками одним UPDATE ... FROM unnest(...)
+
+Строки вне кластеров получают dup_cluster_id = NULL (прошлый результат сбрасывается —
+только в просканированном окне: с --since-days старые строки не трогаются).
+
+Использование:
+  python -m scripts.dedup_backlog                          # message_queue.original_text
+  python -m scripts.dedup_backlog --table posts            # posts.final_text
+  python -m scripts.dedup_backlog --since-days 90 --dry-run
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import select, update, text as sql_text
+from app.database.engine import SessionLocal, engine
+from app.models.message import MessageQueue
+from app.models.post import Post
+from app.services.near_dup import simhash
+from app.config import NEAR_DUP_MAX_DISTANCE
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(message)s')
+logger = logging.getLogger(__name__)
+
+BANDS = 4
+BAND_BITS = 16
+BLOCK = 1024  # строк в блоке попарного сравнения (BLOCK × размер корзины)
+WRITE_BATCH = 10_000
+
+TABLES = {
+    'queue': (MessageQueue, MessageQueue.original_text, MessageQueue.collected_at),
+    'posts': (Post, Post.final_text, Post.created_at),
+}
+
+
+# ============================================
+# ПУЛ ПРОЦЕССОВ
+# ============================================
+
+def fingerprint_chunk(texts: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """SimHash пачки текстов → (маска "есть отпечаток", отпечатки uint64)"""
+    fingerprints = np.zeros(len(texts), dtype=np.uint64)
+    valid = np.zeros(len(texts), dtype=bool)
+    for i, text in enumerate(texts):
+        fingerprint = simhash(text or '')
+        if fingerprint is not None:
+            fingerprints[i] = fingerprint
+            valid[i] = True
+    return valid, fingerprints
+
+
+def band_pairs(fingerprints: np.ndarray, band: int, max_distance: int) -> np.ndarray:
+    """
+    Пары индексов (i, j), i < j, совпавшие в полосе band и близкие по Хэммингу
+
+    Возвращает массив формы (k, 2)
+    """
+    values = (fingerprints >> np.uint64(band * BAND_BITS)) & np.uint64((1 << BAND_BITS) - 1)
+    order = np.argsort(values, kind='stable')
+    boundaries = np.flatnonzero(np.diff(values[order])) + 1
+
+    pairs = []
+    for bucket in np.split(order, boundaries):
+        if len(bucket) < 2:
+            continue
+        members = fingerprints[bucket]
+        for start in range(0, len(bucket), BLOCK):
+            rows = members[start:start + BLOCK]
+            distances = np.bitwise_count(rows[:, None] ^ members[None, :])
+            i, j = np.nonzero(distances <= max_distance)
+            i += start
+            keep = i < j  # каждая пара один раз, без диагонали
+            if keep.any():
+                pairs.append(np.stack([bucket[i[keep]], bucket[j[keep]]], axis=1))
+
+    if not pairs:
+        return np.empty((0, 2), dtype=np.int64)
+    return np.concatenate(pairs)
+
+
+# ============================================
+# КЛАСТЕРИЗАЦИЯ
+# ============================================
+
+def _find(parent: np.ndarray, x: int) -> int:
+    root = x
+    while parent[root] != root:
+        root = parent[root]
+    while parent[x] != root:
+        parent[x], x = root, parent[x]
+    return root
+
+
+def find_clusters(ids: np.ndarray, fingerprints: np.ndarray, max_distance: int,
+                  pool: ProcessPoolExecutor) -> np.ndarray:
+    """
+    Номер кластера для каждой строки (0 — строка уникальна)
+
+    Номер кластера — минимальный id строки в нём
+    """
+    unique, inverse = np.unique(fingerprints, return_inverse=True)
+    logger.info(f"🔢 Отпечатков: {len(fingerprints)}, уникальных: {len(unique)}")
+
+    parent = np.arange(len(unique))
+    futures = [pool.submit(band_pairs, unique, band, max_distance) for band in range(BANDS)]
+    for band, future in enumerate(futures):
+        pairs = future.result()
+        logger.info(f"🧩 Полоса {band + 1}/{BANDS}: близких пар {len(pairs)}")
+        for a, b in pairs:
+            root_a, root_b = _find(parent, a), _find(parent, b)
+            if root_a != root_b:
+                parent[max(root_a, root_b)] = min(root_a, root_b)
+
+    roots = np.array([_find(parent, i) for i in range(len(unique))], dtype=np.int64)
+    row_roots = roots[inverse]
+
+    cluster_min = np.full(len(unique), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(cluster_min, row_roots, ids)
+    sizes = np.bincount(row_roots, minlength=len(unique))
+
+    return np.where(sizes[row_roots] > 1, cluster_min[row_roots], 0)
+
+
+# ============================================
+# БД
+# ============================================
+
+async def read_fingerprints(table: str, since: datetime | None, chunk: int,
+                            pool: ProcessPoolExecutor, workers: int) -> tuple[np.ndarray, np.ndarray]:
+    """Потоково читает тексты и считает отпечатки в пуле процессов"""
+    model, text_column, time_column = TABLES[table]
+    loop = asyncio.get_running_loop()
+
+    stmt = select(model.id, text_column).where(
+        text_column.isnot(None),
+        text_column != ''
+    ).order_by(model.id)
+    if since is not None:
+        stmt = stmt.where(time_column > since)
+
+    id_parts, fp_parts = [], []
+    pending = []
+    max_pending = workers * 2
+    read = 0
+
+    async def collect(ids, future):
+        valid, fingerprints = await future
+        id_parts.append(ids[valid])
+        fp_parts.append(fingerprints[valid])
+
+    async with SessionLocal() as session:
+        result = await session.stream(stmt.execution_options(yield_per=chunk))
+        async for rows in result.partitions(chunk):
+            ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            texts = [row[1] for row in rows]
+            pending.append((ids, loop.run_in_executor(pool, fingerprint_chunk, texts)))
+
+            # Не держим в памяти больше пачек, чем успевают обработать процессы
+            if len(pending) >= max_pending:
+                await collect(*pending.pop(0))
+
+            read += len(rows)
+            logger.info(f"📖 Прочитано {read} строк")
+
+    for ids, future in pending:
+        await collect(ids, future)
+
+    if not id_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint64)
+    return np.concatenate(id_parts), np.concatenate(fp_parts)
+
+
+async def write_clusters(table: str, ids: np.ndarray, clusters: np.ndarray, since: datetime | None):
+    """Сбрасывает старые кластеры в просканированном окне и пишет новые пачками"""
+    model, _, time_column = TABLES[table]
+    in_cluster = clusters > 0
+    ids, clusters = ids[in_cluster], clusters[in_cluster]
+
+    async with SessionLocal() as session:
+        reset = update(model).where(model.dup_cluster_id.isnot(None)).values(dup_cluster_id=None)
+        if since is not None:
+            reset = reset.where(time_column > since)  # то же окно, что при чтении
+        await session.execute(reset)
+
+        for start in range(0, len(ids), WRITE_BATCH):
+            await session.execute(
+                sql_text(
+                    f"UPDATE {model.__tablename__} AS t SET dup_cluster_id = v.cluster_id "
+                    f"FROM unnest(CAST(:ids AS BIGINT[]), CAST(:clusters AS BIGINT[])) AS v(id, cluster_id) "
+                    f"WHERE t.id = v.id"
+                ),
+                {
+                    'ids': ids[start:start + WRITE_BATCH].tolist(),
+                    'clusters': clusters[start:start + WRITE_BATCH].tolist(),
+                }
+            )
+            logger.info(f"💾 Записано {min(start + WRITE_BATCH, len(ids))}/{len(ids)}")
+
+        await session.commit()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Офлайн-дедупликация истории")
+    parser.add_argument('--table', choices=sorted(TABLES), default='queue')
+    parser.add_argument('--since-days', type=int, default=None, help="только за последние N дней")
+    parser.add_argument('--max-distance', type=int, default=NEAR_DUP_MAX_DISTANCE,
+                        help="порог Хэмминга (гарантированно находятся пары ≤ 3)")
+    parser.add_argument('--chunk', type=int, default=5000, help="строк в пачке чтения")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="процессов в пуле")
+    parser.add_argument('--dry-run', action='store_true', help="только посчитать, не писать в БД")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    since = datetime.utcnow() - timedelta(days=args.since_days) if args.since_days is not None else None
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            ids, fingerprints = await read_fingerprints(
+                args.table, since, args.chunk, pool, args.workers
+            )
+            if len(ids) == 0:
+                logger.info("ℹ️ Нет текстов для сравнения")
+                return
+            clusters = find_clusters(ids, fingerprints, args.max_distance, pool)
+
+        in_cluster = clusters > 0
+        n_clusters = len(np.unique(clusters[in_cluster]))
+        logger.info(
+            f"✅ Кластеров: {n_clusters}, строк в них: {int(in_cluster.sum())} "
+            f"из {len(ids)} ({time.perf_counter() - started:.1f} с)"
+        )
+
+        if args.dry_run:
+            logger.info("ℹ️ --dry-run: в БД ничего не записано")
+            return
+
+        await write_clusters(args.table, ids, clusters, since)
+        logger.info(f"✅ Готово за {time.perf_counter() - started:.1f} с")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
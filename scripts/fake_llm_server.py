@@ -0,0 +1,184 @@
+"""
+Локальный фейковый OpenAI-совместимый сервер LLM
+
+Для проверки сборки запросов и учёта кэша промпта без ключей и платных запросов.
+Отвечает на POST /v1/chat/completions (и /chat/completions):
+- текст ответа — локальный рерайт (app/fallback_rewriter.py); для пакетного
+  промпта (## BATCH MODE) — JSON-массив [{"id", "text"}]
+- кэш префикса как у провайдеров: общая побайтовая часть системного сообщения
+  с уже виденными (не короче --min-cache-tokens) в usage отдаётся как закэшированная —
+  prompt_tokens_details.cached_tokens (OpenAI/OpenRouter) и
+  prompt_cache_hit_tokens / prompt_cache_miss_tokens (DeepSeek)
+- задержка и доля ошибок настраиваются (проверка роутера и hedging)
+
+Токены считаются приблизительно: 1 токен ≈ 4 символа.
+
+Использование:
+  python -m scripts.fake_llm_server --port 8808 --latency-ms 300
+  OPENROUTER_BASE_URL=http://127.0.0.1:8808/v1 OPENROUTER_API_KEY=fake python -m scripts.bench_batch_rewrite
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.fallback_rewriter import fallback_rewrite
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class PrefixCache:
+    """Кэш системных сообщений: текст → когда истекает; попадание — по самому длинному общему префиксу"""
+
+    def __init__(self, ttl: float, min_tokens: int):
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self._seen = {}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hits = 0
+        self.cached_tokens = 0
+        self.prompt_tokens = 0
+
+    def lookup(self, system: str, prompt_tokens: int) -> int:
+        """Сколько входных токенов пришло из кэша (и запомнить префикс)"""
+        now = time.monotonic()
+        with self._lock:
+            self.requests += 1
+            self.prompt_tokens += prompt_tokens
+            self._seen = {text: expires for text, expires in self._seen.items() if expires > now}
+
+            common = max((len(os.path.commonprefix((system, text))) for text in self._seen), default=0)
+            self._seen[system] = now + self.ttl
+            tokens = common // 4
+            if tokens < self.min_tokens:
+                return 0
+            self.hits += 1
+            self.cached_tokens += tokens
+            return tokens
+
+
+def _text(content) -> str:
+    """content сообщения: строка или список частей (как с cache_control)"""
+    if isinstance(content, list):
+        return ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return content or ''
+
+
+def _answer(system: str, user: str) -> str:
+    if '## BATCH MODE' not in system:
+        return fallback_rewrite(user)
+    try:
+        items = json.loads(user)
+    except ValueError:
+        return '[]'
+    return json.dumps(
+        [{"id": item.get("id"), "text": fallback_rewrite(item.get("text", ""))} for item in items],
+        ensure_ascii=False
+    )
+
+
+def make_handler(args, cache: PrefixCache):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive, как у настоящих API
+
+        def log_message(self, fmt, *fmt_args):
+            pass
+
+        def _send(self, status: int, body: dict, headers: dict | None = None):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+                self._send(404, {"error": {"message": f"unknown path {self.path}"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+
+            delay = args.latency_ms + random.uniform(0, args.jitter_ms)
+            time.sleep(delay / 1000)
+
+            if random.random() < args.fail_rate:
+                if random.random() < 0.5:
+                    self._send(429, {"error": {"message": "rate limited (fake)"}}, {'Retry-After': '1'})
+                else:
+                    self._send(500, {"error": {"message": "internal error (fake)"}})
+                return
+
+            messages = request.get('messages', [])
+            system = ''.join(_text(m.get('content')) for m in messages if m.get('role') == 'system')
+            user = '\n'.join(_text(m.get('content')) for m in messages if m.get('role') == 'user')
+            content = _answer(system, user)
+
+            prompt_tokens = estimate_tokens(system) + estimate_tokens(user)
+            cached = cache.lookup(system, prompt_tokens)
+            completion_tokens = estimate_tokens(content)
+            print(f"{request.get('model')}: вход {prompt_tokens} (из кэша {cached}), "
+                  f"выход {completion_tokens}, {delay:.0f} мс", flush=True)
+
+            self._send(200, {
+                "id": f"fake-{time.time_ns()}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get('model'),
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                    "prompt_tokens_details": {"cached_tokens": cached},
+                    "prompt_cache_hit_tokens": cached,
+                    "prompt_cache_miss_tokens": prompt_tokens - cached,
+                },
+            })
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый OpenAI-совместимый сервер LLM")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8808)
+    parser.add_argument('--latency-ms', type=float, default=200, help="базовая задержка ответа")
+    parser.add_argument('--jitter-ms', type=float, default=100, help="случайная добавка к задержке")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="доля ответов 429/500")
+    parser.add_argument('--cache-ttl', type=float, default=300, help="сколько секунд помнить префикс")
+    parser.add_argument('--min-cache-tokens', type=int, default=1024, help="префикс короче не кэшируется")
+    args = parser.parse_args()
+
+    cache = PrefixCache(args.cache_ttl, args.min_cache_tokens)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args, cache))
+    print(f"Фейковый LLM: http://{args.host}:{args.port}/v1 (Ctrl+C — остановить)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        share = cache.cached_tokens / cache.prompt_tokens if cache.prompt_tokens else 0
+        print(f"\nЗапросов: {cache.requests}, попаданий в кэш: {cache.hits}, "
+              f"входных токенов из кэша: {100 * share:.1f}%")
+
+
+if __name__ == '__main__':
+    main()
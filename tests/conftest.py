@@ -0,0 +1,73 @@
+"""
+Общие настройки тестов
+
+app.config читает обязательные переменные при импорте — задаём заглушки до
+импорта app. Тестам с БД нужен отдельный PostgreSQL: TEST_DATABASE_URL
+(postgresql+asyncpg://...), схема пересоздаётся. Без него такие тесты пропускаются.
+"""
+import os
+
+for name, value in (('API_ID', '1'), ('API_HASH', 'test'), ('PHONE', '0'), ('DEST', 'test')):
+    os.environ.setdefault(name, value)
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+if TEST_DATABASE_URL:
+    os.environ['DATABASE_URL'] = TEST_DATABASE_URL
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE_URL:
+        return
+    skip = pytest.mark.skip(reason="TEST_DATABASE_URL не задан")
+    for item in items:
+        if 'db' in item.keywords:
+            item.add_marker(skip)
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "db: тест с PostgreSQL (TEST_DATABASE_URL)")
+
+
+@pytest.fixture
+def llm_server():
+    """Локальный OpenAI-совместимый сервер: отвечает по очереди из server.replies (статус)"""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            server.requests += 1
+            status = server.replies.pop(0) if server.replies else 200
+            if status == 200:
+                body = {
+                    "id": "test", "object": "chat.completion", "created": 0, "model": "test-model",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 2, "total_tokens": 12},
+                }
+            else:
+                body = {"error": {"message": "fail"}}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests, server.replies = 0, []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.base_url = f"http://127.0.0.1:{server.server_port}/v1"
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,34 @@
+"""Клиенты SDK не повторяют запросы сами — повторяет только роутер"""
+import asyncio
+
+import pytest
+
+
+def test_sdk_retries_disabled():
+    from app.ai_clients import ClientPool
+
+    pool = ClientPool()
+    assert pool.get('openrouter', 'key').max_retries == 0
+    assert pool.get('google', 'key')._api_client._http_options.retry_options.attempts == 1
+    asyncio.run(pool.close())
+
+
+def test_server_error_reaches_router_once(llm_server, monkeypatch):
+    import openai
+    from app import ai_clients
+    from app.ai_clients import ClientPool
+
+    monkeypatch.setitem(ai_clients.BASE_URLS, 'openrouter', llm_server.base_url)
+    llm_server.replies = [500]
+    pool = ClientPool()
+
+    async def call():
+        client = pool.get('openrouter', 'key')
+        try:
+            with pytest.raises(openai.InternalServerError):
+                await client.chat.completions.create(model='test-model', messages=[{"role": "user", "content": "x"}])
+        finally:
+            await pool.close()
+
+    asyncio.run(call())
+    assert llm_server.requests == 1
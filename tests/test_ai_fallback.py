@@ -0,0 +1,48 @@
+"""Запасной рерайтер не подменяет AI после одной временной ошибки"""
+import asyncio
+
+import httpx
+
+
+def test_single_route_recovers_after_one_server_error(monkeypatch):
+    from app import ai
+    from app.ai_router import AiRouter, Route
+
+    calls = []
+
+    async def fake_request(route, text, prefix=None):
+        calls.append(route)
+        if len(calls) == 1:
+            request = httpx.Request('POST', 'https://llm.test/v1/chat/completions')
+            raise httpx.HTTPStatusError("server error", request=request, response=httpx.Response(500, request=request))
+        return f"rewritten: {text}", 10, 5
+
+    monkeypatch.setattr(ai, 'router', AiRouter([Route('openrouter', 'key', 0, 'test-model')]))
+    monkeypatch.setattr(ai, '_request', fake_request)
+    monkeypatch.setattr(ai, 'AI_HEDGE', False)
+    monkeypatch.setattr(ai, 'AI_FALLBACK', True)
+
+    result = asyncio.run(ai.rewrite_text_async("Куртка Softshell, размеры 46-58"))
+
+    assert result.provider == 'openrouter'
+    assert result.text == "rewritten: Куртка Softshell, размеры 46-58"
+    assert len(calls) == 2
+
+
+def test_fallback_when_breaker_open(monkeypatch):
+    from app import ai
+    from app.ai_router import AiRouter, Route, OPEN
+
+    route = Route('openrouter', 'key', 0, 'test-model', state=OPEN)
+    route.cooldown_until = float('inf')
+
+    async def fake_request(route, text, prefix=None):
+        raise AssertionError("разомкнутый маршрут не должен получать запросы")
+
+    monkeypatch.setattr(ai, 'router', AiRouter([route]))
+    monkeypatch.setattr(ai, '_request', fake_request)
+    monkeypatch.setattr(ai, 'AI_FALLBACK', True)
+
+    result = asyncio.run(ai.rewrite_text_async("Куртка Softshell, размеры 46-58"))
+
+    assert result.provider == 'fallback'
@@ -0,0 +1,185 @@
+"""Роутер AI: классификация ошибок, паузы, circuit breaker и Retry-After"""
+import asyncio
+import types
+
+import httpx
+import openai
+import pytest
+
+from app import ai_router
+from app.ai_router import (
+    AiRouter, Route, RoutesExhausted, classify_error,
+    CLOSED, OPEN, HALF_OPEN, RATE_LIMIT, QUOTA, AUTH, NOT_FOUND, TIMEOUT, NETWORK, SERVER, BAD_REQUEST, UNKNOWN,
+)
+
+URL = 'https://llm.test/v1/chat/completions'
+
+
+def http_error(status: int, headers=None) -> httpx.HTTPStatusError:
+    request = httpx.Request('POST', URL)
+    response = httpx.Response(status, headers=headers, request=request)
+    return httpx.HTTPStatusError(f"{status}", request=request, response=response)
+
+
+@pytest.mark.parametrize('status, kind', [
+    (402, QUOTA),
+    (401, AUTH),
+    (403, AUTH),
+    (404, NOT_FOUND),
+    (408, TIMEOUT),
+    (504, TIMEOUT),
+    (500, SERVER),
+    (503, SERVER),
+    (400, BAD_REQUEST),
+])
+def test_classify_status(status, kind):
+    assert classify_error(http_error(status)).kind == kind
+
+
+def test_classify_rate_limit_with_retry_after():
+    assert classify_error(http_error(429, {'Retry-After': '7'})) == (RATE_LIMIT, 7.0)
+    assert classify_error(http_error(429)) == (RATE_LIMIT, None)
+
+
+def test_classify_openai_errors():
+    request = httpx.Request('POST', URL)
+    response = httpx.Response(429, headers={'retry-after': '3'}, request=request)
+
+    assert classify_error(openai.RateLimitError("429", response=response, body=None)) == (RATE_LIMIT, 3.0)
+    assert classify_error(openai.APITimeoutError(request)).kind == TIMEOUT
+    assert classify_error(openai.APIConnectionError(request=request)).kind == NETWORK
+
+
+def test_classify_transport_errors():
+    request = httpx.Request('POST', URL)
+
+    assert classify_error(asyncio.TimeoutError()).kind == TIMEOUT
+    assert classify_error(httpx.ReadTimeout("timeout", request=request)).kind == TIMEOUT
+    assert classify_error(httpx.ConnectError("refused", request=request)).kind == NETWORK
+    assert classify_error(ValueError("bad json")).kind == UNKNOWN
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ai_router, 'time', types.SimpleNamespace(monotonic=clock.monotonic, time=lambda: 0.0))
+    monkeypatch.setattr(ai_router, 'AI_RETRY_BACKOFF', 1.0)
+    monkeypatch.setattr(ai_router, 'AI_RATE_LIMIT_COOLDOWN', 30.0)
+    monkeypatch.setattr(ai_router, 'AI_BREAKER_THRESHOLD', 3)
+    monkeypatch.setattr(ai_router, 'AI_BREAKER_COOLDOWN', 60.0)
+    monkeypatch.setattr(ai_router, 'AI_BREAKER_MAX_COOLDOWN', 900.0)
+    return clock
+
+
+def route(key='key', model='model') -> Route:
+    return Route('openrouter', key, 0, model)
+
+
+def test_backoff_doubles_then_breaker_opens(clock):
+    r = route()
+    router = AiRouter([r])
+
+    router.failure(r, http_error(500))
+    assert r.cooldown_until == clock.now + 1 and r.state == CLOSED
+    router.failure(r, http_error(500))
+    assert r.cooldown_until == clock.now + 2 and r.state == CLOSED
+
+    router.failure(r, http_error(500))
+    assert r.state == OPEN
+    assert r.cooldown_until == clock.now + 60
+
+
+def test_half_open_probe(clock):
+    r = route()
+    router = AiRouter([r])
+    for _ in range(3):
+        router.failure(r, http_error(500))
+
+    assert router.try_acquire() is None
+    clock.now += 60
+    assert router.try_acquire() is r
+    assert r.state == HALF_OPEN
+    assert router.try_acquire() is None  # один пробный запрос
+
+    # Проба не удалась — пауза удваивается
+    router.failure(r, http_error(500))
+    asyncio.run(router.release(r))
+    assert r.state == OPEN
+    assert r.cooldown_until == clock.now + 120
+
+    clock.now += 120
+    assert router.try_acquire() is r
+    router.success(r, latency_ms=100)
+    asyncio.run(router.release(r))
+    assert r.state == CLOSED and r.opens == 0 and r.failures == 0
+
+
+def test_rate_limit_pauses_by_retry_after(clock):
+    r = route()
+    router = AiRouter([r])
+
+    failure = router.failure(r, http_error(429, {'Retry-After': '7'}))
+    assert failure.kind == RATE_LIMIT
+    assert r.cooldown_until == clock.now + 7
+    assert r.state == CLOSED
+
+    clock.now += 7
+    router.failure(r, http_error(429))
+    assert r.cooldown_until == clock.now + 30
+
+
+def test_retry_after_extends_breaker_cooldown(clock):
+    r = route()
+    router = AiRouter([r])
+    router.failure(r, http_error(500))
+    router.failure(r, http_error(500))
+
+    router.failure(r, http_error(429, {'Retry-After': '300'}))
+    assert r.state == OPEN
+    assert r.cooldown_until == clock.now + 300
+
+
+def test_auth_error_opens_whole_key(clock):
+    a, b, other = route(model='a'), route(model='b'), route(key='other')
+    router = AiRouter([a, b, other])
+
+    router.failure(a, http_error(401))
+    assert a.state == b.state == OPEN
+    assert a.cooldown_until == b.cooldown_until == clock.now + 900
+    assert other.state == CLOSED
+    assert router.try_acquire() is other
+
+
+def test_not_found_opens_route_only(clock):
+    a, b = route(model='a'), route(model='b')
+    router = AiRouter([a, b])
+
+    router.failure(a, http_error(404))
+    assert a.state == OPEN and a.cooldown_until == clock.now + 900
+    assert b.state == CLOSED
+
+
+def test_acquire_exhausted_when_no_route_frees_in_time(clock):
+    r = route()
+    router = AiRouter([r])
+    for _ in range(3):
+        router.failure(r, http_error(500))
+
+    with pytest.raises(RoutesExhausted):
+        asyncio.run(router.acquire(max_wait=5))
+
+
+def test_acquire_skips_paused_route(clock):
+    slow, fast = route(model='slow'), route(model='fast')
+    router = AiRouter([slow, fast])
+    router.failure(slow, http_error(500))
+
+    assert asyncio.run(router.acquire(max_wait=5)) is fast
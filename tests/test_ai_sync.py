@@ -0,0 +1,18 @@
+"""Синхронная обёртка rewrite_text: каждый asyncio.run — со свежим состоянием"""
+
+
+def test_rewrite_text_twice_from_sync_code(llm_server, monkeypatch):
+    from app import ai, ai_clients
+    from app.ai_router import AiRouter, Route
+
+    monkeypatch.setitem(ai_clients.BASE_URLS, 'openrouter', llm_server.base_url)
+    monkeypatch.setattr(ai, 'router', AiRouter([Route('openrouter', 'key', 0, 'test-model')]))
+    monkeypatch.setattr(ai, 'AI_HEDGE', False)
+    monkeypatch.setattr(ai, 'AI_FALLBACK', False)
+    # В каждом вызове сначала 5xx: роутер ждёт конца паузы маршрута на своём Condition
+    llm_server.replies = [500, 200, 500, 200]
+
+    assert ai.rewrite_text("Куртка Softshell, размеры 46-58") == "ok"
+    assert ai.rewrite_text("Штаны G3, размеры 46-58") == "ok"
+    assert llm_server.requests == 4
+    assert len(ai.client_pool) == 0
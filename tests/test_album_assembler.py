@@ -0,0 +1,147 @@
+"""AlbumAssembler без event loop: часы подставляются"""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from app.services.album_assembler import ALBUM_MAX_ITEMS, AlbumAssembler
+from app.services.incoming import IncomingItem
+
+CHAT_ID = -100123
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def assembler(clock):
+    return AlbumAssembler(clock=clock, min_window=0.5, max_window=3.0, factor=3.0, alpha=0.3)
+
+
+def media(message_id: int, grouped_id: int = 1, chat_id: int = CHAT_ID):
+    return IncomingItem(chat_id, message_id, grouped_id, None, datetime.utcnow(), 'photo', message_id, 0, b'')
+
+
+def text(message_id: int, chat_id: int = CHAT_ID):
+    return IncomingItem(chat_id, message_id, None, "текст", datetime.utcnow())
+
+
+def test_message_waits_for_open_album_and_late_item_joins_it(assembler, clock):
+    assembler.add(CHAT_ID, 1, media(10))
+    assembler.add(CHAT_ID, 1, media(11))
+    single = text(13)
+    assert assembler.hold(CHAT_ID, single)
+
+    # Медиа альбома пришло позже одиночного сообщения — попадает в тот же альбом
+    clock.now = 0.1
+    assert assembler.add(CHAT_ID, 1, media(12)) is None
+    assert len(assembler) == 1
+
+    (album,) = assembler.pop_due(10)
+    assert [m.message_id for m in album.messages] == [10, 11, 12]
+    assert album.followers == [single]
+
+
+def test_hold_without_open_album(assembler):
+    assembler.add(CHAT_ID + 1, 1, media(10, chat_id=CHAT_ID + 1))
+    assert not assembler.hold(CHAT_ID, text(5))
+
+
+def test_followers_released_after_last_album_of_chat(assembler):
+    assembler.add(CHAT_ID, 1, media(10))
+    assembler.add(CHAT_ID, 2, media(20, grouped_id=2))
+    single = text(21)
+    assembler.hold(CHAT_ID, single)
+
+    first, second = sorted(assembler.close_all(), key=lambda album: album.grouped_id)
+    assert first.followers == []
+    assert second.followers == [single]
+
+
+def test_flush_sends_album_before_followers(assembler):
+    calls = []
+
+    async def on_album(album):
+        calls.append(('album', album.grouped_id))
+
+    async def on_message(item):
+        calls.append(('message', item.message_id))
+
+    assembler.on_album, assembler.on_message = on_album, on_message
+    assembler.add(CHAT_ID, 1, media(10))
+    assembler.hold(CHAT_ID, text(11))
+    (album,) = assembler.close_all()
+    asyncio.run(assembler.flush(album))
+
+    assert calls == [('album', 1), ('message', 11)]
+
+
+def test_closes_at_max_items(assembler):
+    for message_id in range(1, ALBUM_MAX_ITEMS):
+        assert assembler.add(CHAT_ID, 1, media(message_id)) is None
+
+    album = assembler.add(CHAT_ID, 1, media(ALBUM_MAX_ITEMS))
+    assert album is not None
+    assert len(album.messages) == ALBUM_MAX_ITEMS
+    assert len(assembler) == 0
+    assert assembler.next_deadline() is None  # запись кучи закрытого альбома не актуальна
+
+
+def test_quiet_window_close(assembler, clock):
+    assembler.add(CHAT_ID, 1, media(1))
+    assert assembler.next_deadline() == 3.0  # наблюдений нет — max_window
+
+    assert assembler.pop_due(2.9) == []
+    (album,) = assembler.pop_due(3.0)
+    assert album.grouped_id == 1
+    assert assembler.next_deadline() is None
+
+
+def test_stale_heap_entries_skipped_after_deadline_moves(assembler, clock):
+    assembler.add(CHAT_ID, 1, media(1))
+    clock.now = 1.0
+    assembler.add(CHAT_ID, 1, media(2))  # дедлайн сдвинулся 3.0 → 4.0
+
+    assert assembler.pop_due(3.5) == []  # старая запись кучи пропущена
+    assert len(assembler) == 1
+    assert assembler.next_deadline() == 4.0
+
+    (album,) = assembler.pop_due(4.0)
+    assert [m.message_id for m in album.messages] == [1, 2]
+    assert album.max_gap == 1.0
+
+
+def close_album(assembler, clock, chat_id, grouped_id, gap):
+    """Альбом из двух медиа с паузой gap, закрытый по тишине"""
+    assembler.add(chat_id, grouped_id, media(grouped_id * 10, grouped_id, chat_id))
+    clock.now += gap
+    assembler.add(chat_id, grouped_id, media(grouped_id * 10 + 1, grouped_id, chat_id))
+    clock.now += 10
+    assert len(assembler.pop_due()) == 1
+
+
+def test_window_adapts_per_chat(assembler, clock):
+    other = CHAT_ID + 1
+
+    close_album(assembler, clock, CHAT_ID, 1, gap=0.2)
+    assert assembler.window(CHAT_ID) == pytest.approx(0.6)  # 0.2 × factor
+    assert assembler.window(other) == 3.0  # у другого чата наблюдений нет
+
+    close_album(assembler, clock, CHAT_ID, 2, gap=0.4)
+    assert assembler.window(CHAT_ID) == pytest.approx((0.3 * 0.4 + 0.7 * 0.2) * 3)  # EWMA, alpha=0.3
+
+    close_album(assembler, clock, other, 3, gap=0.05)
+    assert assembler.window(other) == 0.5  # не меньше min_window
+
+    close_album(assembler, clock, other, 4, gap=5.0)
+    assert assembler.window(other) == 3.0  # не больше max_window
@@ -0,0 +1,145 @@
+"""
+Склейка альбома без подписи с текстом, пришедшим следом
+
+Альбом без подписи не собирается, пока открыто окно склейки: текст внутри
+окна должен попасть в тот же пост, а не стать отдельным.
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+pytestmark = pytest.mark.db
+
+CHAT_ID = -100123
+GROUPED_ID = 777
+
+
+def run(scenario):
+    """Пересоздаёт схему и выполняет сценарий в одном event loop"""
+    from app.database.engine import engine
+    from app.models import Base
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            await scenario()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+def album():
+    from app.services.album_assembler import Album
+    from app.services.incoming import IncomingItem
+
+    now = datetime.utcnow()
+    return Album(CHAT_ID, GROUPED_ID, messages=[
+        IncomingItem(CHAT_ID, 10, GROUPED_ID, None, now, 'photo', 1, 11, b'a'),
+        IncomingItem(CHAT_ID, 11, GROUPED_ID, None, now, 'photo', 2, 22, b'b'),
+    ])
+
+
+def text(message_id: int, value: str):
+    from app.services.incoming import IncomingItem
+    return IncomingItem(CHAT_ID, message_id, None, value, datetime.utcnow())
+
+
+async def add_source():
+    from app.database.engine import SessionLocal
+    from app.models import Source
+
+    async with SessionLocal() as session:
+        session.add(Source(chat_id=CHAT_ID, title='test'))
+        await session.commit()
+
+
+async def build():
+    from app.database.engine import SessionLocal
+    from app.services.processor import MessageProcessor
+
+    async with SessionLocal() as session:
+        await MessageProcessor(session).build_posts_from_messages()
+
+
+async def posts():
+    from app.database.engine import SessionLocal
+    from app.models import Post, PostMedia
+
+    async with SessionLocal() as session:
+        result = await session.execute(select(Post).order_by(Post.id))
+        found = result.scalars().all()
+        media = (await session.execute(select(PostMedia))).scalars().all()
+    return found, media
+
+
+def test_text_inside_window_glued_to_album(monkeypatch):
+    from app import ai
+    from app.database.engine import SessionLocal
+    from app.services.collector import MessageCollector
+    from app.services.gluing import GluingEngine
+    from app.services.processor import MessageProcessor
+
+    calls = []
+
+    async def fake_rewrite(value, max_retries=6, album=False):
+        calls.append((value, album))
+        return ai.RewriteResult(f"rewritten: {value}", 'test', 'test-model')
+
+    monkeypatch.setattr(ai, 'rewrite_text_async', fake_rewrite)
+    caption = "Новое поступление курток Softshell всех размеров, доставка по всей стране"
+
+    async def scenario():
+        await add_source()
+        gluing = GluingEngine()
+
+        async with SessionLocal() as session:
+            await MessageCollector(session, gluing).collect_album(album())
+
+        # Окно склейки открыто — сборщик альбом не трогает
+        await build()
+        assert (await posts())[0] == []
+
+        async with SessionLocal() as session:
+            await MessageCollector(session, gluing).collect_message(text(12, caption))
+
+        async with SessionLocal() as session:
+            assert await MessageProcessor(session).process_pending_rewrites() == 1
+        await build()
+
+        found, media = await posts()
+        assert len(found) == 1
+        assert found[0].grouped_id == GROUPED_ID
+        assert found[0].final_text == f"rewritten: {caption}"
+        assert len(media) == 2
+        assert calls == [(caption, True)]
+
+    run(scenario)
+
+
+def test_album_released_when_window_expires():
+    from app.database.engine import SessionLocal
+    from app.services.collector import MessageCollector
+    from app.services.gluing import GluingEngine
+
+    async def scenario():
+        await add_source()
+        gluing = GluingEngine()
+
+        async with SessionLocal() as session:
+            await MessageCollector(session, gluing).collect_album(album())
+
+        # То, что делает колесо таймеров по истечении окна
+        await gluing._close_expired([], [gluing._albums[CHAT_ID]])
+        await build()
+
+        found, media = await posts()
+        assert len(found) == 1
+        assert found[0].grouped_id == GROUPED_ID
+        assert len(media) == 2
+
+    run(scenario)
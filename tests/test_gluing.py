@@ -0,0 +1,114 @@
+"""Колесо таймеров и порядок сопоставления текста в GluingEngine"""
+import asyncio
+from datetime import datetime, timedelta
+
+from app.services.gluing import GluingEngine, PendingMedia, RecentAlbum, TimerWheel
+
+CHAT_ID = -100123
+
+
+def test_timer_fires_on_deadline_tick():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule('a', deadline=3.0, now=0.0)
+
+    assert wheel.advance(2.5) == []
+    assert wheel.advance(3.0) == ['a']
+    assert len(wheel) == 0
+
+
+def test_past_deadline_fires_on_next_tick():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.advance(10.0)
+    wheel.schedule('a', deadline=4.0, now=10.0)
+
+    assert wheel.advance(11.0) == ['a']
+
+
+def test_cancel():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule('a', deadline=3.0, now=0.0)
+
+    assert wheel.cancel('a')
+    assert not wheel.cancel('a')
+    assert wheel.advance(5.0) == []
+
+
+def test_reschedule_replaces_timer():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule('a', deadline=3.0, now=0.0)
+    wheel.schedule('a', deadline=6.0, now=0.0)
+
+    assert wheel.advance(4.0) == []
+    assert wheel.advance(6.0) == ['a']
+
+
+def test_wrap_around_after_long_sleep():
+    wheel = TimerWheel(tick=1.0, slots=8)
+    wheel.schedule('soon', deadline=20.0, now=0.0)
+    wheel.schedule('later', deadline=100.0, now=0.0)  # тот же слот (100 % 8 == 20 % 8)
+
+    assert wheel.advance(5.0) == []
+    # Проспали несколько оборотов: один проход по слотам, поздний таймер остаётся
+    assert wheel.advance(30.0) == ['soon']
+    assert len(wheel) == 1
+    assert wheel.advance(100.0) == ['later']
+
+
+def run(scenario):
+    async def main():
+        engine = GluingEngine(tick_ms=10)
+        scenario(engine)
+
+    asyncio.run(main())
+
+
+def until():
+    return datetime.utcnow() + timedelta(seconds=30)
+
+
+def test_latest_media_before_text_wins():
+    def scenario(engine):
+        engine.register_album(CHAT_ID, 777, head_row_id=1, head_message_id=5, has_text=False, until=until())
+        engine.register_media(CHAT_ID, 7, row_id=2, awaiting_until=until())
+        engine.register_media(CHAT_ID, 8, row_id=3, awaiting_until=until())
+        engine.register_media(CHAT_ID, 12, row_id=4, awaiting_until=until())
+
+        assert engine.match_text(CHAT_ID, 10) == PendingMedia(CHAT_ID, 8, 3)
+        assert engine.match_text(CHAT_ID, 10) == PendingMedia(CHAT_ID, 7, 2)
+        # Медиа до текста кончились — текст уходит в альбом
+        assert isinstance(engine.match_text(CHAT_ID, 10), RecentAlbum)
+
+    run(scenario)
+
+
+def test_album_takes_one_text():
+    def scenario(engine):
+        engine.register_album(CHAT_ID, 777, head_row_id=1, head_message_id=5, has_text=False, until=until())
+
+        assert engine.match_text(CHAT_ID, 4) is None  # текст раньше альбома
+        album = engine.match_text(CHAT_ID, 6)
+        assert album.grouped_id == 777 and album.has_text
+        assert engine.match_text(CHAT_ID, 7) is None
+
+    run(scenario)
+
+
+def test_album_with_caption_not_matched():
+    def scenario(engine):
+        engine.register_album(CHAT_ID, 777, head_row_id=1, head_message_id=5, has_text=True, until=until())
+        assert engine.match_text(CHAT_ID, 6) is None
+        assert engine.match_text(-100999, 6) is None
+
+    run(scenario)
+
+
+def test_matched_media_timer_cancelled():
+    def scenario(engine):
+        engine.register_media(CHAT_ID, 7, row_id=2, awaiting_until=until())
+        assert len(engine._wheel) == 1
+
+        engine.match_text(CHAT_ID, 8)
+        assert len(engine._wheel) == 0
+        assert engine._media == {}
+
+    run(scenario)
@@ -0,0 +1,43 @@
+"""Бюджет дублирующих запросов: жетоны копятся от запросов и не превышают burst"""
+import pytest
+
+from app.ai_router import HedgeBudget
+
+
+def test_starts_with_burst():
+    budget = HedgeBudget(ratio=0.5, burst=2)
+
+    assert budget.try_spend()
+    assert budget.try_spend()
+    assert not budget.try_spend()
+
+
+def test_requests_refill_budget():
+    budget = HedgeBudget(ratio=0.5, burst=2)
+    budget.tokens = 0
+
+    budget.on_request()
+    assert not budget.try_spend()
+    budget.on_request()
+    assert budget.try_spend()
+    assert budget.tokens == pytest.approx(0)
+
+
+def test_refill_capped_by_burst():
+    budget = HedgeBudget(ratio=0.5, burst=2)
+    for _ in range(100):
+        budget.on_request()
+
+    assert budget.tokens == 2
+    assert budget.try_spend() and budget.try_spend()
+    assert not budget.try_spend()
+
+
+def test_long_run_hedge_rate_bounded_by_ratio():
+    budget = HedgeBudget(ratio=0.1, burst=5)
+    hedges = 0
+    for _ in range(1000):
+        budget.on_request()
+        hedges += budget.try_spend()  # каждый запрос хочет дубль
+
+    assert hedges <= 0.1 * 1000 + 5
@@ -0,0 +1,29 @@
+"""IncomingItem: тип медиа как в исходном коллекторе"""
+from types import SimpleNamespace
+
+from app.services.incoming import IncomingItem
+
+
+def message(media=None, **kinds):
+    fields = dict(id=1, grouped_id=None, message='текст', date=None,
+                  photo=None, video=None, document=None, voice=None)
+    fields.update(kinds)
+    return SimpleNamespace(media=media, **fields)
+
+
+def test_unknown_media_is_other_but_not_glued_as_media():
+    item = IncomingItem.from_message(1, message(media=object()))
+    assert item.media_type == 'other'
+    assert not item.has_media
+
+
+def test_text_without_media():
+    item = IncomingItem.from_message(1, message())
+    assert item.media_type is None
+    assert not item.has_media
+
+
+def test_photo():
+    photo = SimpleNamespace(id=5, access_hash=6, file_reference=b'r')
+    item = IncomingItem.from_message(1, message(media=object(), photo=photo))
+    assert (item.media_type, item.media_file_id, item.has_media) == ('photo', 5, True)
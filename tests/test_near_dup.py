@@ -0,0 +1,158 @@
+"""
+Near-duplicate: повтор определяется по тексту и медиа, индекс общий для реплик
+
+Оригинал — более раннее сообщение; отпечатки, записанные другой репликой,
+подтягиваются перед поиском (NearDupIndex.sync).
+"""
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from app.services.near_dup import NearDupIndex, simhash
+
+CHAT_ID = -100123
+TEXT = "Новое поступление курток Softshell всех размеров, доставка по всей стране, есть в наличии"
+REPOST = "Новое поступление курток Softshell всех размеров!!! доставка по всей стране, есть в наличии 🔥"
+
+
+def test_simhash_close_for_repost():
+    index = NearDupIndex()
+    index.add(simhash(TEXT), 1)
+    assert index.find(simhash(REPOST), before_row=2)[0] == 1
+
+
+def test_find_ignores_later_rows():
+    index = NearDupIndex()
+    index.add(simhash(TEXT), 5)
+    assert index.find(simhash(REPOST), before_row=5) is None
+    assert index.find(simhash(REPOST), before_row=3) is None
+    assert index.find(simhash(REPOST), before_row=6) is not None
+
+
+def run(scenario):
+    """Пересоздаёт схему и выполняет сценарий в одном event loop"""
+    from app.database.engine import engine
+    from app.models import Base
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            await scenario()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def rewrites(monkeypatch):
+    """Подменяет LLM, отключает пакеты и даёт процессору пустой индекс"""
+    from app import ai
+    from app.services import processor
+
+    calls = []
+
+    async def fake_rewrite(value, max_retries=6, album=False):
+        calls.append(value)
+        return ai.RewriteResult(f"rewritten: {value}", 'test', 'test-model')
+
+    monkeypatch.setattr(ai, 'rewrite_text_async', fake_rewrite)
+    monkeypatch.setattr(processor, 'REWRITE_BATCH_SIZE', 1)
+    monkeypatch.setattr(processor, 'NEAR_DUP_MODE', 'skip')
+    monkeypatch.setattr(processor, 'near_dup_index', NearDupIndex())
+    return calls
+
+
+async def add_source():
+    from app.database.engine import SessionLocal
+    from app.models import Source
+
+    async with SessionLocal() as session:
+        session.add(Source(chat_id=CHAT_ID, title='test'))
+        await session.commit()
+
+
+async def add_photo(message_id: int, text: str, file_id: int) -> int:
+    from app.database.engine import SessionLocal
+    from app.models.message import MessageQueue
+
+    async with SessionLocal() as session:
+        row = MessageQueue(
+            source_id=CHAT_ID, message_id=message_id, original_text=text,
+            media_type='photo', media_file_id=file_id, media_access_hash=1,
+            media_file_reference=b'x'
+        )
+        session.add(row)
+        await session.commit()
+        return row.id
+
+
+async def process():
+    from app.database.engine import SessionLocal
+    from app.services.processor import MessageProcessor
+
+    async with SessionLocal() as session:
+        return await MessageProcessor(session).process_pending_rewrites()
+
+
+async def statuses():
+    from app.database.engine import SessionLocal
+    from app.models.message import MessageQueue
+
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(MessageQueue.id, MessageQueue.rewrite_status, MessageQueue.duplicate_of)
+            .order_by(MessageQueue.id)
+        )
+        return [tuple(row) for row in result]
+
+
+@pytest.mark.db
+def test_same_text_other_photo_is_published(rewrites):
+    async def scenario():
+        await add_source()
+        first = await add_photo(10, TEXT, file_id=111)
+        second = await add_photo(11, REPOST, file_id=222)
+
+        assert await process() == 2
+        assert await statuses() == [(first, 'done', None), (second, 'done', None)]
+        assert len(rewrites) == 2
+
+    run(scenario)
+
+
+@pytest.mark.db
+def test_same_text_same_photo_is_duplicate(rewrites):
+    async def scenario():
+        await add_source()
+        first = await add_photo(10, TEXT, file_id=111)
+        second = await add_photo(11, REPOST, file_id=111)
+
+        assert await process() == 2
+        assert await statuses() == [(first, 'done', None), (second, 'duplicate', first)]
+        assert rewrites == [TEXT]
+
+    run(scenario)
+
+
+@pytest.mark.db
+def test_fingerprint_from_other_replica(rewrites, monkeypatch):
+    from app.services import processor
+
+    async def scenario():
+        await add_source()
+        first = await add_photo(10, TEXT, file_id=111)
+        assert await process() == 1
+
+        # Другая реплика: её индекс в памяти пуст, оригинал известен только по БД
+        monkeypatch.setattr(processor, 'near_dup_index', NearDupIndex())
+        second = await add_photo(11, REPOST, file_id=111)
+        assert await process() == 1
+
+        assert await statuses() == [(first, 'done', None), (second, 'duplicate', first)]
+        assert rewrites == [TEXT]
+
+    run(scenario)
@@ -0,0 +1,174 @@
+"""
+Пакетный рерайт: ответ сопоставляется с постами только по id
+
+Пропущенный, чужой или повторный id, невалидный JSON — такие посты
+переписываются поодиночке; рерайт никогда не достаётся другому посту.
+"""
+import asyncio
+import json
+
+import pytest
+from sqlalchemy import select
+
+from app import ai
+from app.ai import _parse_batch
+
+CHAT_ID = -100123
+
+
+def reply(items) -> str:
+    return json.dumps(items, ensure_ascii=False)
+
+
+def test_parse_by_id_not_by_position():
+    raw = reply([{"id": 2, "text": "c"}, {"id": 0, "text": "a"}, {"id": 1, "text": "b"}])
+    assert _parse_batch(raw, 3) == ["a", "b", "c"]
+
+
+def test_parse_missing_id():
+    raw = reply([{"id": 0, "text": "a"}, {"id": 2, "text": "c"}])
+    assert _parse_batch(raw, 3) == ["a", None, "c"]
+
+
+def test_parse_extra_ids_ignored():
+    raw = reply([
+        {"id": 0, "text": "a"},
+        {"id": 3, "text": "лишний"},
+        {"id": -1, "text": "отрицательный"},
+        {"id": "1", "text": "строка вместо числа"},
+        {"id": True, "text": "bool вместо числа"},
+        {"text": "без id"},
+    ])
+    assert _parse_batch(raw, 2) == ["a", None]
+
+
+def test_parse_duplicate_id_dropped():
+    raw = reply([{"id": 0, "text": "a"}, {"id": 0, "text": "a2"}, {"id": 1, "text": "b"}])
+    assert _parse_batch(raw, 2) == [None, "b"]
+
+
+def test_parse_empty_text():
+    raw = reply([{"id": 0, "text": "  "}, {"id": 1, "text": None}])
+    assert _parse_batch(raw, 2) == [None, None]
+
+
+@pytest.mark.parametrize('raw', [
+    None,
+    "",
+    "Вот переписанные тексты: ...",
+    '[{"id": 0, "text": "a"}',
+    '{"id": 0, "text": "a"}',
+    '["a", "b"]',
+])
+def test_parse_invalid_json(raw):
+    assert _parse_batch(raw, 2) == [None, None]
+
+
+def test_parse_code_fence():
+    raw = '```json\n' + reply([{"id": 0, "text": "a"}, {"id": 1, "text": "b"}]) + '\n```'
+    assert _parse_batch(raw, 2) == ["a", "b"]
+    assert _parse_batch(raw.replace('```json', '```'), 2) == ["a", "b"]
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    """Один маршрут; ответ пакетного запроса строит answer(входные элементы) → raw"""
+    from app.ai_router import AiRouter, Route
+
+    state = {'answer': None, 'singles': []}
+
+    async def fake_call(route, text, prefix=ai.REWRITE_PREFIX, expected_tokens=None):
+        await ai.router.release(route)
+        return state['answer'](json.loads(text)), 100, 40
+
+    async def fake_rewrite(value, max_retries=6, album=False):
+        state['singles'].append(value)
+        return ai.RewriteResult(f"single: {value}", 'test', 'test-model')
+
+    monkeypatch.setattr(ai, 'router', AiRouter([Route('openrouter', 'key', 0, 'test-model')]))
+    monkeypatch.setattr(ai, '_call', fake_call)
+    monkeypatch.setattr(ai, 'rewrite_text_async', fake_rewrite)
+    return state
+
+
+def test_batch_partial_reply(llm):
+    llm['answer'] = lambda items: reply([
+        {"id": item["id"], "text": f"batch: {item['text']}"} for item in reversed(items) if item["id"] != 1
+    ])
+
+    results = asyncio.run(ai.rewrite_batch_async(["первый", "второй", "третий"]))
+
+    assert [r and r.text for r in results] == ["batch: первый", None, "batch: третий"]
+    assert results[0].provider == 'openrouter'
+
+
+def test_batch_invalid_reply_all_none(llm):
+    llm['answer'] = lambda items: "Не могу выполнить запрос"
+    assert asyncio.run(ai.rewrite_batch_async(["первый", "второй"])) == [None, None]
+
+
+def run(scenario):
+    """Пересоздаёт схему и выполняет сценарий в одном event loop"""
+    from app.database.engine import engine
+    from app.models import Base
+
+    async def main():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.drop_all)
+            await conn.run_sync(Base.metadata.create_all)
+        try:
+            await scenario()
+        finally:
+            await engine.dispose()
+
+    asyncio.run(main())
+
+
+@pytest.mark.db
+def test_invalid_items_fall_back_per_post(llm, monkeypatch):
+    from app.database.engine import SessionLocal
+    from app.models import Source
+    from app.models.message import MessageQueue
+    from app.services import processor
+    from app.services.processor import MessageProcessor
+
+    monkeypatch.setattr(processor, 'REWRITE_BATCH_SIZE', 4)
+    monkeypatch.setattr(processor, 'REWRITE_BATCH_MAX_CHARS', 1000)
+    monkeypatch.setattr(processor, 'NEAR_DUP_MODE', 'off')
+
+    texts = ["Берцы зимние", "Куртка Softshell", "Штаны G3", "Панама мультикам"]
+    # id 1 пропущен, id 2 повторён, id 7 лишний — рерайт есть только у постов 0 и 3
+    llm['answer'] = lambda items: reply([
+        {"id": 3, "text": f"batch: {items[3]['text']}"},
+        {"id": 2, "text": f"batch: {items[2]['text']}"},
+        {"id": 7, "text": "batch: чужой пост"},
+        {"id": 0, "text": f"batch: {items[0]['text']}"},
+        {"id": 2, "text": f"batch: {items[1]['text']}"},
+    ])
+
+    async def scenario():
+        async with SessionLocal() as session:
+            session.add(Source(chat_id=CHAT_ID, title='test'))
+            await session.commit()
+            for message_id, text in enumerate(texts, start=10):
+                session.add(MessageQueue(source_id=CHAT_ID, message_id=message_id, original_text=text))
+            await session.commit()
+
+        async with SessionLocal() as session:
+            assert await MessageProcessor(session).process_pending_rewrites() == 4
+
+        async with SessionLocal() as session:
+            rows = (await session.execute(
+                select(MessageQueue.original_text, MessageQueue.rewritten_text, MessageQueue.rewrite_status)
+                .order_by(MessageQueue.message_id)
+            )).all()
+
+        assert [tuple(row) for row in rows] == [
+            ("Берцы зимние", "batch: Берцы зимние", 'done'),
+            ("Куртка Softshell", "single: Куртка Softshell", 'done'),
+            ("Штаны G3", "single: Штаны G3", 'done'),
+            ("Панама мультикам", "batch: Панама мультикам", 'done'),
+        ]
+        assert sorted(llm['singles']) == ["Куртка Softshell", "Штаны G3"]
+
+    run(scenario)
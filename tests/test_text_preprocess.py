@@ -0,0 +1,66 @@
+"""Предобработка: вырезаются только суммы и контакты, короткие посты не пропускаются"""
+import pytest
+
+from app.text_preprocess import preprocess
+
+
+@pytest.mark.parametrize('text', [
+    "Прицел 3-9x40, 2024 года",
+    "Куртка Softshell, 48 размер",
+    "Берцы",
+])
+def test_short_product_post_not_skipped(text):
+    result = preprocess(text)
+    assert not result.skip
+    assert result.text == text
+
+
+def test_promo_word_at_line_start_keeps_line():
+    result = preprocess("Акция! Новое поступление: куртки Softshell, штаны G3, размеры 46-58")
+    assert not result.skip
+    assert result.text == "Акция! Новое поступление: куртки Softshell, штаны G3, размеры 46-58"
+
+
+def test_price_fragment_removed_line_kept():
+    result = preprocess("Скидка 20% на куртки Softshell\nЦена: 5 000 ₽\nКуртка G3 — 4500 руб")
+    assert not result.skip
+    assert result.text == "Скидка на куртки Softshell\n\nКуртка G3"
+
+
+def test_price_label_without_currency():
+    assert preprocess("Штаны G3, цена 3500, размеры 46-58").text == "Штаны G3, размеры 46-58"
+    assert preprocess("Цена договорная").text == "Цена договорная"
+
+
+def test_only_contacts_and_prices_skipped():
+    result = preprocess("Цена: 5000 руб\nДля заказа пишите @manager\n+7 900 123-45-67")
+    assert result.skip
+
+
+def test_price_label_and_contact_call_removed_together():
+    result = preprocess("Цена 5 000 руб. Пишите @shop_manager или +7 (900) 123-45-67")
+    assert result.text == ''
+    assert result.skip
+
+
+def test_contact_call_removed_inside_post():
+    result = preprocess("Куртка Softshell. Пишите @shop_manager или звоните +7 900 123 45 67. Доставка по РФ")
+    assert result.text == "Куртка Softshell. Доставка по РФ"
+
+
+def test_call_verb_with_content_kept():
+    assert preprocess("Пишите отзывы о куртке").text == "Пишите отзывы о куртке"
+
+
+@pytest.mark.parametrize('text', [
+    "Размеры: 8 800 555 35 35 см",
+    "Длина 8 900 123 45 67 мм",
+])
+def test_number_with_unit_is_not_phone(text):
+    result = preprocess(text)
+    assert result.text == text
+    assert not result.skip
+
+
+def test_phone_without_unit_removed():
+    assert preprocess("Берцы 45 размера 8 800 555 35 35").text == "Берцы 45 размера"
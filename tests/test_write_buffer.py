@@ -0,0 +1,69 @@
+"""Буфер записи коллектора не теряет строки при ошибке сброса"""
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from tests.test_album_gluing import CHAT_ID, add_source, run
+
+
+def test_failed_flush_retried_until_commit(monkeypatch):
+    from app import metrics
+    from app.services import write_buffer
+    from app.services.write_buffer import CollectorWriteBuffer
+
+    monkeypatch.setattr(write_buffer, 'COLLECTOR_BUFFER_RETRY_BACKOFF', 0.01)
+    buffer = CollectorWriteBuffer(max_delay_ms=1)
+    written, failures = [], []
+
+    async def flaky_write(batch):
+        if len(failures) < 5:  # БД недоступна дольше, чем _BATCH_ATTEMPTS попыток
+            failures.append(len(batch))
+            raise ConnectionError("connection refused")
+        written.extend(batch)
+        return len(batch)
+
+    monkeypatch.setattr(buffer, '_write', flaky_write)
+    lost = metrics.get('collector_buffer.lost_rows')
+
+    async def wait_written():
+        while len(written) < 2:
+            await asyncio.sleep(0.01)
+
+    async def scenario():
+        buffer.start()
+        await buffer.put('rewrite', source_id=1, message_id=1)
+        await buffer.put('rewrite', source_id=1, message_id=2)
+        await asyncio.wait_for(wait_written(), 5)
+        await buffer.close()
+
+    asyncio.run(scenario())
+
+    assert [values['message_id'] for _, values in written] == [1, 2]
+    assert metrics.get('collector_buffer.lost_rows') == lost
+
+
+@pytest.mark.db
+def test_rejected_row_does_not_drop_batch():
+    from app import metrics
+    from app.database.engine import SessionLocal
+    from app.models import MessageQueue
+    from app.services.write_buffer import CollectorWriteBuffer
+
+    lost = metrics.get('collector_buffer.lost_rows')
+
+    async def scenario():
+        await add_source()
+        buffer = CollectorWriteBuffer(max_delay_ms=50)
+        buffer.start()
+        await buffer.put('rewrite', source_id=CHAT_ID, message_id=1, original_text='a', rewrite_status='pending')
+        await buffer.put('rewrite', source_id=-1, message_id=2, original_text='b', rewrite_status='pending')  # нет источника
+        await buffer.put('rewrite', source_id=CHAT_ID, message_id=3, original_text='c', rewrite_status='pending')
+        await buffer.close()
+
+        async with SessionLocal() as session:
+            result = await session.execute(select(MessageQueue.message_id).order_by(MessageQueue.message_id))
+            assert result.scalars().all() == [1, 3]
+
+    run(scenario)
+    assert metrics.get('collector_buffer.lost_rows') == lost + 1